@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the cos and cos² fits with analytic Jacobian against the finite
+difference Jacobian estimated by scipy.
+
+Reports the number of model and Jacobian evaluations and the wall time per fit
+for a set of array lengths.
+
+Usage:
+    python benchmarks/benchFit.py [n_points ...]
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+import scipy.optimize as optimize
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import lib.transportdata as transdat
+
+
+def syntheticAdmr(n, squared = False, noise = 1e-3):
+    """
+    Angle (rad) and noisy cos (or cos²) signal with a period of 180 deg
+    """
+    rnd = np.random.RandomState(0)
+    x = np.linspace(0, 2*np.pi, n)
+    if squared:
+        y = 1.3 * np.cos(x + 0.4)**2 + 0.2
+    else:
+        y = 1.3 * np.cos(2*x + 0.4) + 0.2
+    return x, y + noise*rnd.randn(n)
+
+
+def countEvaluations(x, y, squared, jacobian):
+    """
+    Count model/Jacobian evaluations of one fit with fitY0 and the default guess
+    """
+    model = transdat._cosModel(x, squared = squared, fitY0 = True)
+    guess = [np.ptp(y)/2, 1. if squared else 2., 0., np.mean(y)]
+    if jacobian:
+        optimize.curve_fit(model, x, y, guess, jac = model.jacobian)
+    else:
+        optimize.curve_fit(model, x, y, guess)
+    return model.nfev, model.njev
+
+
+def bench(n, repeat = 5):
+    for squared, fit in ((False, transdat.fitcos), (True, transdat.fitcos_squared)):
+        x, y = syntheticAdmr(n, squared = squared)
+        for jacobian in (False, True):
+            nfev, njev = countEvaluations(x, y, squared, jacobian)
+            t = min(timeit.repeat(lambda: fit(x, y, fitY0 = True, jacobian = jacobian),
+                                  number = 1, repeat = repeat))
+            print("%-14s n=%-9d jacobian=%-13s nfev=%-4d njev=%-4d %9.2f ms"%(
+                fit.__name__, n, "analytic" if jacobian else "finite diff.",
+                nfev, njev, t*1e3))
+
+
+if __name__ == "__main__":
+    lengths = [int(arg) for arg in sys.argv[1:]] or [1000, 100000, 1000000]
+    for n in lengths:
+        bench(n)
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end performance regression harness.
+
+Builds a synthetic ADMR measurement (delta method, up and down sweep at
+several fields) as TDMS file with nptdms and times the whole workflow:
+
+    open -> group/channel discovery -> preprocessTransportData ->
+    segment lookup -> DataObject pipeline -> fit -> export
+
+Wall time and peak memory of each stage are appended to a JSON history file
+(local to the machine, not versioned). The peak memory is traced with
+tracemalloc where available (python 3), otherwise it is the maximum resident
+set size of the process after the stage (resource.getrusage, which can't be
+reset per stage); only peaks of the same kind are compared. checkBuffers()
+makes sure the pipeline reuses its intermediate buffers across segments.
+
+The run is compared against the baseline file given with --baseline (e.g. one
+recorded on the reference machine and kept with the sources) and fails (exit
+status 1) if a stage is slower or uses more memory than the baseline by more
+than the given threshold. --set-baseline stores the run as this baseline.
+
+Usage:
+    python benchmarks/benchPipeline.py [--fields N] [--angles N] [--history FILE]
+                                       [--baseline FILE [--set-baseline]]
+                                       [--threshold 0.2] [--label TEXT]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import lib.transportdata as transdat
+from lib.DataObject import DataObject
+from lib.operations import Buffers, OperationSpec, execute
+from lib.tdmsindex import openTdmsIndex
+from lib.segments import TransportQuery
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+GROUP = "Read.K2400_long_oopj"
+FIELD = "IPS.TargetField"
+ANGLE = "owis.Angle (deg)"
+VOLTAGE = "K2400U"
+
+HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipelineHistory.json")
+
+
+def writeSyntheticTdms(filename, nFields, nAngles):
+    """
+    Write an ADMR measurement recorded with the delta method: for each field
+    an up and a down sweep of nAngles angles, each angle measured at +I and -I
+    """
+    from nptdms import TdmsWriter, ChannelObject
+
+    rnd = np.random.RandomState(0)
+    angles = np.linspace(0, 360, nAngles)
+    sweep = np.repeat(np.concatenate((angles, angles[::-1])), 2)
+    fields = np.linspace(0.5, 7, nFields)
+
+    field = np.repeat(fields, np.size(sweep))
+    angle = np.tile(sweep, nFields)
+    polarity = np.tile([1., -1.], np.size(angle)//2)
+    signal = (1e-3 + 1e-5*np.outer(fields, np.ones_like(sweep)).ravel()*np.cos(2*np.deg2rad(angle)))
+    voltage = polarity*signal + 1e-6 + 1e-8*rnd.randn(np.size(angle))
+
+    with TdmsWriter(filename) as writer:
+        writer.write_segment([ChannelObject(GROUP, FIELD, field),
+                              ChannelObject(GROUP, ANGLE, angle),
+                              ChannelObject(GROUP, VOLTAGE, voltage)])
+
+
+def peakMemory():
+    """
+    (peak memory in bytes, kind of peak): traced by tracemalloc since it was
+    (re)started, or the maximum resident set size of the process
+    """
+    if tracemalloc:
+        return tracemalloc.get_traced_memory()[1], "tracemalloc"
+    if resource:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kiB on Linux, bytes on macOS
+        return maxrss*(1 if sys.platform == "darwin" else 1024), "maxrss"
+    return None, None
+
+
+def measure(stage, results, func, *args):
+    """
+    Run func(*args), store wall time and peak memory in results[stage]
+    """
+    if tracemalloc:
+        tracemalloc.stop()
+        tracemalloc.start()
+    start = time.time()
+    value = func(*args)
+    duration = time.time() - start
+    peak, peakKind = peakMemory()
+    results[stage] = {"time": duration, "peak": peak, "peakKind": peakKind}
+    print("%-12s %9.3f s %s"%(stage, duration, "%10.1f MiB"%(peak/2.**20) if peak is not None else ""))
+    return value
+
+
+def runPipeline(filename, exportDir):
+    results = {}
+
+    index = measure("open", results, lambda: openTdmsIndex(filename, useNpyCache = False, useSidecar = False))
+
+    def discover():
+        return dict((group, index.channelNames(group)) for group in index.groupNames("Read."))
+    measure("discovery", results, discover)
+
+    def preprocess():
+        return transdat.preprocessTransportData(index.channelData(GROUP, FIELD),
+                                                index.channelData(GROUP, ANGLE),
+                                                index.channelData(GROUP, VOLTAGE))
+    measure("preprocess", results, preprocess)
+
+    query = TransportQuery([index])
+    def segments():
+        nSegments = len(query.segmentIndex(filename, GROUP, FIELD))
+        return [query.segment(filename, GROUP, ANGLE, VOLTAGE, FIELD, number = n) for n in range(nSegments)]
+    data = measure("segments", results, segments)
+
+    def pipeline():
+        dataObjects = []
+        buffers = Buffers()
+        for x, y in data:
+            dataObject = DataObject(x, y, path = filename, group = GROUP, xChannel = ANGLE, yChannel = VOLTAGE)
+            dataObject.deltaMethod(3)
+            dataObject.averageUpDown()
+            dataObject.symmetrize(2, symm_step = 180)
+            dataObject.offsetCorrection(3)
+            dataObject.processData(buffers)
+            dataObjects.append(dataObject)
+        return dataObjects
+    dataObjects = measure("pipeline", results, pipeline)
+    checkBuffers(data)
+
+    def fit():
+        return [transdat.fitcos(np.deg2rad(d.xCalc), d.yCalc, fitY0 = True) for d in dataObjects]
+    measure("fit", results, fit)
+
+    def export():
+        for n, dataObject in enumerate(dataObjects):
+            dataObject.saveASCII(os.path.join(exportDir, "%d.dat"%n))
+    measure("export", results, export)
+    return results
+
+
+def checkBuffers(segments):
+    """
+    Check that the delta method -> average -> symmetrize chain writes its
+    intermediate results to buffers that are allocated for the first
+    segment only and reused for the others, and that the results match
+    those of an unbuffered run and don't share memory with the buffers.
+    """
+    specs = [OperationSpec("deltaMethod", method = 3),
+             OperationSpec("averageUpDown"),
+             OperationSpec("symmetrize", method = 2, symm_step = 180),
+             OperationSpec("offsetCorrection", method = 3)]
+    buffers = Buffers()
+    results = []
+    for n, (x, y) in enumerate(segments):
+        results.append(execute(specs, x, y, buffers = buffers))
+        if n == 0:
+            allocations = buffers.allocations
+    if not allocations or buffers.allocations != allocations:
+        raise Exception("Buffers were allocated %d times for %d segments, expected %d"%(
+            buffers.allocations, len(segments), allocations))
+    for (x, y), (xCalc, yCalc) in zip(segments, results):
+        expected = execute(specs, x, y)
+        if not (np.array_equal(xCalc, expected[0]) and np.array_equal(yCalc, expected[1])):
+            raise Exception("Buffered pipeline result differs from the unbuffered one")
+        if any(np.may_share_memory(value, buffer) for value in (xCalc, yCalc) for buffer in buffers.arrays.values()):
+            raise Exception("Pipeline result shares memory with a buffer")
+    print("%-12s %d buffers (%.1f MiB) reused for %d segments"%(
+        "buffers", len(buffers.arrays), buffers.memoryUsage()/2.**20, len(segments)))
+
+
+def compare(results, baseline, threshold):
+    """
+    Stages of results that regressed by more than threshold against baseline
+    """
+    regressions = []
+    for stage, values in results.items():
+        if stage not in baseline:
+            continue
+        for key in ("time", "peak"):
+            if key == "peak" and baseline[stage].get("peakKind") != values.get("peakKind"):
+                continue
+            old, new = baseline[stage].get(key), values.get(key)
+            if old and new is not None and new > old*(1 + threshold):
+                regressions.append("%s %s: %.4g -> %.4g (+%.0f%%)"%(stage, key, old, new, 100.*(new/old - 1)))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.split("\n\n")[0])
+    parser.add_argument("--fields", type = int, default = 20, help = "number of fields")
+    parser.add_argument("--angles", type = int, default = 361, help = "angles per sweep")
+    parser.add_argument("--repeat", type = int, default = 3, help = "runs, the fastest one is recorded")
+    parser.add_argument("--history", default = HISTORY, help = "JSON history file")
+    parser.add_argument("--baseline", help = "JSON baseline file to compare against")
+    parser.add_argument("--threshold", type = float, default = 0.2, help = "allowed relative regression")
+    parser.add_argument("--set-baseline", action = "store_true", help = "store this run as the baseline (--baseline)")
+    parser.add_argument("--label", default = "", help = "label of this run in the history")
+    args = parser.parse_args()
+    if args.set_baseline and not args.baseline:
+        parser.error("--set-baseline needs the baseline file (--baseline)")
+
+    workDir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(workDir, "synthetic-admr.tdms")
+        writeSyntheticTdms(filename, args.fields, args.angles)
+        runs = []
+        for i in range(args.repeat):
+            runs.append(runPipeline(filename, workDir))
+    finally:
+        shutil.rmtree(workDir)
+
+    # fastest time of each stage over the repetitions, largest peak memory
+    results = {}
+    for stage in runs[0]:
+        peaks = [run[stage]["peak"] for run in runs if run[stage]["peak"] is not None]
+        results[stage] = {"time": min(run[stage]["time"] for run in runs),
+                          "peak": max(peaks) if peaks else None,
+                          "peakKind": runs[0][stage]["peakKind"]}
+
+    history = {"runs": []}
+    if os.path.exists(args.history):
+        with open(args.history) as f:
+            history = json.load(f)
+    params = {"fields": args.fields, "angles": args.angles}
+    history["runs"].append({"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                            "label": args.label,
+                            "params": params,
+                            "stages": results})
+
+    with open(args.history, "w") as f:
+        json.dump(history, f, indent = 1)
+
+    regressions = []
+    if args.set_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"params": params, "stages": results}, f, indent = 1, sort_keys = True)
+        print("Stored run as baseline %s"%args.baseline)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["params"] != params:
+            print("Baseline was recorded with %s, not comparing"%baseline["params"])
+        else:
+            regressions = compare(results, baseline["stages"], args.threshold)
+    else:
+        print("No baseline given (--baseline), not comparing")
+
+    for regression in regressions:
+        print("REGRESSION %s"%regression)
+    sys.exit(1 if regressions else 0)
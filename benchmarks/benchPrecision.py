@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy and cost of processing in float32 compared to float64.
+
+Processes a synthetic ADMR segment (delta method, up and down sweep) with a
+typical pipeline in both precisions and prints the processing time, the
+memory of the segment data and the accuracy report of lib.precision (errors
+of the processed data and of the cos fit parameters against float64).
+
+Usage:
+    python benchmarks/benchPrecision.py [--angles N] [--repeat N]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import lib.precision as precision
+from lib.operations import OperationSpec, execute
+
+PIPELINE = [OperationSpec("deltaMethod", method = 3),
+            OperationSpec("averageUpDown"),
+            OperationSpec("smooth", method = 1, window = 5),
+            OperationSpec("offsetCorrection", method = 3)]
+
+
+def syntheticSegment(nAngles):
+    """
+    One field of an ADMR measurement recorded with the delta method
+    """
+    rnd = np.random.RandomState(0)
+    angles = np.linspace(0, 360, nAngles)
+    angle = np.repeat(np.concatenate((angles, angles[::-1])), 2)
+    polarity = np.tile([1., -1.], np.size(angle)//2)
+    signal = 1e-3 + 1e-5*np.cos(2*np.deg2rad(angle))
+    voltage = polarity*signal + 1e-6 + 1e-8*rnd.randn(np.size(angle))
+    return angle, voltage
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.split("\n\n")[0])
+    parser.add_argument("--angles", type = int, default = 100001, help = "angles per sweep")
+    parser.add_argument("--repeat", type = int, default = 5, help = "runs, the fastest one is reported")
+    args = parser.parse_args()
+
+    x, y = syntheticSegment(args.angles)
+    for name in ("float64", "float32"):
+        precision.setPrecision(name)
+        xSeg, ySeg = precision.asFloat(x), precision.asFloat(y)
+        times = []
+        for i in range(args.repeat):
+            start = time.time()
+            execute(PIPELINE, xSeg, ySeg)
+            times.append(time.time() - start)
+        print("%s: %8.2f ms, segment data %6.1f MiB"%(name, 1e3*min(times), (xSeg.nbytes + ySeg.nbytes)/2.**20))
+
+    print("")
+    print(precision.formatReport(precision.accuracyReport(PIPELINE, x, y)))
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the startup time of the processing library and of the GUI and check
+them against a time budget.
+
+Each measurement runs in a fresh interpreter. Importing lib must neither pull
+in scipy nor any Qt binding (they are imported on first use).
+
+Usage:
+    python benchmarks/benchStartup.py [--lib-budget SECONDS] [--gui-budget SECONDS] [--no-gui]
+
+Exits with status 1 if a budget is exceeded or lib imports Qt/scipy.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+LIB_BUDGET = 0.5 # s, import lib.transportdata and lib.DataObject
+GUI_BUDGET = 3.0 # s, previewTransportData() until the window is shown
+
+LIB_SCRIPT = """
+import sys, time
+start = time.time()
+import lib.transportdata
+import lib.DataObject
+duration = time.time() - start
+heavy = [m for m in ("scipy", "PyQt4", "guiqwt", "guidata", "nptdms") if m in sys.modules]
+print("%f %s" % (duration, ",".join(heavy)))
+"""
+
+GUI_SCRIPT = """
+import time
+start = time.time()
+import guidata
+from PyQt4.QtCore import QTimer
+app = guidata.qapplication()
+# quits the event loop as soon as previewTransportData() has shown its window
+QTimer.singleShot(0, app.quit)
+from previewTransportData import previewTransportData
+previewTransportData()
+print("%f" % (time.time() - start))
+"""
+
+
+def run(script, repeat):
+    """
+    Run script repeat times in a fresh interpreter, return the fastest output
+    """
+    outputs = []
+    for i in range(repeat):
+        output = subprocess.check_output([sys.executable, "-c", script], cwd = ROOT)
+        outputs.append(output.decode().strip().split(" "))
+    return min(outputs, key = lambda o: float(o[0]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.split("\n\n")[0])
+    parser.add_argument("--lib-budget", type = float, default = LIB_BUDGET)
+    parser.add_argument("--gui-budget", type = float, default = GUI_BUDGET)
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--no-gui", action = "store_true", help = "skip the GUI measurement")
+    args = parser.parse_args()
+
+    failed = False
+    result = run(LIB_SCRIPT, args.repeat)
+    duration, heavy = float(result[0]), result[1:]
+    print("import lib:             %6.3f s (budget %.3f s)"%(duration, args.lib_budget))
+    if duration > args.lib_budget:
+        failed = True
+        print("  -> over budget")
+    if heavy and heavy[0]:
+        failed = True
+        print("  -> importing lib pulled in %s"%heavy[0])
+
+    if not args.no_gui:
+        duration = float(run(GUI_SCRIPT, args.repeat)[0])
+        print("previewTransportData(): %6.3f s (budget %.3f s)"%(duration, args.gui_budget))
+        if duration > args.gui_budget:
+            failed = True
+            print("  -> over budget")
+
+    sys.exit(1 if failed else 0)
@@ -3,13 +3,36 @@
 Created on Wed Jul 23 10:32:51 2014
 
 """
-import transportdata as transdat
+import mmap
+import os
+import tempfile
+from collections import OrderedDict
+
 import numpy as np 
+from operations import OperationSpec, execute
 
 import logging
-logging.basicConfig()
-l = logging.getLogger(__name__)
-l.setLevel(logging.DEBUG)
+l = logging.getLogger(__name__) # level is configured in lib/__init__.py
+
+def baseArray(value):
+    """
+    The array that owns the data of value (value itself if it is no view)
+    """
+    while isinstance(value.base, np.ndarray):
+        value = value.base
+    return value
+
+
+def isMemoryMapped(value):
+    """
+    Whether an array (or the array it is a view of) is memory-mapped
+    """
+    while isinstance(value, np.ndarray):
+        if isinstance(value, np.memmap):
+            return True
+        value = value.base
+    return isinstance(value, mmap.mmap)
+
 
 class DataObject():
     """
@@ -37,13 +60,19 @@ class DataObject():
         recalculated x-channel data (raw data until first process data was run)
     self.yCalc : np.array
         recalculated y-channel data (raw data until first process data was run)
+    self.operations : list of lib.operations.OperationSpec
+        queued operations (the pipeline run by processData())
+    self.stats : dict
+        min, max and mean of y if known (e.g. from the sidecar index), used
+        by normalization and offset correction of unprocessed data
      
     """    
-    def __init__(self,x,y, label = None, path = None, group = None, paramChannel = None, param = None, xChannel = None, yChannel = None):
+    def __init__(self,x,y, label = None, path = None, group = None, paramChannel = None, param = None, xChannel = None, yChannel = None, stats = None):
         self.x = x
         self.y = y
-        self.xCalc = np.array(x)
-        self.yCalc = np.array(y)
+        self.stats = stats
+        self.xCalc = np.asarray(x)
+        self.yCalc = np.asarray(y)
         self.label = label
 
         self.path = unicode(path)
@@ -53,9 +82,9 @@ class DataObject():
         self.xChannel = xChannel
         self.yChannel = yChannel
         
-        self.operations = []
-        self.operationParameters = []
+        self.operations = [] # queued lib.operations.OperationSpec
         self.isUpDownData = True # whether the currently calculated data consists of an up and down sweep
+        self.spillFiles = [] # .npy files the data has been spilled to (see release())
 
     def __str__(self):
         return """Data Object "%s" for data in file '%s'
@@ -65,41 +94,6 @@ class DataObject():
     yChannel: '%s' (%d long)
     #Operations: %d"""%(self.label, self.path, self.group, self.paramChannel, self.param, self.xChannel, len(self.x), self.yChannel, len(self.y), len(self.operations))        
         
-    def _deltaMethod(self, method):
-        """
-        method : int(0-4)
-            0: no delta method [n] (default)
-            1: uneven indexed raw data [2n-1]
-            2: even indexed raw data [2n]
-            3: difference ([2n-1]-[2n])/2
-            4: sum ([2n-1]+[2n])/2
-        """
-        x = self.xCalc
-        y = self.yCalc
-        
-        if method == 0:
-            # plain raw data
-            pass
-        elif method == 1:
-            # odd raw data values
-            x = transdat.separateAlternatingSignal(x)[0]
-            y = transdat.separateAlternatingSignal(y)[0]
-        elif method == 2:
-            # even raw data values
-            x = transdat.separateAlternatingSignal(x)[1]
-            y = transdat.separateAlternatingSignal(y)[1]
-        elif method == 3:
-            # difference of odd - even values
-            x = transdat.separateAlternatingSignal(x)[0]
-            y = transdat.separateAlternatingSignal(y)[0] -  transdat.separateAlternatingSignal(y)[1]
-        elif method == 4:
-            # difference of odd - even values
-            x = transdat.separateAlternatingSignal(x)[0]
-            y = transdat.separateAlternatingSignal(y)[0] +  transdat.separateAlternatingSignal(y)[1]
-
-        self.xCalc = x
-        self.yCalc = y
-        
     def deltaMethod(self, method):
         """
         Queue delta method processing.
@@ -114,45 +108,37 @@ class DataObject():
             4: sum ([2n-1]+[2n])/2
         """
         if method:
-            self.operations.append(self._deltaMethod)
-            self.operationParameters.append({'method': method})
+            self.operations.append(OperationSpec("deltaMethod", method = method))
 
 
-    def _averageUpDown(self):
-        """
-        Average up and down sweep
-        
-        and mark data as being averaged (for e.g. symmetrization)
-        """
-        if not self.isUpDownData:
-            raise Exception("Averaging up-down-sweep only makes sense if there's an up- and down-sweep. The function can only be called once.")
-        self.xCalc = transdat.averageUpDownSweep(self.xCalc)
-        self.yCalc = transdat.averageUpDownSweep(self.yCalc)                    
-        self.isUpDownData = False
-        
-    def averageUpDown(self):
+    def averageUpDown(self, tolerance = None):
         """
         Queue averaging an up and down sweep (queue this only once)
+        
+        Parameters
+        ----------
+        tolerance : float
+            noise of the x-data that doesn't count as a turning point
+            (derived from the x-data if omitted)
         """
-        self.operations.append(self._averageUpDown)
-        self.operationParameters.append({}) # add empty to maintain index sync
-                                            # w/ self.operations
+        self.operations.append(OperationSpec("averageUpDown", tolerance = tolerance))
 
-    def _normalize(self, method):
+    def averageSweeps(self, nRepetitions = None, alternating = True, tolerance = None):
         """
-        method : int(0-2)
-            0: no normalization (default)
-            1: normalize y to min(y)
-            2: normalize y to max(y)
+        Queue averaging repeated sweeps (queue this only once)
+        
+        Parameters
+        ----------
+        nRepetitions : int
+            number of sweeps, detected from the x-data if omitted
+        alternating : bool
+            sweeps alternate in direction (up, down, up, ...) (default: True)
+        tolerance : float
+            noise of the x-data that doesn't count as a turning point
+            (derived from the x-data if omitted)
         """
-        if 0 == method:
-            pass
-        elif 1 == method:
-            # normalize by min(y)
-            self.yCalc = self.yCalc/np.min(self.yCalc)
-        elif 2 == method:
-            # normalize by max(y)
-            self.yCalc = self.yCalc/np.max(self.yCalc)
+        self.operations.append(OperationSpec("averageSweeps", nRepetitions = nRepetitions, alternating = alternating,
+                                             tolerance = tolerance))
 
     def normalize(self, method):
         """
@@ -166,67 +152,43 @@ class DataObject():
             2: normalize y to max(y)
         """
         if method:
-            self.operations.append(self._normalize)
-            self.operationParameters.append({'method': method})
+            self.operations.append(OperationSpec("normalize", method = method))
 
 
-    def _symmetrize(self, method, symm_step = None, symm_center = None):
+    def smooth(self, method, window, order = 3):
         """
+        Queue smoothing the y-data
+        
+        Parameters
+        ----------
         method : int(0-2)
-            0: no symmetrization (default)
-            1: symmetrization
-            2: antisymmetrization
+            0: no smoothing (default)
+            1: moving average over window points
+            2: Savitzky-Golay filter of order order over window points
+        window : int
+            number of points of the smoothing window
+        order : int
+            order of the polynomial for Savitzky-Golay (default: 3)
         """
-        if ((not symm_step == None and not symm_center == None)
-            or (symm_step == None and symm_center == None)):
-                raise Exception("Provide either a center of symmetry (symm_center) or a symmetry step (symm_step).")
-            
-        x = self.xCalc
-        y = self.yCalc
-        if method and symm_step != None and self.isUpDownData:
-            #admr data        
-            # only regard one half of the data for finding the period
-            stepIdx = int(np.abs((np.abs(x[0:int(len(x))+1/2]-0)).argmin() 
-                       - (np.abs(x[0:int(len(x)/2+1)]-symm_step)).argmin()))
-            stepWidth = (x[(np.abs(x[0:int(len(x)/2+1)]-0)).argmin()] 
-                        - x[np.abs(x[1:int(len(x)/2+1)]-symm_step).argmin()+1])
-            l.debug("(Anti-)Symmetrizing admr data with period %d (val:%f)"%(stepIdx,np.abs(stepWidth)))
-            
-            if 1 == method: # symmetrize
-                y = transdat.symmetrizeSignalUpDown(y,stepIdx)
-                x = x[0:len(y)]
-            elif 2 == method: #antisymmetrize
-                y = transdat.antiSymmetrizeSignalUpDown(y,stepIdx)
-                x = x[0:len(y)]
-        elif method and  symm_step != None and not self.isUpDownData:
-            #admr data where up and down sweep are already averaged
-            stepIdx = int(np.abs((np.abs(x-0)).argmin() 
-                       - (np.abs(x-symm_step)).argmin()))
-            stepWidth = (x[(np.abs(x-0)).argmin()] 
-                        - x[np.abs(x-symm_step).argmin()+1])
-            l.debug("(Anti-)Symmetrizing admr data with period %d (val:%f)"%(stepIdx,np.abs(stepWidth)))
-            
-            if 1 == method: # symmetrize
-                y = transdat.symmetrizeSignal(y,stepIdx)
-                x = x[0:len(y)]
-            elif 2 == method: #antisymmetrize
-                y = transdat.antiSymmetrizeSignal(y,stepIdx)
-                x = x[0:len(y)]
-        elif method and symm_center != None:
-            centerIdx = (np.abs(x-symm_center)).argmin()
-            l.debug("(Anti-)Symmetrizing data of len %d around index %d (val: %f)"%(len(x),centerIdx, x[centerIdx]))
-            # R(H) data
-            if 1 == method: # symmetrize
-                y = transdat.symmetrizeSignalZero(y,centerIdx)
-                x = x[0:len(y)][::-1]
-            elif 2 == method: # symmetrize
-                y = transdat.antiSymmetrizeSignalZero(y,centerIdx)
-                x = x[0:len(y)][::-1]
+        if method:
+            self.operations.append(OperationSpec("smooth", method = method, window = window, order = order))
+
+    def rejectOutliers(self, window, threshold = 3.5):
+        """
+        Queue replacing outliers, i.e. points deviating from the rolling median
+        by more than threshold times the rolling median absolute deviation, by
+        the rolling median
         
-        self.xCalc = x
-        self.yCalc = y
+        Parameters
+        ----------
+        window : int
+            number of points of the rolling median
+        threshold : float
+            allowed deviation in units of the (scaled) MAD (default: 3.5)
+        """
+        self.operations.append(OperationSpec("rejectOutliers", window = window, threshold = threshold))
 
-    def symmetrize(self, method, symm_step = None, symm_center = None):
+    def symmetrize(self, method, symm_step = None, symm_center = None, tolerance = None):
         """
         Queue symmetrizing data see doc/symmetrizing for conventions and algorithm (FIXME)
         
@@ -236,41 +198,19 @@ class DataObject():
             0: no symmetrization (default)
             1: symmetrization
             2: antisymmetrization
+        tolerance : float
+            noise of the x-data that doesn't count as a turning point of
+            up-down data (derived from the x-data if omitted)
         """
         if method:
             if ((not symm_step == None and not symm_center == None)
                 or (symm_step == None and symm_center == None)):
                     raise Exception("Provide either a center of symmetry (symm_center) or a symmetry step (symm_step).")
             
-            self.operations.append(self._symmetrize)
-            self.operationParameters.append({'method': method, 'symm_step': symm_step, 'symm_center': symm_center})
+            self.operations.append(OperationSpec("symmetrize", method = method, symm_step = symm_step, symm_center = symm_center,
+                                                 tolerance = tolerance))
 
         
-    def _offsetCorrection(self, method, offset = None):
-        """
-        switchOffset : int(0-4)
-            0   -> no offset correction (default)
-            1   -> subtracts min(y)
-            2   -> subtracts max(y)
-            3   -> subtracts mean(y)
-            4   -> subtracts value defined in valueOffset
-        offset : double 
-            custom value to subtract from the data (if switchOffset = 4) (default = None)
-        """
-        if 0 == method:
-            pass
-        elif 1 == method:
-            # subtract min(y)
-            offset = np.min(self.yCalc)
-        elif 2 == method:
-            # subtract max(y)
-            offset = np.max(self.yCalc)
-        elif 3 == method:
-            # subtract mean(y)
-            offset = np.mean(self.yCalc)
-
-        self.yCalc = self.yCalc-offset
-
     def offsetCorrection(self, method, offset = None):
         """
         Queue substracting the offset
@@ -287,14 +227,19 @@ class DataObject():
             custom value to subtract from the data (if switchOffset = 4) (default = None)
         """
         if method:
-            self.operations.append(self._offsetCorrection)
-            self.operationParameters.append({'method': method, 'offset': offset})
+            self.operations.append(OperationSpec("offsetCorrection", method = method, offset = offset))
         
         
-    def processData(self):
+    def processData(self, buffers = None):
         """
         Apply queued operations
         
+        Parameters
+        ----------
+        buffers : operations.Buffers (optional)
+            buffers for the intermediate results, e.g. shared by the data
+            objects of all segments of a measurement
+        
         Returns
         ----------
         xCalc : np.ndarray()
@@ -303,21 +248,120 @@ class DataObject():
         yCalc : np.ndarray()
             y-channel of the processed data
         """
-        self.xCalc = np.array(self.x)
-        self.yCalc = np.array(self.y)        
+        # operations never modify their input in place, so the raw data
+        # doesn't need to be copied
+        self.xCalc = np.asarray(self.x)
+        self.yCalc = np.asarray(self.y)
+        self.isUpDownData = True
         
-        for idx, operation in enumerate(self.operations):
-            operation(**self.operationParameters[idx])
-            
-        return self.xCalc, self.yCalc
+        return execute(self.operations, data = self, buffers = buffers)
+
+    @property
+    def operationParameters(self):
+        """
+        Parameters of each queued operation (in sync with self.operations)
+        """
+        return [operation.parameters for operation in self.operations]
+
+    def setOperations(self, operations):
+        """
+        Replace the queued operations, e.g. to replay the pipeline of another
+        DataObject on this data
         
+        Parameters
+        ----------
+        operations : list of OperationSpec
+        """
+        self.operations = list(operations)
+        
+    def copy(self, label = None):
+        """
+        New data object of the same raw data and meta data (without queued
+        operations), e.g. for another branch of processing
+
+        Parameters
+        ----------
+        label : str (optional)
+            label of the copy (default: the label of this object)
+        """
+        return DataObject(self.x, self.y,
+                          label = self.label if label is None else label,
+                          path = self.path,
+                          group = self.group,
+                          paramChannel = self.paramChannel,
+                          param = self.param,
+                          xChannel = self.xChannel,
+                          yChannel = self.yChannel,
+                          stats = self.stats)
+
     def operationsToString(self):
         opString = ""
-        for idx, operation in enumerate(self.operations):
-            opString += str(operation.__name__) + ":\n"
-            opString += "   %s"%(self.operationParameters[idx])
+        for operation in self.operations:
+            opString += operation.name + ":\n"
+            opString += "   %s"%(operation.parameters)
         return opString
             
+    def _arrays(self):
+        """
+        Data arrays held in memory by the object by member name (arrays
+        shared by several members, e.g. unprocessed xCalc and x, are listed
+        once): arrays owning their data and views of them. Views of data
+        owned elsewhere (e.g. of the channel data, see
+        segments.TransportQuery) and memory-mapped data are not listed,
+        releasing them wouldn't free anything.
+
+        Returns
+        ----------
+        arrays : list of (array, member names, owns data)
+        """
+        members = OrderedDict() # id -> (array, member names)
+        for name in ("x", "y", "xCalc", "yCalc"):
+            value = getattr(self, name)
+            if isinstance(value, np.ndarray) and not isMemoryMapped(value):
+                members.setdefault(id(value), (value, []))[1].append(name)
+        owners = set(key for key, (value, names) in members.items() if value.flags.owndata)
+        return [(value, names, key in owners) for key, (value, names) in members.items()
+                if key in owners or id(baseArray(value)) in owners]
+
+    def memoryUsage(self):
+        """
+        Bytes of the data arrays owned by the object and held in memory
+        (memory-mapped data, e.g. spilled by release(), and views of data
+        owned elsewhere are not counted)
+        """
+        return sum(value.nbytes for value, names, owned in self._arrays() if owned)
+
+    def release(self, spillDirectory):
+        """
+        Spill the data arrays to .npy files in spillDirectory and memory-map
+        them (see memory.py), they are read from disk again when accessed.
+        Operations never modify data in place, so read-only maps suffice.
+        Views of the spilled arrays are spilled as well, so the arrays are
+        actually freed.
+        """
+        for value, names, owned in self._arrays():
+            if value.dtype.hasobject:
+                continue
+            handle, path = tempfile.mkstemp(suffix = ".npy", dir = spillDirectory)
+            os.close(handle)
+            np.save(path, value)
+            self.spillFiles.append(path)
+            mapped = np.load(path, mmap_mode = "r")
+            for name in names:
+                setattr(self, name, mapped)
+
+    def discardSpill(self):
+        """
+        Delete the files the data has been spilled to (once the object is not
+        used anymore)
+        """
+        for path in self.spillFiles:
+            try:
+                os.remove(path)
+            except OSError as e:
+                l.debug("Could not delete %s: %s", path, e) # still mapped (Windows)
+        self.spillFiles = []
+
     def saveASCII(self, fname):
         header = str(self) + self.operationsToString()
         np.savetxt(fname, np.transpose((self.xCalc, self.yCalc)), header = header)
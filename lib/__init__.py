@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Processing library of previewTransportData.
+
+The log level of all modules in lib is set with setLogLevel() or by the
+environment variable PREVIEWTRANSPORTDATA_LOGLEVEL (default: WARNING).
+The processing precision (float64 or float32) is set with
+precision.setPrecision() or by the environment variable
+PREVIEWTRANSPORTDATA_PRECISION (default: float64).
+The memory budget of the GUI session (see memory.py) is set by the
+environment variable PREVIEWTRANSPORTDATA_MEMORY_MB (default: 2048).
+"""
+import os
+import logging
+
+l = logging.getLogger(__name__)
+l.addHandler(logging.NullHandler())
+
+
+def setLogLevel(level):
+    """
+    Set the log level of all modules in lib
+
+    Parameters
+    ----------
+    level : int or str
+        logging level, e.g. logging.DEBUG, "DEBUG" or "10". Invalid levels
+        fall back to WARNING.
+    """
+    if not isinstance(level, int):
+        level = str(level).strip().upper()
+        if level.isdigit():
+            level = int(level)
+        elif not isinstance(logging.getLevelName(level), int):
+            l.setLevel(logging.WARNING)
+            l.warn("Invalid log level %r, using WARNING", level)
+            return
+    l.setLevel(level)
+
+
+setLogLevel(os.environ.get("PREVIEWTRANSPORTDATA_LOGLEVEL", "WARNING"))
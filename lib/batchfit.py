@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent fitting of many curves.
+
+Curves are fitted in a pool of worker processes (the least-squares
+iterations call back into python and hold the GIL, so threads would not fit
+in parallel). A session keeps one pool (createPool()) for all fits, so the
+worker processes are started once. The callback receives the results of all
+curves at once, so
+the caller can add all fit curves in a single replot. The fit parameters can
+be collected in a results table (amplitude, period, phase, offset vs field)
+and saved as ASCII.
+"""
+import time
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+import transportdata as transdat
+
+import logging
+l = logging.getLogger(__name__) # level is configured in lib/__init__.py
+
+DEFAULT_WORKERS = max(1, cpu_count() - 1)
+
+# fit function of each kind of fit, see transportdata.fitcos
+FITS = {"cos": transdat.fitcos,
+        "cos2": transdat.fitcos_squared}
+
+RESULT_DTYPE = [("field", np.float64),
+                ("amplitude", np.float64),
+                ("period", np.float64), # in deg
+                ("phase", np.float64),  # in deg
+                ("offset", np.float64)]
+
+
+def _fit(args):
+    """
+    Worker: fit one curve and return (key, result, error, duration) instead
+    of raising, so that a failing fit does not abort the others.
+    result is (amplitude, frequency, phase, y0, yFit) as returned by fitcos
+    """
+    kind, key, x, y = args
+    start = time.time()
+    try:
+        return key, FITS[kind](np.deg2rad(x), y, fitY0 = True), None, time.time() - start
+    except Exception as e:
+        return key, None, e, time.time() - start
+
+
+def createPool(workers = DEFAULT_WORKERS, processes = True):
+    """
+    Pool to pass to fitCurves() for all fits of a session. Close it with
+    pool.terminate() when the session ends.
+
+    Parameters
+    ----------
+    workers : int
+        number of worker processes (threads)
+    processes : bool
+        fit in worker processes (default), in threads otherwise
+    """
+    return Pool(workers) if processes else ThreadPool(workers)
+
+
+def fitCurves(curves, callback, kind = "cos", workers = DEFAULT_WORKERS, processes = True, pool = None):
+    """
+    Fit all curves concurrently.
+
+    Parameters
+    ----------
+    curves : list of (key, x, y)
+        curves to fit, x in deg. key identifies the curve in the results
+    callback : callable(results)
+        called once all curves are fitted with the list of
+        (key, result, error, duration) in the order of curves, see _fit().
+        Note that the callback is invoked from a thread of the pool.
+    kind : str
+        "cos" or "cos2" (see FITS)
+    workers : int
+        maximum number of curves fitted at the same time
+    processes : bool
+        fit in worker processes (default), in threads otherwise
+    pool : multiprocessing.pool.Pool (optional)
+        pool to fit in (see createPool()), it is left open. If omitted, a
+        pool of at most workers workers is created for these curves.
+
+    Returns
+    ----------
+    pool : multiprocessing.pool.Pool
+        the pool; if it has been created for these curves it is closed, call
+        pool.join() to wait until all curves are fitted
+    """
+    if kind not in FITS:
+        raise Exception("Unknown fit %s"%kind)
+    tasks = [(kind, key, np.asarray(x, dtype = np.float64), np.asarray(y, dtype = np.float64))
+             for key, x, y in curves]
+    if pool is not None:
+        pool.map_async(_fit, tasks, callback = callback)
+        l.debug("Fitting %d curves in the session pool", len(tasks))
+        return pool
+    nWorkers = max(1, min(workers, len(tasks)))
+    # starting processes does not pay off for a single curve
+    pool = createPool(nWorkers, processes and len(tasks) > 1)
+    pool.map_async(_fit, tasks, callback = callback)
+    pool.close()
+    l.debug("Fitting %d curves with %d workers", len(tasks), nWorkers)
+    return pool
+
+
+def resultRow(field, result):
+    """
+    Row of the results table for a fit result of fitCurves
+    """
+    amplitude, frequency, phase, y0, yFit = result
+    return (field, amplitude, np.rad2deg(2*np.pi/frequency), np.rad2deg(phase), y0)
+
+
+def resultsTable(rows):
+    """
+    Structured array (see RESULT_DTYPE) of fit results sorted by field
+    (results of unknown field last)
+
+    Parameters
+    ----------
+    rows : list of tuple
+        rows as returned by resultRow()
+    """
+    table = np.array([tuple(row) for row in rows], dtype = RESULT_DTYPE)
+    return table[np.argsort(table["field"], kind = "mergesort")]
+
+
+def saveResultsTable(fname, table, comment = ""):
+    """
+    Save a results table as whitespace separated ASCII file
+    """
+    header = comment + "\n" if comment else ""
+    header += "\t".join(name for name, dtype in RESULT_DTYPE)
+    np.savetxt(fname, np.column_stack([table[name] for name, dtype in RESULT_DTYPE]),
+               delimiter = "\t", header = header)
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Chunked (out-of-core) variants of the streaming-friendly processing stages in
+transportdata for channels that do not fit into memory.
+
+All functions process their input in blocks of fixed size, carry state across
+block boundaries and write their results to (memory-mapped) output arrays, so
+the peak memory is bounded by the chunk size and not by the size of the file.
+
+Usage example
+----------
+>>> tdms = openTdmsFileMemmapped("2014-06-23-YY84-A02-admr_300K.tdms")
+>>> field = tdms.object("Read.K2400_long_oopj", "IPS.TargetField")
+>>> U = tdms.object("Read.K2400_long_oopj", "K2400U")
+>>> uniqueFields, startIdx = segmentFieldsChunked(field)
+>>> stats = segmentReduceChunked(U, startIdx, out = "U-stats.npy")
+>>> diff = deltaMethodChunked(U, 3, out = "U-diff.npy")
+"""
+import atexit
+import os
+import tempfile
+
+import numpy as np
+
+import logging
+l = logging.getLogger(__name__) # level is configured in lib/__init__.py
+
+DEFAULT_CHUNK_SIZE = 2**20 # number of elements per block
+
+SEGMENT_STATS_DTYPE = np.dtype([("min", np.float64),
+                                ("max", np.float64),
+                                ("mean", np.float64),
+                                ("count", np.int64)])
+
+
+def openTdmsFileMemmapped(filename, memmapDir = None):
+    """
+    Open a TDMS file with its channel data memory-mapped to memmapDir (a
+    temporary directory if omitted) instead of being read into memory.
+    """
+    import nptdms
+    if memmapDir is None:
+        memmapDir = tempfile.gettempdir()
+    return nptdms.TdmsFile(filename, memmap_dir = memmapDir)
+
+
+def channelLength(source):
+    """
+    Number of elements of an array or TDMS channel
+    """
+    if hasattr(source, "read_data"):
+        return len(source)
+    if hasattr(source, "data") and not isinstance(source, np.ndarray):
+        source = source.data
+    return np.size(source)
+
+
+def readChunks(source, chunkSize = DEFAULT_CHUNK_SIZE, start = 0, stop = None):
+    """
+    Iterate over source[start:stop] in blocks of at most chunkSize elements.
+
+    Parameters
+    ----------
+    source : array_like or TDMS channel
+        np.ndarray/np.memmap or a TDMS channel. Channels of a streamed
+        TdmsFile are read block by block with channel.read_data(), other
+        channels are sliced from channel.data (which is a np.memmap when the
+        file is opened with openTdmsFileMemmapped()).
+    chunkSize : int
+        maximum number of elements per block
+
+    Returns
+    ----------
+    generator of (offset, block)
+        offset is the index of block[0] in source
+    """
+    n = channelLength(source)
+    if stop is None or stop > n:
+        stop = n
+    if hasattr(source, "read_data"):
+        read = lambda a, b: source.read_data(a, b - a)
+    else:
+        data = source.data if hasattr(source, "data") and not isinstance(source, np.ndarray) else source
+        read = lambda a, b: np.asarray(data[a:b])
+    for offset in range(start, stop, chunkSize):
+        yield offset, read(offset, min(offset + chunkSize, stop))
+
+
+def openOutput(out, shape, dtype):
+    """
+    Return a writable array for the results of a chunked operation.
+
+    Parameters
+    ----------
+    out : None, str or np.ndarray
+        None: a memory-mapped .npy file in the temporary directory is created
+        and removed again right away (the mapping stays valid and the disk
+        space is freed with the array). Where open files can't be removed
+        (Windows), it is removed when the interpreter exits.
+        str: filename of the .npy file the memory-mapped output is created in
+        np.ndarray: used as is (needs to be of shape shape)
+    """
+    shape = tuple(np.atleast_1d(shape))
+    if out is None:
+        fd, path = tempfile.mkstemp(suffix = ".npy")
+        os.close(fd)
+        out = np.lib.format.open_memmap(path, mode = "w+", dtype = dtype, shape = shape)
+        try:
+            os.remove(path)
+        except OSError:
+            _temporaryOutputs.append(path)
+        return out
+    if not hasattr(out, "shape"):
+        return np.lib.format.open_memmap(out, mode = "w+", dtype = dtype, shape = shape)
+    if np.shape(out) != shape:
+        raise Exception("Output array has shape %s, expected %s"%(np.shape(out), shape))
+    return out
+
+
+_temporaryOutputs = [] # temporary outputs that couldn't be removed while mapped
+
+
+@atexit.register
+def _removeTemporaryOutputs():
+    for path in _temporaryOutputs:
+        try:
+            os.remove(path)
+        except OSError:
+            l.debug("Could not remove temporary output %s", path)
+
+
+def separateAlternatingSignalChunked(x, out0 = None, out1 = None, chunkSize = DEFAULT_CHUNK_SIZE):
+    """
+    Chunked variant of transportdata.separateAlternatingSignal.
+
+    Blocks of odd length are handled by carrying the last element over to the
+    next block.
+
+    Parameters
+    ----------
+    x : array_like or TDMS channel
+        data to separate
+    out0, out1 : None, str or np.ndarray
+        outputs for x[2n] and x[2n+1], see openOutput()
+
+    Returns
+    ----------
+    separated_signal : tuple of two arrays (x[2n], x[2n+1])
+    """
+    n = channelLength(x)
+    if n%2:
+        l.warn("""Data does not have an even number of elements. Dropping last datapoint.
+        Maybe the data has not been recorded using a delta method?""")
+    n = n//2
+    dtype = _dtype(x)
+    out0 = openOutput(out0, n, dtype)
+    out1 = openOutput(out1, n, dtype)
+
+    pos = 0
+    for block in _pairedBlocks(x, chunkSize, 2*n):
+        m = len(block)//2
+        out0[pos:pos+m] = block[0::2]
+        out1[pos:pos+m] = block[1::2]
+        pos += m
+    return out0, out1
+
+
+def deltaMethodChunked(y, method, out = None, chunkSize = DEFAULT_CHUNK_SIZE):
+    """
+    Chunked delta method evaluation (see DataObject.deltaMethod).
+
+    Parameters
+    ----------
+    y : array_like or TDMS channel
+        data to process
+    method : int(0-4)
+        0: no delta method [n] (default)
+        1: uneven indexed raw data [2n-1]
+        2: even indexed raw data [2n]
+        3: difference [2n-1]-[2n]
+        4: sum [2n-1]+[2n]
+    out : None, str or np.ndarray
+        output, see openOutput()
+    """
+    n = channelLength(y)
+    dtype = _dtype(y)
+    if method == 0:
+        out = openOutput(out, n, dtype)
+        for offset, block in readChunks(y, chunkSize):
+            out[offset:offset+len(block)] = block
+        return out
+
+    out = openOutput(out, n//2, dtype)
+    pos = 0
+    for block in _pairedBlocks(y, chunkSize, n - n%2):
+        m = len(block)//2
+        if method == 1:
+            out[pos:pos+m] = block[0::2]
+        elif method == 2:
+            out[pos:pos+m] = block[1::2]
+        elif method == 3:
+            np.subtract(block[0::2], block[1::2], out = out[pos:pos+m])
+        elif method == 4:
+            np.add(block[0::2], block[1::2], out = out[pos:pos+m])
+        else:
+            raise Exception("Unknown delta method %s"%method)
+        pos += m
+    return out
+
+
+def segmentFieldsChunked(field, chunkSize = DEFAULT_CHUNK_SIZE):
+    """
+    Chunked equivalent of np.unique(field, return_index = True) sorted by
+    start index (i.e. by order of measurement) as done in
+    transportdata.preprocessTransportData.
+
+    Memory is bounded by the chunk size and the number of unique values.
+
+    Returns
+    ----------
+    uniqueFields : np.ndarray
+        unique field values in order of measurement
+    uniqueFieldStartIdx : np.ndarray
+        index of the first occurrence of each unique field value
+    """
+    firstIdx = {}
+    for offset, block in readChunks(field, chunkSize):
+        values, idx = np.unique(block, return_index = True)
+        for value, i in zip(values, idx):
+            if value not in firstIdx:
+                firstIdx[value] = offset + i
+
+    uniqueFields = np.array(list(firstIdx.keys()), dtype = _dtype(field))
+    uniqueFieldStartIdx = np.array(list(firstIdx.values()), dtype = np.int64)
+    order = np.argsort(uniqueFieldStartIdx)
+    return uniqueFields[order], uniqueFieldStartIdx[order]
+
+
+def segmentReduceChunked(y, startIdx, out = None, chunkSize = DEFAULT_CHUNK_SIZE):
+    """
+    Per-segment min, max, mean and number of points of y, where segment i
+    spans y[startIdx[i]:startIdx[i+1]] and the last segment runs to the end
+    of y. Data before startIdx[0] is ignored.
+
+    Segments crossing block boundaries are combined with the partial results
+    of the previous blocks.
+
+    Parameters
+    ----------
+    y : array_like or TDMS channel
+        data to reduce
+    startIdx : array_like
+        sorted start indices of the segments, e.g. from segmentFieldsChunked()
+    out : None, str or np.ndarray
+        output with dtype SEGMENT_STATS_DTYPE, see openOutput()
+
+    Returns
+    ----------
+    stats : np.ndarray of dtype SEGMENT_STATS_DTYPE
+        fields "min", "max", "mean", "count" for each segment
+    """
+    startIdx = np.asarray(startIdx, dtype = np.int64)
+    nSegments = np.size(startIdx)
+    stats = openOutput(out, nSegments, SEGMENT_STATS_DTYPE)
+    stats["min"] = np.inf
+    stats["max"] = -np.inf
+    stats["mean"] = 0. # holds the sum until all blocks are processed
+    stats["count"] = 0
+    if not nSegments:
+        return stats
+
+    for offset, block in readChunks(y, chunkSize, start = int(startIdx[0])):
+        end = offset + len(block)
+        # segments starting within this block and the one running into it
+        first = np.searchsorted(startIdx, offset, side = "right") - 1
+        last = np.searchsorted(startIdx, end, side = "left")
+        local = np.maximum(startIdx[first:last] - offset, 0)
+        segments = np.arange(first, last)
+
+        counts = np.diff(np.append(local, len(block)))
+        stats["min"][segments] = np.minimum(stats["min"][segments], np.minimum.reduceat(block, local))
+        stats["max"][segments] = np.maximum(stats["max"][segments], np.maximum.reduceat(block, local))
+        stats["mean"][segments] += np.add.reduceat(block, local, dtype = np.float64)
+        stats["count"][segments] += counts
+
+    nonEmpty = stats["count"] > 0
+    stats["mean"][nonEmpty] /= stats["count"][nonEmpty]
+    stats["mean"][~nonEmpty] = np.nan
+    return stats
+
+
+def _dtype(source):
+    """
+    dtype of an array or TDMS channel
+    """
+    if hasattr(source, "dtype"):
+        return source.dtype
+    for _, block in readChunks(source, 1, stop = 1):
+        return block.dtype
+    return np.dtype(np.float64)
+
+
+def _pairedBlocks(source, chunkSize, stop):
+    """
+    Iterate over source[:stop] in blocks of even length. An element left over
+    at the end of an odd-length block is carried over to the next block.
+    """
+    carry = None
+    for offset, block in readChunks(source, chunkSize, stop = stop):
+        if carry is not None:
+            block = np.concatenate((carry, block))
+            carry = None
+        if len(block)%2:
+            carry = block[-1:].copy()
+            block = block[:-1]
+        yield block
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent loading of measurement files.
+
+Files are opened in a pool of worker threads; a callback is invoked for each
+file as soon as it has been loaded (or failed to load), so a single bad file
+does not keep the others from being loaded.
+"""
+import time
+from multiprocessing.pool import ThreadPool
+
+import logging
+l = logging.getLogger(__name__) # level is configured in lib/__init__.py
+
+DEFAULT_WORKERS = 4
+
+
+def openTdmsFile(filename):
+    """
+    Open (and read) a TDMS file with nptdms
+    """
+    import nptdms
+    return nptdms.TdmsFile(filename)
+
+
+def _load(args):
+    """
+    Worker: load one file and return (filename, result, error, duration)
+    instead of raising so that errors can be reported per file
+    """
+    loader, filename = args
+    start = time.time()
+    try:
+        return filename, loader(filename), None, time.time() - start
+    except Exception as e:
+        return filename, None, e, time.time() - start
+
+
+def loadFiles(filenames, callback, loader = openTdmsFile, workers = DEFAULT_WORKERS):
+    """
+    Load files concurrently in a thread pool.
+
+    Parameters
+    ----------
+    filenames : list of str
+        files to load
+    callback : callable(filename, result, error, duration)
+        called for each file as soon as it is finished. error is None on
+        success, otherwise result is None and error is the raised exception.
+        Note that the callback is invoked from a worker thread of the pool.
+    loader : callable(filename)
+        function opening a file (default: openTdmsFile)
+    workers : int
+        maximum number of files loaded at the same time
+
+    Returns
+    ----------
+    pool : multiprocessing.pool.ThreadPool
+        the (closed) pool, call pool.join() to wait until all files are loaded
+    """
+    filenames = list(filenames)
+    pool = ThreadPool(max(1, min(workers, len(filenames))))
+    for filename in filenames:
+        pool.apply_async(_load, ((loader, filename),),
+                         callback = lambda result: callback(*result))
+    pool.close()
+    return pool
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Memory budget of a session.
+
+The MemoryManager keeps track of the objects holding data in memory (opened
+files, data objects of plotted curves) in least recently used order. If
+their memory use exceeds the budget, the data of the least recently used
+objects is released until it fits again:
+
+    + files (tdmsindex.TdmsIndex) unload the channel data read from the TDMS
+      file, it is read again on the next access
+    + data objects (DataObject) spill their arrays to .npy files and memory-map
+      them, so they are read back from disk transparently when accessed
+
+Tracked objects implement memoryUsage() (bytes held in memory) and
+release(spillDirectory). The budget is set in MiB by the environment variable
+PREVIEWTRANSPORTDATA_MEMORY_MB (default: 2048) or passed to the manager.
+
+Usage example
+----------
+>>> memory = MemoryManager()
+>>> memory.track(index, u"file %s"%index.filename)
+>>> memory.track(dataObject, u"curve %s"%dataObject.label)
+>>> memory.touch(index)          # index is in use again
+>>> memory.enforce(protect = [dataObject])
+>>> print(memory.formatReport())
+"""
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import logging
+l = logging.getLogger(__name__) # level is configured in lib/__init__.py
+
+DEFAULT_BUDGET_MB = 2048
+
+
+def defaultBudget():
+    """
+    Memory budget in bytes (PREVIEWTRANSPORTDATA_MEMORY_MB or DEFAULT_BUDGET_MB)
+    """
+    return int(float(os.environ.get("PREVIEWTRANSPORTDATA_MEMORY_MB", DEFAULT_BUDGET_MB))*2**20)
+
+
+class MemoryManager(object):
+    """
+    Keep the memory used by tracked objects within a budget by releasing the
+    data of the least recently used ones
+
+    Parameters
+    ----------
+    budget : int (optional)
+        budget in bytes (default: defaultBudget())
+    spillDirectory : str (optional)
+        directory spilled data is written to (default: a temporary directory
+        that is removed by close())
+
+    Class Members
+    ----------
+    self.entries : OrderedDict
+        tracked object -> name, least recently used first
+    self.releasedBytes : int
+        bytes released in this session
+    """
+    def __init__(self, budget = None, spillDirectory = None):
+        self.budget = defaultBudget() if budget is None else int(budget)
+        self.entries = OrderedDict()
+        self.releasedBytes = 0
+        self._spillDirectory = spillDirectory
+        self._ownsSpillDirectory = spillDirectory is None
+
+    @property
+    def spillDirectory(self):
+        """
+        Directory spilled data is written to (created on first use)
+        """
+        if self._spillDirectory is None:
+            self._spillDirectory = tempfile.mkdtemp(prefix = "previewTransportData-")
+        return self._spillDirectory
+
+    def track(self, obj, name = None):
+        """
+        Track obj (as most recently used)
+        """
+        self.entries.pop(obj, None)
+        self.entries[obj] = name if name is not None else repr(obj)
+
+    def touch(self, obj):
+        """
+        Mark obj as most recently used
+        """
+        if obj in self.entries:
+            self.entries[obj] = self.entries.pop(obj)
+
+    def forget(self, obj):
+        """
+        Stop tracking obj (e.g. because its curve has been removed) and
+        delete its spilled data
+        """
+        if self.entries.pop(obj, None) is not None and hasattr(obj, "discardSpill"):
+            obj.discardSpill()
+
+    def usage(self):
+        """
+        Bytes held in memory by all tracked objects
+        """
+        return sum(obj.memoryUsage() for obj in self.entries)
+
+    def enforce(self, protect = ()):
+        """
+        Release the data of the least recently used objects until the memory
+        use is within the budget
+
+        Parameters
+        ----------
+        protect : list
+            objects that are in use and must not be released
+
+        Returns
+        ----------
+        released : list
+            names of the released objects
+        """
+        usage = OrderedDict((obj, obj.memoryUsage()) for obj in self.entries)
+        total = sum(usage.values())
+        released = []
+        for obj, size in usage.items():
+            if total <= self.budget:
+                break
+            if not size or any(obj is other for other in protect):
+                continue
+            obj.release(self.spillDirectory)
+            freed = size - obj.memoryUsage()
+            total -= freed
+            self.releasedBytes += freed
+            released.append(self.entries[obj])
+            l.debug("Released %.1f MiB of %s", freed/2.**20, self.entries[obj])
+        if total > self.budget:
+            l.warn("Memory use of %.1f MiB exceeds the budget of %.1f MiB (objects in use can't be released)",
+                   total/2.**20, self.budget/2.**20)
+        return released
+
+    def report(self):
+        """
+        Memory use of each tracked object
+
+        Returns
+        ----------
+        rows : list of (name, bytes)
+            least recently used first
+        """
+        return [(name, obj.memoryUsage()) for obj, name in self.entries.items()]
+
+    def formatReport(self):
+        """
+        report() as readable text
+        """
+        rows = self.report()
+        lines = [u"%10.1f MiB  %s"%(size/2.**20, name) for name, size in rows]
+        lines.append(u"%10.1f MiB  total of %d objects (budget %.1f MiB, %.1f MiB released so far)"
+                     %(sum(size for name, size in rows)/2.**20, len(rows), self.budget/2.**20, self.releasedBytes/2.**20))
+        return u"\n".join(lines)
+
+    def close(self):
+        """
+        Remove the spill directory (if it has been created by the manager)
+        """
+        if self._ownsSpillDirectory and self._spillDirectory is not None:
+            shutil.rmtree(self._spillDirectory, ignore_errors = True)
+            self._spillDirectory = None
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of the channels of a TDMS file as memory-mapped .npy files.
+
+Parsing a TDMS file with nptdms is far slower than mapping raw arrays. A file
+is converted once with convertTdmsToNpy(); every channel is written to its
+own .npy file in a per-file cache directory (<file>.tdms.npycache/ by default)
+together with a manifest. Later opens (tdmsindex.openTdmsIndex, i.e. addFiles
+in the GUI and the headless query API) map the channels with
+np.load(mmap_mode = 'r'), so opening is instant and pages are only read when
+they are touched.
+
+The manifest records size and modification time of the TDMS file; the cache
+is ignored once the TDMS file changes. Channels are stored in their source
+type and converted to the processing precision when segments are read (see
+segments.TransportQuery), so a cache serves sessions of any precision.
+
+Next to the channels the cache can hold precomputed field segmentations
+(writeSegments, loaded with the index) and processed results
+(writeResult/readResult), e.g. filled in by the directory watcher.
+"""
+import os
+import json
+import hashlib
+import datetime
+from collections import OrderedDict
+
+import numpy as np
+
+from tdmsindex import TdmsIndex, ChannelInfo, openTdmsIndex
+
+import logging
+l = logging.getLogger(__name__) # level is configured in lib/__init__.py
+
+MANIFEST = "manifest.json"
+MANIFEST_VERSION = 2 # 1: floating point channels stored in the processing precision
+SEGMENTS = "segments.json"
+RESULTS = "results"
+
+
+def cacheDir(filename):
+    """
+    Default cache directory of a TDMS file
+    """
+    return filename + ".npycache"
+
+
+def sourceStamp(filename):
+    """
+    Size and modification time of a file to validate caches against
+    """
+    stat = os.stat(filename)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def readManifest(filename, directory = None):
+    """
+    Manifest of the cache of filename (None if there is none)
+    """
+    path = os.path.join(directory or cacheDir(filename), MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def isCacheValid(filename, directory = None):
+    """
+    Whether a complete cache exists that matches the current state of filename
+    """
+    try:
+        manifest = readManifest(filename, directory)
+        return (manifest is not None
+                and manifest.get("version") == MANIFEST_VERSION
+                and manifest.get("source") == sourceStamp(filename))
+    except (OSError, IOError, ValueError):
+        return False
+
+
+def replaceFile(temporary, path):
+    """
+    Move the completely written file temporary to path, replacing path
+    atomically (on Windows, where rename doesn't replace, path is removed
+    first)
+    """
+    if os.name == "nt" and os.path.exists(path):
+        os.remove(path)
+    os.rename(temporary, path)
+
+
+def mappableData(data):
+    """
+    Channel data as array that can be memory-mapped: object arrays (e.g.
+    nptdms timestamps or strings) are converted to datetime64 or unicode
+    arrays. None if they can't be converted.
+    """
+    if not data.dtype.hasobject:
+        return data
+    if not np.size(data):
+        return np.zeros(0)
+    first = data.flat[0]
+    try:
+        if isinstance(first, datetime.datetime):
+            return np.asarray(data, dtype = "datetime64[us]")
+        if isinstance(first, (str, type(u""))):
+            return np.asarray(data, dtype = type(u""))
+    except (TypeError, ValueError) as e:
+        l.debug("Can't convert channel data to a mappable type: %s", e)
+    return None
+
+
+def convertTdmsToNpy(filename, directory = None, index = None):
+    """
+    Write each channel of a TDMS file to a .npy file in its cache directory.
+    Numeric channels are stored in their source type, timestamps and strings
+    as datetime64 and unicode arrays.
+    Channels that can't be memory-mapped are read from the TDMS file.
+
+    Parameters
+    ----------
+    filename : str
+        TDMS file to convert
+    directory : str (optional)
+        cache directory (default: cacheDir(filename))
+    index : TdmsIndex (optional)
+        index of the already opened file (the file is opened otherwise)
+
+    Returns
+    ----------
+    directory : str
+        the cache directory
+    """
+    directory = directory or cacheDir(filename)
+    if index is None or index.tdmsFile is None:
+        index = openTdmsIndex(filename, useNpyCache = False)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    groups = []
+    n = 0
+    for group, channels in index.groups.items():
+        entries = []
+        for name, channel in channels.items():
+            data = channel.data
+            if data is None:
+                entries.append([name, None, None, 0])
+                continue
+            data = mappableData(np.asarray(data))
+            if data is None:
+                # read from the TDMS file on access
+                entries.append([name, None, None, int(channel.length)])
+                continue
+            npyFile = "%05d.npy"%n
+            np.save(os.path.join(directory, npyFile), data)
+            entries.append([name, npyFile, data.dtype.str, int(np.size(data))])
+            n += 1
+        groups.append([group, entries])
+
+    # the manifest is written last (and atomically), so an interrupted
+    # conversion leaves an invalid cache
+    _writeJson(os.path.join(directory, MANIFEST),
+               {"version": MANIFEST_VERSION,
+                "source": sourceStamp(filename),
+                "groups": groups})
+    l.info("Cached %d channels of %s in %s", n, filename, directory)
+    return directory
+
+
+def _writeJson(path, value):
+    """
+    Write value as JSON to path atomically (via a temporary file)
+    """
+    with open(path + ".tmp", "w") as f:
+        json.dump(value, f)
+    replaceFile(path + ".tmp", path)
+
+
+def writeSegments(filename, segmentIndexes, directory = None):
+    """
+    Store precomputed field segmentations in the cache of filename (replacing
+    the stored ones)
+
+    Parameters
+    ----------
+    segmentIndexes : dict
+        (group, field channel) -> segments.SegmentIndex
+    """
+    directory = directory or cacheDir(filename)
+    entries = [[group, channel, segments.fields.tolist(), segments.start.tolist(),
+                int(segments.stop[-1]) if len(segments) else 0]
+               for (group, channel), segments in segmentIndexes.items()]
+    _writeJson(os.path.join(directory, SEGMENTS),
+               {"source": sourceStamp(filename), "segments": entries})
+
+
+def readSegments(filename, directory = None):
+    """
+    Precomputed field segmentations of filename ({} if there are none or they
+    are outdated)
+
+    Returns
+    ----------
+    segmentIndexes : dict
+        (group, field channel) -> segments.SegmentIndex
+    """
+    from segments import SegmentIndex
+    path = os.path.join(directory or cacheDir(filename), SEGMENTS)
+    try:
+        with open(path) as f:
+            stored = json.load(f)
+        if stored["source"] != sourceStamp(filename):
+            return {}
+    except (OSError, IOError, ValueError, KeyError):
+        return {}
+    return dict(((group, channel), SegmentIndex(fields, start, length))
+                for group, channel, fields, start, length in stored["segments"])
+
+
+def resultPath(filename, key, directory = None):
+    """
+    File of the processed result identified by key (any JSON serializable
+    value, e.g. [group, x, y, field channel, operations])
+    """
+    digest = hashlib.sha1(json.dumps(key, sort_keys = True).encode("utf-8")).hexdigest()
+    return os.path.join(directory or cacheDir(filename), RESULTS, digest + ".npz")
+
+
+def writeResult(filename, key, fields, curves, directory = None):
+    """
+    Store processed data of all segments of a measurement
+
+    Parameters
+    ----------
+    key : JSON serializable
+        identifies the result (see resultPath)
+    fields : array_like
+        field of each segment
+    curves : list of (x, y)
+        processed data of each segment
+    """
+    path = resultPath(filename, key, directory)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    arrays = {}
+    for n, (x, y) in enumerate(curves):
+        arrays["x%d"%n] = x
+        arrays["y%d"%n] = y
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, source = json.dumps(sourceStamp(filename)), fields = fields, **arrays)
+    replaceFile(path + ".tmp", path)
+
+
+def readResult(filename, key, directory = None):
+    """
+    Processed data stored with writeResult (None if there is none or it is
+    outdated)
+
+    Returns
+    ----------
+    fields : ndarray
+    curves : list of (x, y)
+    """
+    path = resultPath(filename, key, directory)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        if json.loads(str(data["source"])) != sourceStamp(filename):
+            return None
+        fields = data["fields"]
+        return fields, [(data["x%d"%n], data["y%d"%n]) for n in range(np.size(fields))]
+
+
+def openNpyCache(filename, directory = None):
+    """
+    Build the TdmsIndex of filename from its cache. Channel data is
+    memory-mapped from the .npy files on first access.
+    """
+    directory = directory or cacheDir(filename)
+    manifest = readManifest(filename, directory)
+    if manifest is None:
+        raise Exception("No npy cache of %s in %s"%(filename, directory))
+
+    index = TdmsIndex(filename)
+    for group, entries in manifest["groups"]:
+        channels = index.groups.setdefault(group, OrderedDict())
+        for name, npyFile, dtype, length in entries:
+            channels[name] = ChannelInfo(group, name,
+                                         np.dtype(dtype) if dtype else None,
+                                         length,
+                                         npyPath = os.path.join(directory, npyFile) if npyFile else None,
+                                         # channels that couldn't be cached are read from the TDMS file
+                                         loader = index.loadChannel if length and not npyFile else None)
+    index.segmentIndexes.update(readSegments(filename, directory))
+    return index
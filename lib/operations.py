@@ -0,0 +1,693 @@
+# -*- coding: utf-8 -*-
+"""
+Declarative processing operations.
+
+An operation is described by an OperationSpec: the name of a registered
+operation and its (typed, validated) parameters. Specs are immutable,
+hashable and picklable, have a stable digest, and can be converted to and
+from JSON ([name, {parameters}]). A pipeline is a sequence of specs. It can
+be replayed on other data, used as a cache key, or sent to worker processes.
+
+Operations are registered with their parameters in OPERATIONS and run by
+execute(). DataObject queues specs and runs them through execute().
+
+Several pipelines that start with the same operations (e.g. symmetrized and
+antisymmetrized results of the same averaged data) form a PipelineGraph: the
+pipelines are branches of a tree of operations that share their upstream
+nodes, and each node is computed once.
+
+The intermediate results of a pipeline (all but its final results) can be
+written to preallocated Buffers that are reused when the pipeline is run
+again on data of the same shape (e.g. on all segments of a measurement).
+
+Usage example
+----------
+>>> pipeline = [OperationSpec("deltaMethod", method = 3),
+...             OperationSpec("averageUpDown"),
+...             OperationSpec("symmetrize", method = 2, symm_step = 180.)]
+>>> x, y = execute(pipeline, x, y)
+>>> results = executeSegments(pipeline, [(x0, y0), (x1, y1)], pool = multiprocessing.Pool())
+>>> graph = PipelineGraph([("sym", pipeline[:2] + [OperationSpec("symmetrize", method = 1, symm_step = 180.)]),
+...                        ("antisym", pipeline)])
+>>> results = graph.execute(x, y) # deltaMethod and averageUpDown run once
+>>> xSym, ySym = results["sym"].xCalc, results["sym"].yCalc
+>>> buffers = Buffers()
+>>> results = [execute(pipeline, x, y, buffers = buffers) for x, y in segments]
+"""
+import hashlib
+import json
+from collections import OrderedDict
+
+import numpy as np
+
+import transportdata as transdat
+
+import logging
+l = logging.getLogger(__name__) # level is configured in lib/__init__.py
+
+REQUIRED = object() # marks parameters without default
+
+OPERATIONS = OrderedDict() # name -> (function, parameters)
+
+
+def register(name, parameters = ()):
+    """
+    Decorator registering an operation
+
+    Parameters
+    ----------
+    name : str
+        name of the operation in specs
+    parameters : list of (name, type, default)
+        parameters of the operation. Values are converted with type (None
+        is allowed if the default is None). Parameters without default are
+        marked by REQUIRED.
+    """
+    def decorator(function):
+        OPERATIONS[name] = (function, tuple(parameters))
+        return function
+    return decorator
+
+
+class OperationSpec(object):
+    """
+    Immutable description of one processing operation
+
+    Parameters
+    ----------
+    name : str
+        name of a registered operation (see OPERATIONS)
+    **parameters :
+        parameters of the operation; omitted parameters are set to their
+        defaults so equal operations have equal specs
+
+    Class Members
+    ----------
+    self.name : str
+        name of the operation
+    self.params : tuple of (name, value)
+        all parameters in the order of registration
+    """
+    def __init__(self, name, **parameters):
+        if name not in OPERATIONS:
+            raise Exception("Unknown operation %s"%name)
+        declared = OPERATIONS[name][1]
+        unknown = set(parameters) - set(p[0] for p in declared)
+        if unknown:
+            raise Exception("Unknown parameter(s) %s of operation %s"%(", ".join(sorted(unknown)), name))
+        params = []
+        for pName, pType, default in declared:
+            value = parameters.get(pName, default)
+            if value is REQUIRED:
+                raise Exception("Missing parameter %s of operation %s"%(pName, name))
+            params.append((pName, None if value is None else pType(value)))
+        self.__dict__["name"] = name
+        self.__dict__["params"] = tuple(params)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("OperationSpec is immutable")
+
+    @property
+    def parameters(self):
+        """
+        Parameters as dict (as passed to the operation)
+        """
+        return dict(self.params)
+
+    def __getitem__(self, key):
+        return self.parameters[key]
+
+    def __eq__(self, other):
+        return isinstance(other, OperationSpec) and (self.name, self.params) == (other.name, other.params)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.name, self.params))
+
+    def __repr__(self):
+        return "OperationSpec(%r%s)"%(self.name, "".join(", %s = %r"%param for param in self.params))
+
+    def __getstate__(self):
+        return (self.name, self.params)
+
+    def __setstate__(self, state):
+        self.__dict__["name"], self.__dict__["params"] = state
+
+    def toJson(self):
+        """
+        [name, parameters] (e.g. for the ops parameter of the preview server)
+        """
+        return [self.name, self.parameters]
+
+    @classmethod
+    def fromJson(cls, value):
+        name, parameters = value
+        return cls(str(name), **dict((str(k), v) for k, v in parameters.items()))
+
+    @property
+    def digest(self):
+        """
+        Hash that is stable across processes and sessions
+        """
+        return pipelineDigest([self])
+
+
+def pipelineDigest(specs):
+    """
+    Stable hash (sha1 hex digest) of a pipeline, e.g. as key of stored results
+    """
+    key = json.dumps([spec.toJson() for spec in specs], sort_keys = True)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def pipelineFromJson(value):
+    """
+    Pipeline from a list of [name, parameters]
+    """
+    return [OperationSpec.fromJson(item) for item in value]
+
+
+class Buffers(object):
+    """
+    Preallocated outputs of the intermediate operations of pipelines, reused
+    each time a pipeline is run on data of the same shape
+
+    An output is identified by the pipeline node (the specs up to and
+    including the operation) and its name ("x" or "y"). The final results of
+    a pipeline are never written to buffers, so they stay valid when the
+    buffers are reused.
+
+    Class Members
+    ----------
+    self.arrays : dict
+        (node, name) -> ndarray
+    self.allocations : int
+        number of arrays allocated so far (stays constant while the buffers
+        are reused)
+    """
+    def __init__(self):
+        self.arrays = {}
+        self.allocations = 0
+
+    def get(self, key, shape, dtype):
+        """
+        Buffer key of shape and dtype (allocated if there is none of this
+        shape and dtype yet)
+        """
+        array = self.arrays.get(key)
+        if array is None or array.shape != tuple(shape) or array.dtype != dtype:
+            array = self.arrays[key] = np.empty(shape, dtype = dtype)
+            self.allocations += 1
+        return array
+
+    def allocator(self, key):
+        """
+        callable(shape, dtype) returning buffer key (an out= argument of the
+        functions in transportdata)
+        """
+        return lambda shape, dtype: self.get(key, shape, dtype)
+
+    def detach(self, array):
+        """
+        array, or a copy of it if it shares memory with a buffer (e.g. a view
+        of an intermediate result)
+        """
+        if any(np.may_share_memory(array, buffer) for buffer in self.arrays.values()):
+            return np.array(array)
+        return array
+
+    def memoryUsage(self):
+        """
+        Bytes held by the buffers
+        """
+        return sum(array.nbytes for array in self.arrays.values())
+
+
+class PipelineData(object):
+    """
+    Data an operation works on: the calculated x- and y-data, whether it
+    (still) consists of an up and down sweep, and optionally min/max/mean
+    of the unprocessed y-data (e.g. from the sidecar index)
+
+    While an operation runs, buffers (Buffers or None) holds the buffers its
+    outputs may be written to, node identifies them (see _out()).
+    """
+    def __init__(self, x, y, stats = None):
+        self.xCalc = np.asarray(x)
+        self.yCalc = np.asarray(y)
+        self.isUpDownData = True
+        self.stats = stats
+        self.buffers = None
+        self.node = ()
+
+    def branch(self):
+        """
+        New PipelineData continuing from the current state (the arrays are
+        shared, operations never modify them in place)
+        """
+        data = PipelineData(self.xCalc, self.yCalc, self.stats)
+        data.isUpDownData = self.isUpDownData
+        data.untouched = getattr(self, "untouched", False)
+        return data
+
+
+def _run(data, node, buffers):
+    """
+    Run the last operation of node on data, writing its outputs to buffers
+    (if not None)
+    """
+    spec = node[-1]
+    data.node, data.buffers = node, buffers
+    try:
+        OPERATIONS[spec.name][0](data, **spec.parameters)
+    finally:
+        data.buffers = None
+    data.untouched = False
+
+
+def _detach(data, buffers):
+    """
+    Make sure the results in data don't share memory with buffers
+    """
+    if buffers is not None:
+        data.xCalc = buffers.detach(data.xCalc)
+        data.yCalc = buffers.detach(data.yCalc)
+
+
+def execute(specs, x = None, y = None, data = None, buffers = None):
+    """
+    Run the operations of specs in order
+
+    Parameters
+    ----------
+    specs : list of OperationSpec
+        the pipeline
+    x, y : array_like
+        data to process (not modified). y may be the stacked data of several
+        channels recorded against x (shape (channels, points)); the
+        operations work along the last axis.
+    data : PipelineData-like (optional)
+        object with xCalc, yCalc and isUpDownData to process in place
+        instead of x and y (e.g. a DataObject)
+    buffers : Buffers (optional)
+        buffers for the intermediate results, reused by the next run on
+        data of the same shape
+
+    Returns
+    ----------
+    xCalc, yCalc : ndarray
+        processed data (never in buffers)
+    """
+    if data is None:
+        data = PipelineData(x, y)
+    specs = tuple(specs)
+    # the statistics of the unprocessed data are valid until the first operation
+    data.untouched = True
+    for i in range(len(specs)):
+        _run(data, specs[:i + 1], buffers if i < len(specs) - 1 else None)
+    _detach(data, buffers)
+    return data.xCalc, data.yCalc
+
+
+class PipelineGraph(object):
+    """
+    Several pipelines (branches) sharing their upstream operations
+
+    The branches form a tree of operations: each node is a pipeline prefix,
+    branches that start with equal specs share these nodes. execute() runs
+    each node once and hands its result on to all nodes downstream.
+
+    Parameters
+    ----------
+    branches : list of (key, specs) or dict (optional)
+        branches to add (see add())
+
+    Class Members
+    ----------
+    self.branches : OrderedDict
+        key -> tuple of OperationSpec (the pipeline of the branch)
+    """
+    def __init__(self, branches = ()):
+        self.branches = OrderedDict()
+        for key, specs in (branches.items() if hasattr(branches, "items") else branches):
+            self.add(key, specs)
+
+    def add(self, key, specs):
+        """
+        Add the pipeline specs as branch key (e.g. a label or a DataObject)
+        """
+        self.branches[key] = tuple(specs)
+
+    def nodes(self):
+        """
+        The distinct nodes (non-empty pipeline prefixes) of the graph, i.e.
+        the operations run by execute()
+        """
+        return set(specs[:i] for specs in self.branches.values() for i in range(1, len(specs) + 1))
+
+    def execute(self, x = None, y = None, stats = None, buffers = None):
+        """
+        Run all branches on the same data
+
+        Parameters
+        ----------
+        x, y : array_like
+            data to process (not modified), see execute()
+        stats : dict (optional)
+            min/max/mean of the unprocessed y-data
+        buffers : Buffers (optional)
+            buffers for the results of the nodes that aren't the result of
+            a branch, see execute()
+
+        Returns
+        ----------
+        results : OrderedDict
+            key -> PipelineData (xCalc, yCalc and isUpDownData) of the branch
+        """
+        children = {} # node -> specs of the nodes following it (in order of the branches)
+        for specs in self.branches.values():
+            for i, spec in enumerate(specs):
+                following = children.setdefault(specs[:i], [])
+                if spec not in following:
+                    following.append(spec)
+        terminals = set(self.branches.values())
+
+        root = PipelineData(x, y, stats)
+        root.untouched = True
+        computed = {}
+        pending = [((), root)]
+        while pending:
+            node, data = pending.pop()
+            if node in terminals:
+                _detach(data, buffers)
+                computed[node] = data
+            for spec in reversed(children.get(node, [])):
+                child = data.branch()
+                _run(child, node + (spec,), buffers if node + (spec,) not in terminals else None)
+                pending.append((node + (spec,), child))
+        l.debug("Ran %d branches with %d operations", len(self.branches), len(self.nodes()))
+        return OrderedDict((key, computed[specs]) for key, specs in self.branches.items())
+
+
+MIN_SWEEP_FRACTION = .1 # sweeps shorter than this fraction of the mean sweep length are implausible
+
+
+def _sweepBoundaries(x, tolerance = None, alternating = True):
+    """
+    Sweep boundaries of x (see transdat.sweepBoundaries()), None if x
+    doesn't turn or the sweeps found are implausibly short (e.g. because the
+    tolerance is below the noise of x).
+    """
+    boundaries = transdat.sweepBoundaries(x, tolerance, alternating)
+    l.debug("Sweep boundaries: %s", boundaries.tolist())
+    if len(boundaries) < 2:
+        l.warn("No turning point found in x")
+        return None
+    lengths = boundaries[:, 1] - boundaries[:, 0]
+    if np.min(lengths) < MIN_SWEEP_FRACTION*np.mean(lengths):
+        l.warn("Found %d sweeps of %d to %d points in x, which is implausible (adjust the tolerance)",
+               len(boundaries), np.min(lengths), np.max(lengths))
+        return None
+    return boundaries
+
+
+def _upDownBoundaries(x, tolerance = None):
+    """
+    Sweep boundaries of up-down data x, None (split in halves) if no
+    plausible sweeps are found
+    """
+    boundaries = _sweepBoundaries(x, tolerance)
+    if boundaries is None:
+        l.warn("Splitting the data in halves at the turning point")
+    return boundaries
+
+
+def _out(data, name):
+    """
+    out= argument for the output name ("x" or "y") of the running operation:
+    a buffer allocator if data has buffers, otherwise None
+    """
+    buffers = getattr(data, "buffers", None)
+    if buffers is None:
+        return None
+    return buffers.allocator((data.node, name))
+
+
+def _rawStats(data):
+    """
+    min/max/mean of the y-data if they are known without scanning it (only
+    if no operation has changed the data yet)
+    """
+    if getattr(data, "untouched", False):
+        return getattr(data, "stats", None)
+    return None
+
+
+def _executeTask(args):
+    specs, x, y = args
+    return execute(specs, x, y)
+
+
+def executeSegments(specs, segments, pool = None):
+    """
+    Apply one pipeline to many segments (e.g. all fields of a measurement)
+
+    Parameters
+    ----------
+    specs : list of OperationSpec
+    segments : list of (x, y)
+    pool : multiprocessing.Pool (optional)
+        pool to process the segments in parallel
+
+    Returns
+    ----------
+    results : list of (xCalc, yCalc)
+    """
+    if pool is None:
+        # the segments are processed one after another and reuse the buffers
+        buffers = Buffers()
+        return [execute(specs, x, y, buffers = buffers) for x, y in segments]
+    tasks = [(list(specs), x, y) for x, y in segments]
+    return pool.map(_executeTask, tasks)
+
+
+# %% Operations
+# Operations replace data.xCalc and data.yCalc and never modify them in place:
+# they may be views of the raw data (see transportdata)
+@register("deltaMethod", [("method", int, REQUIRED)])
+def deltaMethod(data, method):
+    """
+    method : int(0-4)
+        0: no delta method [n] (default)
+        1: uneven indexed raw data [2n-1]
+        2: even indexed raw data [2n]
+        3: difference ([2n-1]-[2n])/2
+        4: sum ([2n-1]+[2n])/2
+    """
+    x = data.xCalc
+    y = data.yCalc
+
+    if method == 0:
+        # plain raw data
+        pass
+    elif method == 1:
+        # odd raw data values
+        x = transdat.separateAlternatingSignal(x)[0]
+        y = transdat.separateAlternatingSignal(y)[0]
+    elif method == 2:
+        # even raw data values
+        x = transdat.separateAlternatingSignal(x)[1]
+        y = transdat.separateAlternatingSignal(y)[1]
+    elif method == 3:
+        # difference of odd - even values
+        x = transdat.separateAlternatingSignal(x)[0]
+        y0, y1 = transdat.separateAlternatingSignal(y)
+        out = _out(data, "y")
+        y = np.subtract(y0, y1, out = out(np.shape(y0), np.result_type(y0, y1)) if out else None)
+    elif method == 4:
+        # difference of odd - even values
+        x = transdat.separateAlternatingSignal(x)[0]
+        y0, y1 = transdat.separateAlternatingSignal(y)
+        out = _out(data, "y")
+        y = np.add(y0, y1, out = out(np.shape(y0), np.result_type(y0, y1)) if out else None)
+
+    data.xCalc = x
+    data.yCalc = y
+
+
+@register("averageUpDown", [("tolerance", float, None)])
+def averageUpDown(data, tolerance = None):
+    """
+    Average up and down sweep(s) (located at the turning points of x)
+
+    and mark data as being averaged (for e.g. symmetrization)
+
+    tolerance : float
+        noise of x that doesn't count as a turning point (default: derived
+        from x, see transdat.sweepTolerance())
+    """
+    if not data.isUpDownData:
+        raise Exception("Averaging up-down-sweep only makes sense if there's an up- and down-sweep. The function can only be called once.")
+    boundaries = _upDownBoundaries(data.xCalc, tolerance)
+    data.xCalc = transdat.averageUpDownSweep(data.xCalc, out = _out(data, "x"), boundaries = boundaries)
+    data.yCalc = transdat.averageUpDownSweep(data.yCalc, out = _out(data, "y"), boundaries = boundaries)
+    data.isUpDownData = False
+
+
+@register("averageSweeps", [("nRepetitions", int, None), ("alternating", bool, True), ("tolerance", float, None)])
+def averageSweeps(data, nRepetitions = None, alternating = True, tolerance = None):
+    """
+    Average repeated sweeps (of equal length if nRepetitions is given,
+    otherwise located at the turning points of x)
+
+    and mark data as being averaged (for e.g. symmetrization)
+    """
+    if not data.isUpDownData:
+        raise Exception("Averaging sweeps only makes sense if there are repeated sweeps. The function can only be called once.")
+    boundaries = None
+    if not nRepetitions:
+        boundaries = _sweepBoundaries(data.xCalc, tolerance, alternating)
+        if boundaries is None:
+            nRepetitions = transdat.countSweepRepetitions(data.xCalc, alternating)
+    l.debug("Averaging %d sweeps", nRepetitions or len(boundaries))
+    data.xCalc = transdat.averageSweeps(data.xCalc, nRepetitions, alternating, _out(data, "x"), boundaries)
+    data.yCalc = transdat.averageSweeps(data.yCalc, nRepetitions, alternating, _out(data, "y"), boundaries)
+    data.isUpDownData = False
+
+
+@register("normalize", [("method", int, REQUIRED)])
+def normalize(data, method):
+    """
+    method : int(0-2)
+        0: no normalization (default)
+        1: normalize y to min(y)
+        2: normalize y to max(y)
+    """
+    stats = _rawStats(data)
+    if 0 == method:
+        pass
+    elif 1 == method:
+        # normalize by min(y)
+        data.yCalc = data.yCalc/(stats["min"] if stats else np.min(data.yCalc, axis = -1, keepdims = True))
+    elif 2 == method:
+        # normalize by max(y)
+        data.yCalc = data.yCalc/(stats["max"] if stats else np.max(data.yCalc, axis = -1, keepdims = True))
+
+
+@register("smooth", [("method", int, REQUIRED), ("window", int, REQUIRED), ("order", int, 3)])
+def smooth(data, method, window, order = 3):
+    """
+    method : int(0-2)
+        0: no smoothing (default)
+        1: moving average over window points
+        2: Savitzky-Golay filter of order order over window points
+    """
+    if 0 == method:
+        pass
+    elif 1 == method:
+        data.yCalc = transdat.movingAverage(data.yCalc, window, _out(data, "y"))
+    elif 2 == method:
+        data.yCalc = transdat.savitzkyGolay(data.yCalc, window, order, _out(data, "y"))
+
+
+@register("rejectOutliers", [("window", int, REQUIRED), ("threshold", float, 3.5)])
+def rejectOutliers(data, window, threshold = 3.5):
+    """
+    Replace outliers (rolling median/MAD criterion) in y by the rolling median
+    """
+    data.yCalc, outliers = transdat.rejectOutliers(data.yCalc, window, threshold, _out(data, "y"))
+    l.debug("Rejected %d outliers", np.count_nonzero(outliers))
+
+
+@register("symmetrize", [("method", int, REQUIRED), ("symm_step", float, None), ("symm_center", float, None),
+                         ("tolerance", float, None)])
+def symmetrize(data, method, symm_step = None, symm_center = None, tolerance = None):
+    """
+    method : int(0-2)
+        0: no symmetrization (default)
+        1: symmetrization
+        2: antisymmetrization
+    tolerance : float
+        noise of x that doesn't count as a turning point of up-down data
+        (default: derived from x, see transdat.sweepTolerance())
+    """
+    if ((not symm_step == None and not symm_center == None)
+        or (symm_step == None and symm_center == None)):
+            raise Exception("Provide either a center of symmetry (symm_center) or a symmetry step (symm_step).")
+
+    x = data.xCalc
+    y = data.yCalc
+    if method and symm_step != None and data.isUpDownData:
+        #admr data
+        # only regard the up sweep for finding the period
+        boundaries = _upDownBoundaries(x, tolerance)
+        up = x[boundaries[0, 0]:boundaries[0, 1]] if boundaries is not None else x[0:len(x)//2]
+        stepIdx = int(np.abs((np.abs(up-0)).argmin()
+                   - (np.abs(up-symm_step)).argmin()))
+        stepWidth = (up[(np.abs(up-0)).argmin()]
+                    - up[np.abs(up[1:]-symm_step).argmin()+1])
+        l.debug("(Anti-)Symmetrizing admr data with period %d (val:%f)", stepIdx,np.abs(stepWidth))
+
+        if 1 == method: # symmetrize
+            y = transdat.symmetrizeSignalUpDown(y,stepIdx, _out(data, "y"), boundaries)
+            x = up[0:np.shape(y)[-1]]
+        elif 2 == method: #antisymmetrize
+            y = transdat.antiSymmetrizeSignalUpDown(y,stepIdx, _out(data, "y"), boundaries)
+            x = up[0:np.shape(y)[-1]]
+    elif method and  symm_step != None and not data.isUpDownData:
+        #admr data where up and down sweep are already averaged
+        stepIdx = int(np.abs((np.abs(x-0)).argmin()
+                   - (np.abs(x-symm_step)).argmin()))
+        stepWidth = (x[(np.abs(x-0)).argmin()]
+                    - x[np.abs(x-symm_step).argmin()+1])
+        l.debug("(Anti-)Symmetrizing admr data with period %d (val:%f)", stepIdx,np.abs(stepWidth))
+
+        if 1 == method: # symmetrize
+            y = transdat.symmetrizeSignal(y,stepIdx, _out(data, "y"))
+            x = x[0:np.shape(y)[-1]]
+        elif 2 == method: #antisymmetrize
+            y = transdat.antiSymmetrizeSignal(y,stepIdx, _out(data, "y"))
+            x = x[0:np.shape(y)[-1]]
+    elif method and symm_center != None:
+        centerIdx = (np.abs(x-symm_center)).argmin()
+        l.debug("(Anti-)Symmetrizing data of len %d around index %d (val: %f)", len(x),centerIdx, x[centerIdx])
+        # R(H) data
+        if 1 == method: # symmetrize
+            y = transdat.symmetrizeSignalZero(y,centerIdx, _out(data, "y"))
+            x = x[0:np.shape(y)[-1]][::-1]
+        elif 2 == method: # symmetrize
+            y = transdat.antiSymmetrizeSignalZero(y,centerIdx, _out(data, "y"))
+            x = x[0:np.shape(y)[-1]][::-1]
+
+    data.xCalc = x
+    data.yCalc = y
+
+
+@register("offsetCorrection", [("method", int, REQUIRED), ("offset", float, None)])
+def offsetCorrection(data, method, offset = None):
+    """
+    method : int(0-4)
+        0   -> no offset correction (default)
+        1   -> subtracts min(y)
+        2   -> subtracts max(y)
+        3   -> subtracts mean(y)
+        4   -> subtracts value defined in offset
+    offset : double
+        custom value to subtract from the data (if method = 4) (default = None)
+    """
+    stats = _rawStats(data)
+    if 0 == method:
+        pass
+    elif 1 == method:
+        # subtract min(y)
+        offset = stats["min"] if stats else np.min(data.yCalc, axis = -1, keepdims = True)
+    elif 2 == method:
+        # subtract max(y)
+        offset = stats["max"] if stats else np.max(data.yCalc, axis = -1, keepdims = True)
+    elif 3 == method:
+        # subtract mean(y)
+        offset = stats["mean"] if stats else np.mean(data.yCalc, axis = -1, keepdims = True)
+
+    data.yCalc = data.yCalc-offset
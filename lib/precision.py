@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Session-wide floating point precision of the processing.
+
+By default all data is processed in float64. With setPrecision("float32")
+(or the environment variable PREVIEWTRANSPORTDATA_PRECISION=float32) channel
+data is converted to float32 when segments are read (segments.TransportQuery),
+and the operations of transportdata and DataObject return float32 data.
+Files are cached (npycache) in their source type. This halves memory and bandwidth; the
+resolution of float32 (24 bit mantissa) matches that of the ADCs.
+Accumulations (sums, means) are still done in float64 and fits are always
+done in float64.
+
+accuracyReport() compares the result of a pipeline in the current precision
+with the float64 result.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+import logging
+l = logging.getLogger(__name__) # level is configured in lib/__init__.py
+
+PRECISIONS = {"float32": np.float32, "float64": np.float64}
+
+_floatType = None
+_override = threading.local() # precision of the current thread only (see usePrecision())
+
+
+def setPrecision(precision):
+    """
+    Set the floating point type used for processing
+
+    Parameters
+    ----------
+    precision : str
+        "float32" or "float64"
+    """
+    global _floatType
+    if str(precision) not in PRECISIONS:
+        raise Exception("Unknown precision %s, use one of %s"%(precision, ", ".join(sorted(PRECISIONS))))
+    _floatType = np.dtype(PRECISIONS[str(precision)])
+    l.debug("Processing in %s", _floatType)
+
+
+def floatType():
+    """
+    Floating point type (np.dtype) used for processing (in the current thread)
+    """
+    override = getattr(_override, "floatType", None)
+    if override is not None:
+        return override
+    if _floatType is None:
+        setPrecision(os.environ.get("PREVIEWTRANSPORTDATA_PRECISION", "float64"))
+    return _floatType
+
+
+@contextmanager
+def usePrecision(precision):
+    """
+    Process in precision ("float32" or "float64") in the current thread
+    only, other threads keep the session-wide precision
+
+    Usage example
+    ----------
+    >>> with usePrecision("float64"):
+    ...     x, y = execute(specs, x, y)
+    """
+    if str(precision) not in PRECISIONS:
+        raise Exception("Unknown precision %s, use one of %s"%(precision, ", ".join(sorted(PRECISIONS))))
+    previous = getattr(_override, "floatType", None)
+    _override.floatType = np.dtype(PRECISIONS[str(precision)])
+    try:
+        yield
+    finally:
+        _override.floatType = previous
+
+
+def asFloat(data):
+    """
+    data as array of the processing type if it is floating point data (data
+    of other types is returned unchanged). No copy is made if data already has
+    the processing type.
+    """
+    data = np.asarray(data)
+    if np.issubdtype(data.dtype, np.floating) and data.dtype != floatType():
+        return data.astype(floatType())
+    return data
+
+
+def accuracyReport(specs, x, y, fit = True):
+    """
+    Compare processing x and y with the pipeline specs in the current
+    precision to processing it in float64
+
+    Parameters
+    ----------
+    specs : list of operations.OperationSpec
+        the pipeline
+    x, y : array_like
+        data to process (e.g. one segment)
+    fit : bool
+        also compare the parameters of a cos fit (transportdata.fitcos) of
+        the processed data (x in deg)
+
+    Returns
+    ----------
+    report : dict
+        precision, maxAbsError, rmsError and maxRelError (relative to the
+        range of the float64 result) of the processed y-data. If fit, the
+        deviation of the fit parameters: relative for fit.amplitude and
+        fit.frequency, in rad for fit.phase and relative to the amplitude
+        for fit.y0
+    """
+    from operations import execute
+    import transportdata as transdat
+
+    current = floatType()
+    with usePrecision("float64"):
+        x64, y64 = execute(specs, asFloat(x), asFloat(y))
+    xCur, yCur = execute(specs, asFloat(x), asFloat(y))
+
+    error = np.asarray(yCur, dtype = np.float64) - y64
+    span = np.ptp(y64) if np.size(y64) else 0.
+    report = {"precision": str(current),
+              "maxAbsError": float(np.max(np.abs(error))) if np.size(error) else 0.,
+              "rmsError": float(np.sqrt(np.mean(error**2))) if np.size(error) else 0.,
+              "maxRelError": float(np.max(np.abs(error))/span) if span else 0.}
+    if fit:
+        amplitude64, frequency64, phase64, y064 = transdat.fitcos(np.deg2rad(x64), y64, fitY0 = True)[:4]
+        amplitude, frequency, phase, y0 = transdat.fitcos(np.deg2rad(xCur), yCur, fitY0 = True)[:4]
+        report["fit.amplitude"] = float(abs(amplitude/amplitude64 - 1))
+        report["fit.frequency"] = float(abs(frequency/frequency64 - 1))
+        report["fit.phase"] = float(abs(phase - phase64)) # rad
+        report["fit.y0"] = float(abs(y0 - y064)/abs(amplitude64)) # relative to the amplitude
+    return report
+
+
+def formatReport(report):
+    """
+    accuracyReport() as readable text
+    """
+    return "\n".join("%-16s %s"%(key, report[key] if isinstance(report[key], str) else "%.3e"%report[key])
+                     for key in sorted(report))
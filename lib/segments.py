@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Random access to the field (parameter) segments of measurement data.
+
+A SegmentIndex holds the start and stop offsets of each segment of a field
+channel, so the data recorded at a given field can be looked up in O(1) and
+returned as a view of the channel data without copying or running
+transportdata.preprocessTransportData() on the whole channel.
+
+Usage example
+----------
+>>> query = TransportQuery()
+>>> x, y = query.segment("2014-06-23-YY84-A02-admr_300K.tdms", "Read.K2400_long_oopj",
+                         "owis.Angle (deg)", "K2400U", "IPS.TargetField", field = 3.0)
+>>> x, Y = query.segmentChannels("2014-06-23-YY84-A02-admr_300K.tdms", "Read.K2400_long_oopj",
+                                 "owis.Angle (deg)", ["K2400U", "LockinX", "LockinY"], "IPS.TargetField", field = 3.0)
+>>> fields, segments = query.segmentsInRange("2014-06-23-YY84-A02-admr_300K.tdms", "Read.K2400_long_oopj",
+                                             "owis.Angle (deg)", "K2400U", "IPS.TargetField", 1.0, 5.0)
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+import transportdata as transdat
+from precision import asFloat, floatType
+from tdmsindex import openTdmsIndex
+
+import logging
+l = logging.getLogger(__name__) # level is configured in lib/__init__.py
+
+
+class SegmentIndex(object):
+    """
+    Segment-offset index of a field channel. Segment i has been recorded at
+    field fields[i] and spans the indices start[i]:stop[i] of the channels.
+
+    Segments are numbered in order of measurement (as the entries of the
+    field combo box of the GUI and the list returned by
+    transportdata.preprocessTransportData()).
+
+    Parameters
+    ----------
+    fields : array_like
+        unique field values in order of measurement
+    start : array_like
+        start index of each segment
+    length : int
+        length of the channels (the last segment runs up to here)
+    """
+    def __init__(self, fields, start, length):
+        self.fields = np.asarray(fields)
+        self.start = np.asarray(start, dtype = np.int64)
+        self.stop = np.append(self.start[1:], length).astype(np.int64)
+        self._lookup = dict((field, idx) for idx, field in enumerate(self.fields.tolist()))
+        self._sorted = np.argsort(self.fields)
+
+    @classmethod
+    def fromFieldChannel(cls, field):
+        """
+        Build the index from the recorded field values
+        """
+        fields, start = transdat.segmentUniqueFields(field)
+        return cls(fields, start, np.size(field))
+
+    def __len__(self):
+        return np.size(self.fields)
+
+    def segmentNumber(self, field, tolerance = None):
+        """
+        Number of the segment recorded at field
+
+        Parameters
+        ----------
+        field : float
+            field value of the segment
+        tolerance : float
+            if field is not found exactly, accept the nearest recorded field
+            within tolerance
+        """
+        try:
+            return self._lookup[float(field)]
+        except KeyError:
+            if tolerance is None or not len(self):
+                raise KeyError("No segment recorded at field %s"%field)
+        pos = np.searchsorted(self.fields[self._sorted], field)
+        candidates = self._sorted[max(pos - 1, 0):pos + 1]
+        nearest = candidates[np.argmin(np.abs(self.fields[candidates] - field))]
+        if np.abs(self.fields[nearest] - field) > tolerance:
+            raise KeyError("No segment recorded within %s of field %s"%(tolerance, field))
+        return int(nearest)
+
+    def slice(self, number):
+        """
+        Index range of segment number as a slice
+        """
+        return slice(int(self.start[number]), int(self.stop[number]))
+
+    def segment(self, data, number = None, field = None, tolerance = None):
+        """
+        View of data for one segment, selected by its number or its field
+        """
+        if number is None:
+            number = self.segmentNumber(field, tolerance)
+        return np.asarray(data)[self.slice(number)]
+
+    def inRange(self, fieldMin, fieldMax):
+        """
+        Numbers of all segments with fieldMin <= field <= fieldMax in order
+        of measurement
+        """
+        return np.flatnonzero((self.fields >= fieldMin) & (self.fields <= fieldMax))
+
+    def indices(self, numbers):
+        """
+        Concatenated channel indices of the segments numbers
+        """
+        numbers = np.asarray(numbers, dtype = np.int64)
+        lengths = self.stop[numbers] - self.start[numbers]
+        if not np.sum(lengths):
+            return np.zeros(0, dtype = np.int64)
+        # running index that restarts at the start of each segment
+        offsets = np.repeat(self.start[numbers] - np.cumsum(lengths) + lengths, lengths)
+        return offsets + np.arange(np.sum(lengths))
+
+    def selectRange(self, data, fieldMin, fieldMax):
+        """
+        Views of data for all segments with fieldMin <= field <= fieldMax
+
+        Returns
+        ----------
+        fields : ndarray
+            fields of the selected segments
+        segments : list of ndarray
+            views of data for each selected segment
+        """
+        data = np.asarray(data)
+        numbers = self.inRange(fieldMin, fieldMax)
+        return self.fields[numbers], [data[self.slice(number)] for number in numbers]
+
+
+class TransportQuery(object):
+    """
+    Query layer over the (file, group, channel, field) segments of TDMS files
+
+    Files are opened on first access (unless their TdmsIndex has been added
+    with addIndex()). The SegmentIndex of each field channel is built once
+    and kept for subsequent queries.
+
+    Parameters
+    ----------
+    indexes : list of TdmsIndex (optional)
+        already opened files
+    """
+    def __init__(self, indexes = None):
+        self.indexes = OrderedDict()
+        self.segmentIndexes = {} # (filename, group, field channel) -> SegmentIndex
+        for index in indexes or []:
+            self.addIndex(index)
+
+    def addIndex(self, index):
+        """
+        Make an opened file (TdmsIndex) available to queries
+        """
+        self.indexes[index.filename] = index
+
+    def index(self, filename):
+        """
+        TdmsIndex of filename (the file is opened if necessary)
+        """
+        if filename not in self.indexes:
+            self.addIndex(openTdmsIndex(filename))
+        return self.indexes[filename]
+
+    def segmentIndex(self, filename, group, fieldChannel):
+        """
+        SegmentIndex of fieldChannel in group of filename
+        """
+        key = (filename, group, fieldChannel)
+        if key not in self.segmentIndexes:
+            index = self.index(filename)
+            if (group, fieldChannel) in index.segmentIndexes:
+                # precomputed (see npycache.writeSegments)
+                self.segmentIndexes[key] = index.segmentIndexes[(group, fieldChannel)]
+                return self.segmentIndexes[key]
+            field = index.channelData(group, fieldChannel)
+            self.segmentIndexes[key] = SegmentIndex.fromFieldChannel(field)
+            l.debug("Built segment index of %s with %d segments", key, len(self.segmentIndexes[key]))
+            if index.sidecar is not None:
+                # store the segmentation and the statistics of the segments for the next session
+                import sidecar
+                sidecar.addSegments(index, group, fieldChannel, self.segmentIndexes[key])
+        return self.segmentIndexes[key]
+
+    def segmentStats(self, filename, group, channel, fieldChannel = None, number = None):
+        """
+        min, max and mean of the unprocessed data of channel in one segment
+        (or the whole channel if fieldChannel is None) from the sidecar index.
+        Statistics of a whole channel are computed and stored in the sidecar
+        index on first use.
+
+        Returns
+        ----------
+        stats : dict
+            "min", "max" and "mean" (None if they are not known)
+        """
+        index = self.index(filename)
+        stats = index.segmentStats.get((group, fieldChannel, channel))
+        if stats is None and fieldChannel is None and index.sidecar is not None:
+            import sidecar
+            stats = sidecar.addChannelStats(index, group, channel)
+        if stats is None:
+            return None
+        row = stats[number if fieldChannel is not None else 0]
+        return dict((name, float(row[name])) for name in stats.dtype.names)
+
+    def segment(self, filename, group, xChannel, yChannel, fieldChannel = None, field = None, number = None, tolerance = None):
+        """
+        x- and y-data of one segment as views of the channel data
+
+        Parameters
+        ----------
+        filename, group : str
+            file and group of the channels
+        xChannel, yChannel : str
+            names of the x- and y-channel
+        fieldChannel : str
+            name of the field channel. If None, the whole channels are returned
+        field : float
+            field value of the segment
+        number : int
+            number of the segment in order of measurement (instead of field)
+        tolerance : float
+            accept the nearest recorded field within tolerance
+
+        Returns
+        ----------
+        x, y : ndarray
+            views of the channel data (copies if they are converted to the
+            processing precision, see precision.py)
+        """
+        index = self.index(filename)
+        x = np.asarray(index.channelData(group, xChannel))
+        y = np.asarray(index.channelData(group, yChannel))
+        if fieldChannel is None:
+            return asFloat(x), asFloat(y)
+        segments = self.segmentIndex(filename, group, fieldChannel)
+        if number is None:
+            number = segments.segmentNumber(field, tolerance)
+        return asFloat(x[segments.slice(number)]), asFloat(y[segments.slice(number)])
+
+    def segmentChannels(self, filename, group, xChannel, yChannels, fieldChannel = None, field = None, number = None, tolerance = None, out = None):
+        """
+        x-data and the stacked data of several y-channels of one segment. The
+        segment is looked up once for all channels, so they can be processed
+        together (see operations.execute).
+
+        Parameters
+        ----------
+        yChannels : list of str
+            names of the y-channels (all recorded against xChannel)
+        out : ndarray (optional)
+            buffer of shape (len(yChannels), points) for the stacked data
+        filename, group, xChannel, fieldChannel, field, number, tolerance :
+            see segment()
+
+        Returns
+        ----------
+        x : ndarray
+            view of the x-channel data (see segment())
+        y : ndarray
+            data of the y-channels, shape (len(yChannels), points), in the
+            processing precision (out if given)
+        """
+        index = self.index(filename)
+        selection = slice(None)
+        if fieldChannel is not None:
+            segments = self.segmentIndex(filename, group, fieldChannel)
+            if number is None:
+                number = segments.segmentNumber(field, tolerance)
+            selection = segments.slice(number)
+        x = np.asarray(index.channelData(group, xChannel))[selection]
+        if out is None:
+            out = np.empty((len(yChannels), np.size(x)), dtype = floatType())
+        elif np.shape(out) != (len(yChannels), np.size(x)):
+            raise Exception("out has shape %s, expected %s"%(np.shape(out), (len(yChannels), np.size(x))))
+        for row, yChannel in zip(out, yChannels):
+            row[...] = np.asarray(index.channelData(group, yChannel))[selection]
+        return asFloat(x), out
+
+    def allSegments(self, filename, group, xChannel, yChannel, fieldChannel):
+        """
+        x- and y-data of every segment of fieldChannel. The segment index is
+        looked up and the channels are read once for all segments.
+
+        Returns
+        ----------
+        fields : ndarray
+            fields of the segments (in order of measurement)
+        segments : list of (x, y)
+            views of the channel data for each segment (in the processing
+            precision)
+        stats : list of dict
+            min, max and mean of y in each segment (None if not known, see
+            segmentStats())
+        """
+        index = self.index(filename)
+        x = np.asarray(index.channelData(group, xChannel))
+        y = np.asarray(index.channelData(group, yChannel))
+        segments = self.segmentIndex(filename, group, fieldChannel)
+        numbers = range(len(segments))
+        return (segments.fields,
+                [(asFloat(x[segments.slice(number)]), asFloat(y[segments.slice(number)])) for number in numbers],
+                [self.segmentStats(filename, group, yChannel, fieldChannel, number) for number in numbers])
+
+    def segmentsInRange(self, filename, group, xChannel, yChannel, fieldChannel, fieldMin, fieldMax):
+        """
+        x- and y-data of all segments with fieldMin <= field <= fieldMax
+
+        Returns
+        ----------
+        fields : ndarray
+            fields of the selected segments
+        segments : list of (x, y)
+            views of the channel data for each selected segment (in the
+            processing precision)
+        """
+        index = self.index(filename)
+        x = np.asarray(index.channelData(group, xChannel))
+        y = np.asarray(index.channelData(group, yChannel))
+        segments = self.segmentIndex(filename, group, fieldChannel)
+        numbers = segments.inRange(fieldMin, fieldMax)
+        return segments.fields[numbers], [(asFloat(x[segments.slice(number)]), asFloat(y[segments.slice(number)]))
+                                          for number in numbers]
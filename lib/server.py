@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""
+Local HTTP preview service.
+
+Files are loaded once by the server and processed server-side with the lib
+pipeline (DataObject). Results are kept in a shared cache, so several clients
+looking at the same run do not parse or process it again. Curves are served
+decimated (min/max per bin) as JSON or as compact binary .npy/.npz.
+
+Endpoints (GET, parameters as query string):
+
+    /files                                    loaded files
+    /groups    file                           "Read." groups of a file
+    /channels  file group                     [name, dtype, length] of each channel
+    /fields    file group fieldChannel        fields in order of measurement
+    /curve     file group x y [fieldChannel field|number] [ops] [points] [format]
+    /fieldmap  file group x y fieldChannel [ops] [points] [format]
+
+ops is a JSON list of [operation, parameters] applied in order (see
+operations.OperationSpec.toJson), e.g.
+[["deltaMethod", {"method": 3}], ["averageUpDown", {}]]. format is "json"
+(default) or "npy".
+
+Usage example
+----------
+>>> server = PreviewServer(("localhost", 8050), root = "/data")
+>>> thread = server.serveInBackground()
+>>> client = PreviewClient("localhost", 8050)
+>>> x, y = client.curve("/data/run.tdms", "Read.K2400_long_oopj", "owis.Angle (deg)", "K2400U",
+                        fieldChannel = "IPS.TargetField", number = 0,
+                        ops = [["deltaMethod", {"method": 3}]])
+"""
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qsl
+    from urllib import urlencode
+    from urllib2 import urlopen
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qsl, urlencode
+    from urllib.request import urlopen
+
+import numpy as np
+
+import transportdata as transdat
+import npycache
+from operations import pipelineFromJson, execute
+from segments import TransportQuery
+
+import logging
+l = logging.getLogger(__name__) # level is configured in lib/__init__.py
+
+DEFAULT_POINTS = 2000 # bins of the min/max decimation of served curves
+MAX_POINTS = 100000 # bins (grid points of field maps) a client may request
+DEFAULT_CACHE_SIZE = 256 # number of cached responses
+
+
+class RequestError(Exception):
+    """
+    Invalid request, answered with status 400
+    """
+    pass
+
+
+def requestedPoints(params):
+    """
+    Number of points requested with the points parameter (1..MAX_POINTS)
+    """
+    points = int(params.get("points", DEFAULT_POINTS))
+    if not 1 <= points <= MAX_POINTS:
+        raise RequestError("points must be between 1 and %d, got %d"%(MAX_POINTS, points))
+    return points
+
+
+def processSegment(x, y, ops):
+    """
+    Run the pipeline ops (list of [operation, parameters]) on x and y
+    """
+    try:
+        specs = pipelineFromJson(ops)
+    except Exception as e:
+        raise RequestError(str(e))
+    return execute(specs, x, y)
+
+
+def encodeArrays(fmt, **arrays):
+    """
+    Encode arrays as JSON or as .npy (single array) / .npz (several arrays)
+
+    Returns
+    ----------
+    body : bytes
+    contentType : str
+    """
+    if fmt == "npy":
+        buf = io.BytesIO()
+        if len(arrays) == 1:
+            np.save(buf, list(arrays.values())[0])
+        else:
+            np.savez(buf, **arrays)
+        return buf.getvalue(), "application/octet-stream"
+    if fmt == "json":
+        return encodeJson(dict((k, np.asarray(v).tolist()) for k, v in arrays.items()))
+    raise RequestError("Unknown format %s"%fmt)
+
+
+def encodeJson(value):
+    return json.dumps(value).encode("utf-8"), "application/json"
+
+
+class PreviewServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP server that serves processed data of TDMS files
+
+    Parameters
+    ----------
+    address : (host, port)
+        address to listen on, e.g. ("localhost", 8050)
+    root : str
+        only files below this directory are served (default: current directory)
+    filenames : list of str (optional)
+        files to load at startup
+    cacheSize : int
+        number of responses kept in the shared result cache
+    """
+    daemon_threads = True
+
+    def __init__(self, address, root = None, filenames = None, cacheSize = DEFAULT_CACHE_SIZE):
+        HTTPServer.__init__(self, address, PreviewRequestHandler)
+        self.root = os.path.realpath(root or os.getcwd())
+        self.query = TransportQuery()
+        self.loadLock = threading.Lock()
+        self.cache = OrderedDict() # request -> (body, content type), LRU order
+        self.cacheSize = cacheSize
+        self.cacheLock = threading.Lock()
+        self.pending = {} # request -> threading.Event set once its response is computed
+        for filename in filenames or []:
+            self.index(filename)
+
+    def index(self, filename):
+        """
+        TdmsIndex of filename, loading the file once for all clients
+        """
+        path = os.path.realpath(filename)
+        # the root with exactly one trailing separator (also for "/")
+        root = os.path.join(self.root, "")
+        if not os.path.normcase(path).startswith(os.path.normcase(root)):
+            raise RequestError("%s is not below %s"%(filename, self.root))
+        with self.loadLock:
+            if path not in self.query.indexes:
+                l.info("Loading %s", path)
+                self.query.index(path)
+            return path, self.query.indexes[path]
+
+    def segmentIndex(self, path, group, fieldChannel):
+        with self.loadLock:
+            return self.query.segmentIndex(path, group, fieldChannel)
+
+    def cached(self, key, compute):
+        """
+        Response for key from the cache, computed with compute() if missing.
+        Concurrent requests for a missing key wait for the first one to
+        compute it instead of computing it again.
+        """
+        while True:
+            with self.cacheLock:
+                if key in self.cache:
+                    self.cache[key] = self.cache.pop(key) # mark as recently used
+                    return self.cache[key]
+                pending = self.pending.get(key)
+                if pending is None:
+                    pending = self.pending[key] = threading.Event()
+                    break
+            # computed by another request (check the cache again, it may
+            # have failed or been evicted already)
+            pending.wait()
+        try:
+            response = compute()
+            with self.cacheLock:
+                self.cache[key] = response
+                while len(self.cache) > self.cacheSize:
+                    self.cache.popitem(last = False)
+            return response
+        finally:
+            with self.cacheLock:
+                del self.pending[key]
+            pending.set()
+
+    def serveInBackground(self):
+        """
+        Serve in a daemon thread, returns the thread
+        """
+        thread = threading.Thread(target = self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    # %% Endpoints
+    def files(self, params):
+        return encodeJson(list(self.query.indexes.keys()))
+
+    def groups(self, params):
+        path, index = self.index(params["file"])
+        return encodeJson(index.groupNames("Read."))
+
+    def channels(self, params):
+        path, index = self.index(params["file"])
+        group = params["group"]
+        return encodeJson([[name, str(index.channel(group, name).dtype), index.channel(group, name).length]
+                           for name in index.channelNames(group)])
+
+    def fields(self, params):
+        path, index = self.index(params["file"])
+        return encodeJson(self.segmentIndex(path, params["group"], params["fieldChannel"]).fields.tolist())
+
+    def curve(self, params):
+        points = requestedPoints(params)
+        path, index = self.index(params["file"])
+        ops = json.loads(params.get("ops", "[]"))
+        fieldChannel = params.get("fieldChannel")
+        number = int(params["number"]) if "number" in params else None
+        field = float(params["field"]) if "field" in params else None
+        if fieldChannel is not None:
+            self.segmentIndex(path, params["group"], fieldChannel)
+        x, y = self.query.segment(path, params["group"], params["x"], params["y"],
+                                  fieldChannel, field = field, number = number)
+        x, y = processSegment(x, y, ops)
+        x, y = transdat.decimateMinMax(x, y, points)
+        return encodeArrays(params.get("format", "json"), curve = np.vstack((x, y)))
+
+    def fieldmap(self, params):
+        points = requestedPoints(params)
+        path, index = self.index(params["file"])
+        ops = json.loads(params.get("ops", "[]"))
+        segments = self.segmentIndex(path, params["group"], params["fieldChannel"])
+        # precomputed by the directory watcher (see watcher.resultKey)
+        stored = npycache.readResult(path, [params["group"], params["x"], params["y"], params["fieldChannel"], ops])
+        if stored is not None:
+            results = stored[1]
+        else:
+            results = []
+            for number in range(len(segments)):
+                x, y = self.query.segment(path, params["group"], params["x"], params["y"],
+                                          params["fieldChannel"], number = number)
+                results.append(processSegment(x, y, ops))
+
+        # resample all segments onto a common x grid
+        xMin = min(np.min(x) for x, y in results)
+        xMax = max(np.max(x) for x, y in results)
+        grid = np.linspace(xMin, xMax, points)
+        z = np.empty((len(results), points))
+        for row, (x, y) in enumerate(results):
+            order = np.argsort(x, kind = "mergesort")
+            z[row] = np.interp(grid, x[order], y[order], left = np.nan, right = np.nan)
+        return encodeArrays(params.get("format", "json"), fields = segments.fields, x = grid, z = z)
+
+
+class PreviewRequestHandler(BaseHTTPRequestHandler):
+    """
+    Dispatches GET requests to the endpoints of PreviewServer
+    """
+    endpoints = ("files", "groups", "channels", "fields", "curve", "fieldmap")
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        endpoint = url.path.strip("/")
+        params = dict(parse_qsl(url.query))
+        if endpoint not in self.endpoints:
+            self.respond(404, *encodeJson({"error": "Unknown endpoint %s"%endpoint}))
+            return
+        key = (endpoint, tuple(sorted(params.items())))
+        try:
+            if endpoint in ("curve", "fieldmap"):
+                body, contentType = self.server.cached(key, lambda: getattr(self.server, endpoint)(params))
+            else:
+                body, contentType = getattr(self.server, endpoint)(params)
+        except (RequestError, KeyError, ValueError) as e:
+            self.respond(400, *encodeJson({"error": "%s: %s"%(type(e).__name__, e)}))
+            return
+        except Exception as e:
+            l.exception("Error answering %s", self.path)
+            self.respond(500, *encodeJson({"error": str(e)}))
+            return
+        self.respond(200, body, contentType)
+
+    def respond(self, status, body, contentType):
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        l.debug("%s - %s", self.address_string(), fmt%args)
+
+
+class PreviewClient(object):
+    """
+    Client of a PreviewServer
+
+    Parameters
+    ----------
+    host, port : str, int
+        address of the server
+    """
+    def __init__(self, host = "localhost", port = 8050):
+        self.url = "http://%s:%d"%(host, port)
+
+    def get(self, endpoint, **params):
+        """
+        Raw response body of endpoint
+        """
+        response = urlopen("%s/%s?%s"%(self.url, endpoint, urlencode(params)))
+        try:
+            return response.read()
+        finally:
+            response.close()
+
+    def getJson(self, endpoint, **params):
+        return json.loads(self.get(endpoint, **params).decode("utf-8"))
+
+    def curve(self, filename, group, x, y, fieldChannel = None, field = None, number = None, ops = None, points = DEFAULT_POINTS):
+        """
+        Processed and decimated curve (transferred as .npy)
+
+        Returns
+        ----------
+        x, y : ndarray
+        """
+        params = {"file": filename, "group": group, "x": x, "y": y,
+                  "ops": json.dumps(ops or []), "points": points, "format": "npy"}
+        if fieldChannel is not None:
+            params["fieldChannel"] = fieldChannel
+        if field is not None:
+            params["field"] = repr(float(field))
+        if number is not None:
+            params["number"] = number
+        curve = np.load(io.BytesIO(self.get("curve", **params)))
+        return curve[0], curve[1]
+
+    def fieldmap(self, filename, group, x, y, fieldChannel, ops = None, points = DEFAULT_POINTS):
+        """
+        Processed data of all fields resampled onto a common x grid
+
+        Returns
+        ----------
+        fields : ndarray
+        x : ndarray
+        z : ndarray of shape (len(fields), len(x))
+        """
+        params = {"file": filename, "group": group, "x": x, "y": y, "fieldChannel": fieldChannel,
+                  "ops": json.dumps(ops or []), "points": points, "format": "npy"}
+        data = np.load(io.BytesIO(self.get("fieldmap", **params)))
+        return data["fields"], data["x"], data["z"]
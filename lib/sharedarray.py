@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Shared-memory transport of numpy arrays to worker processes.
+
+Passing channel arrays to a process pool pickles (copies) them to every
+worker. With SharedArrays the source channels and output buffers are placed
+in shared blocks once; only small, picklable handles (SharedArrayHandle) are
+sent to the workers, which map the blocks and operate on views of them.
+
+Blocks are created with multiprocessing.shared_memory where available
+(python >= 3.8). Otherwise they are memory-mapped temporary files (on
+/dev/shm if it exists), which are shared between processes through the page
+cache without copying as well.
+
+The creating process owns the blocks: they are released by
+SharedArrays.close() (or when leaving the with-block). Workers keep the blocks
+they attached to mapped until detach() is called or the worker exits.
+
+Usage example
+----------
+>>> with SharedArrays() as shared:
+...     field = shared.share(fieldChannel)   # copied once into shared memory
+...     y = shared.share(voltageChannel)
+...     out = shared.empty(np.shape(voltageChannel), np.float64)
+...     segments = SegmentIndex.fromFieldChannel(shared.array(field))
+...     mapSegments(functools.partial(transdat.movingAverage, window = 5), [y], segments, out = out)
+...     result = np.array(shared.array(out)) # copy out before the blocks are released
+"""
+import os
+import shutil
+import tempfile
+import uuid
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+import logging
+l = logging.getLogger(__name__) # level is configured in lib/__init__.py
+
+DEFAULT_WORKERS = max(1, cpu_count() - 1)
+
+_attached = {} # blocks mapped by this process: name -> (block, array)
+
+
+class SharedArrayHandle(object):
+    """
+    Picklable reference to an array in a shared block (see SharedArrays)
+
+    Parameters
+    ----------
+    backend : str
+        "shm" (multiprocessing.shared_memory) or "mmap" (memory-mapped file)
+    name : str
+        name of the shared memory block or path of the mapped file
+    shape : tuple
+        shape of the array
+    dtype : str
+        dtype of the array (as np.dtype.str)
+    """
+    def __init__(self, backend, name, shape, dtype):
+        self.backend = backend
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = dtype
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape))*np.dtype(self.dtype).itemsize
+
+    def __repr__(self):
+        return "SharedArrayHandle(%r, %r, %s, %s)"%(self.backend, self.name, self.shape, self.dtype)
+
+
+def _mapBlock(handle, create = False):
+    """
+    Map the block of handle, returns (block, array). block is the
+    SharedMemory object that has to be kept alive as long as array is used
+    (None for the mmap backend)
+    """
+    size = max(handle.nbytes, 1) # blocks of size 0 are not allowed
+    if handle.backend == "shm":
+        if create:
+            block = shared_memory.SharedMemory(name = handle.name, create = True, size = size)
+        else:
+            try:
+                # do not let the resource tracker of a worker unlink the block
+                block = shared_memory.SharedMemory(name = handle.name, track = False)
+            except TypeError:
+                block = shared_memory.SharedMemory(name = handle.name)
+        array = np.ndarray(handle.shape, dtype = handle.dtype, buffer = block.buf)
+        return block, array
+    if create:
+        with open(handle.name, "wb") as f:
+            f.truncate(size)
+    if not handle.nbytes:
+        return None, np.empty(handle.shape, dtype = handle.dtype)
+    return None, np.memmap(handle.name, dtype = handle.dtype, mode = "r+", shape = handle.shape)
+
+
+def attach(handle):
+    """
+    View of the shared array of handle in the current (worker) process.
+    Each block is mapped only once per process.
+    """
+    if handle.name not in _attached:
+        _attached[handle.name] = _mapBlock(handle)
+    return _attached[handle.name][1]
+
+
+def detach(handle = None):
+    """
+    Unmap the block of handle (all blocks if None) in the current process
+    """
+    names = [handle.name] if handle is not None else list(_attached.keys())
+    for name in names:
+        block, array = _attached.pop(name, (None, None))
+        del array
+        if block is not None:
+            try:
+                block.close()
+            except BufferError:
+                l.warn("Shared array %s is still in use", name)
+
+
+class SharedArrays(object):
+    """
+    Owner of shared blocks of arrays; releases all of them on close()
+
+    Parameters
+    ----------
+    backend : str (optional)
+        "shm" or "mmap". Default: "shm" if multiprocessing.shared_memory is
+        available, "mmap" otherwise
+    directory : str (optional)
+        directory of the mapped files of the mmap backend (default: a new
+        temporary directory, on /dev/shm if it exists)
+    """
+    def __init__(self, backend = None, directory = None):
+        if backend is None:
+            backend = "shm" if shared_memory is not None else "mmap"
+        if backend == "shm" and shared_memory is None:
+            raise Exception("multiprocessing.shared_memory is not available, use the mmap backend")
+        self.backend = backend
+        self.directory = None
+        if backend == "mmap":
+            self.directory = directory or tempfile.mkdtemp(prefix = "sharedarray-",
+                                                           dir = "/dev/shm" if os.path.isdir("/dev/shm") else None)
+        self.blocks = {} # name -> (handle, block, array)
+
+    def empty(self, shape, dtype = np.float64):
+        """
+        Allocate an (uninitialized) shared array
+
+        Returns
+        ----------
+        handle : SharedArrayHandle
+        """
+        if np.isscalar(shape):
+            shape = (shape,)
+        name = uuid.uuid4().hex[:24] # names of shared memory blocks are limited to 30 characters on macOS
+        if self.backend == "mmap":
+            name = os.path.join(self.directory, name)
+        handle = SharedArrayHandle(self.backend, name, shape, np.dtype(dtype).str)
+        block, array = _mapBlock(handle, create = True)
+        self.blocks[name] = (handle, block, array)
+        l.debug("Allocated shared array %s (%d bytes)", handle, handle.nbytes)
+        return handle
+
+    def share(self, array):
+        """
+        Copy array into a new shared block (the only copy that is made)
+
+        Returns
+        ----------
+        handle : SharedArrayHandle
+        """
+        array = np.asarray(array)
+        handle = self.empty(array.shape, array.dtype)
+        self.array(handle)[...] = array
+        return handle
+
+    def array(self, handle):
+        """
+        View of the shared array of handle in the owning process
+        """
+        return self.blocks[handle.name][2]
+
+    def release(self, handle):
+        """
+        Free the block of handle. Views of it must not be used afterwards.
+        """
+        handle, block, array = self.blocks.pop(handle.name)
+        del array
+        if block is not None:
+            try:
+                block.close()
+            except BufferError:
+                # views are still in use, the memory is freed once they are gone
+                l.warn("Shared array %s is still in use", handle.name)
+            block.unlink()
+        elif os.path.exists(handle.name):
+            os.remove(handle.name)
+
+    def close(self):
+        """
+        Free all blocks
+        """
+        for name in list(self.blocks.keys()):
+            try:
+                self.release(self.blocks[name][0])
+            except (OSError, IOError) as e:
+                l.warn("Could not release shared array %s: %s", name, e)
+        if self.directory is not None and os.path.isdir(self.directory):
+            shutil.rmtree(self.directory, ignore_errors = True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __del__(self):
+        if self.blocks:
+            self.close()
+
+
+def _segmentTask(args):
+    """
+    Worker: apply func to the views of one segment of the shared inputs and
+    write the result to the shared output (or return it)
+    """
+    func, handles, start, stop, out = args
+    views = [attach(handle)[start:stop] for handle in handles]
+    result = func(*views)
+    if out is None:
+        return result
+    attach(out)[start:stop] = result
+
+
+def mapSegments(func, handles, segments, out = None, workers = DEFAULT_WORKERS, pool = None):
+    """
+    Apply func to every segment of shared arrays in a process pool. Only the
+    handles and the segment bounds are sent to the workers.
+
+    Parameters
+    ----------
+    func : callable(*views)
+        picklable (module level) function, called with the views of one
+        segment of each array in handles
+    handles : list of SharedArrayHandle
+        shared input arrays (e.g. x- and y-channel)
+    segments : segments.SegmentIndex
+        segments to fan out
+    out : SharedArrayHandle (optional)
+        shared output array of the length of the inputs. The result of func
+        for a segment (of the length of the segment) is written to out at the
+        position of the segment
+    workers : int
+        number of worker processes (if no pool is given)
+    pool : multiprocessing.Pool (optional)
+        pool to run the tasks in (e.g. to reuse it for several calls)
+
+    Returns
+    ----------
+    results : list
+        results of func for each segment (None for each segment if out is given)
+    """
+    tasks = [(func, list(handles), int(start), int(stop), out)
+             for start, stop in zip(segments.start, segments.stop)]
+    if pool is not None:
+        return pool.map(_segmentTask, tasks)
+    ownPool = Pool(max(1, min(workers, len(tasks))))
+    try:
+        return ownPool.map(_segmentTask, tasks)
+    finally:
+        ownPool.close()
+        ownPool.join()
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent sidecar index of a TDMS file.
+
+The sidecar index stores the facts about a file that every session needs:
+groups and channels (dtype and length), the segmentation of field channels
+(unique field values and their start offsets) and min/max/mean of every
+channel, as a whole and per segment. It is written to <file>.tdms.sidecar.json
+next to the TDMS file (or to a per-user cache directory if that is not
+writable) and validated by size and modification time of the TDMS file.
+
+With a valid sidecar index a file is opened without parsing it (see
+tdmsindex.openTdmsIndex): filling the group, channel and field boxes, looking
+up segments and min/max/mean based normalization and offset correction of
+unprocessed data are answered from the sidecar index. The TDMS file is only
+read once channel data is accessed.
+
+Segmentations are added by segments.TransportQuery as soon as they are first
+computed (addSegments). Statistics of channels that are not in memory when
+the sidecar index is written (e.g. memory-mapped from the npycache) are
+computed on first use (addChannelStats), so opening a file doesn't read all
+of its data.
+"""
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from npycache import sourceStamp, replaceFile
+from tdmsindex import TdmsIndex, ChannelInfo
+
+import logging
+l = logging.getLogger(__name__) # level is configured in lib/__init__.py
+
+SIDECAR_VERSION = 1
+SUFFIX = ".sidecar.json"
+USER_CACHE = os.path.join(os.path.expanduser("~"), ".previewTransportData", "sidecar")
+
+STATS_DTYPE = np.dtype([("min", np.float64),
+                        ("max", np.float64),
+                        ("mean", np.float64)])
+
+
+def sidecarPaths(filename):
+    """
+    Possible locations of the sidecar index of filename: next to the file
+    and in the per-user cache directory
+    """
+    digest = hashlib.sha1(os.path.abspath(filename).encode("utf-8")).hexdigest()
+    return [filename + SUFFIX, os.path.join(USER_CACHE, digest + SUFFIX)]
+
+
+def readSidecar(filename):
+    """
+    Sidecar index of filename (None if there is none or it is outdated)
+    """
+    for path in sidecarPaths(filename):
+        try:
+            with open(path) as f:
+                stored = json.load(f)
+            if stored.get("version") == SIDECAR_VERSION and stored.get("source") == sourceStamp(filename):
+                stored["path"] = path
+                return stored
+        except (OSError, IOError, ValueError):
+            continue
+    return None
+
+
+def writeSidecar(filename, stored):
+    """
+    Write the sidecar index of filename (atomically, next to the file if
+    possible). Failing to write is logged, not raised.
+
+    Returns
+    ----------
+    stored : dict
+        the sidecar index
+    """
+    stored["version"] = SIDECAR_VERSION
+    stored["source"] = sourceStamp(filename)
+    paths = [stored["path"]] if stored.get("path") else sidecarPaths(filename)
+    for path in paths:
+        try:
+            if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+                os.makedirs(os.path.dirname(os.path.abspath(path)))
+            content = dict((k, v) for k, v in stored.items() if k != "path")
+            with open(path + ".tmp", "w") as f:
+                json.dump(content, f)
+            replaceFile(path + ".tmp", path)
+            stored["path"] = path
+            return stored
+        except (OSError, IOError) as e:
+            l.debug("Could not write sidecar index %s: %s", path, e)
+    l.warn("Could not write a sidecar index for %s", filename)
+    return stored
+
+
+def channelStats(data, start = None):
+    """
+    min, max and mean of data, per segment if the start offsets of the
+    segments are given
+
+    Returns
+    ----------
+    stats : ndarray of STATS_DTYPE
+    """
+    data = np.asarray(data)
+    if start is None:
+        start = [0]
+    start = np.asarray(start, dtype = np.int64)
+    stats = np.zeros(np.size(start), dtype = STATS_DTYPE)
+    if not np.size(data) or not np.size(start):
+        return stats
+    lengths = np.diff(np.append(start, np.size(data)))
+    stats["min"] = np.minimum.reduceat(data, start)
+    stats["max"] = np.maximum.reduceat(data, start)
+    stats["mean"] = np.add.reduceat(data, start, dtype = np.float64)/lengths
+    return stats
+
+
+def _statsToJson(stats):
+    return [stats["min"].tolist(), stats["max"].tolist(), stats["mean"].tolist()]
+
+
+def _statsFromJson(value):
+    stats = np.zeros(len(value[0]), dtype = STATS_DTYPE)
+    stats["min"], stats["max"], stats["mean"] = value
+    return stats
+
+
+def _isNumeric(data):
+    return data is not None and np.issubdtype(np.asarray(data).dtype, np.number)
+
+
+def sidecarFromIndex(index):
+    """
+    Sidecar index (groups, channels and statistics of each channel) of an
+    opened file. Statistics are only computed for channels read into memory
+    (i.e. parsed from the TDMS file), the others are left to
+    addChannelStats().
+    """
+    groups = []
+    for group, channels in index.groups.items():
+        entries = []
+        for name, channel in channels.items():
+            data = channel.channel.data if channel.channel is not None else None
+            stats = _statsToJson(channelStats(data)) if _isNumeric(data) and np.size(data) else None
+            entries.append([name, channel.dtype.str if channel.dtype is not None else None, channel.length, stats])
+        groups.append([group, entries])
+    return {"groups": groups, "segments": []}
+
+
+def indexFromSidecar(filename, stored):
+    """
+    TdmsIndex of filename built from its sidecar index. The TDMS file is
+    opened on first access to channel data.
+    """
+    index = TdmsIndex(filename)
+    for group, entries in stored["groups"]:
+        channels = index.groups.setdefault(group, OrderedDict())
+        for name, dtype, length, stats in entries:
+            channels[name] = ChannelInfo(group, name, np.dtype(dtype) if dtype else None, length,
+                                         loader = index.loadChannel)
+    return index
+
+
+def applySidecar(index, stored):
+    """
+    Attach segmentations and statistics of the sidecar index to index
+    """
+    from segments import SegmentIndex
+    for group, entries in stored["groups"]:
+        for name, dtype, length, stats in entries:
+            if stats is not None:
+                index.segmentStats[(group, None, name)] = _statsFromJson(stats)
+    for group, fieldChannel, fields, start, length, stats in stored["segments"]:
+        index.segmentIndexes.setdefault((group, fieldChannel), SegmentIndex(fields, start, length))
+        for name, value in stats.items():
+            index.segmentStats[(group, fieldChannel, name)] = _statsFromJson(value)
+    index.sidecar = stored
+
+
+def addChannelStats(index, group, name):
+    """
+    Compute the statistics of the whole channel name in group (if they are
+    not known yet) and store them in the sidecar index of index.filename
+
+    Returns
+    ----------
+    stats : ndarray of STATS_DTYPE
+        statistics of the channel (None if it has no numeric data)
+    """
+    if (group, None, name) in index.segmentStats:
+        return index.segmentStats[(group, None, name)]
+    data = index.channelData(group, name)
+    if not _isNumeric(data) or not np.size(data):
+        return None
+    stats = channelStats(data)
+    index.segmentStats[(group, None, name)] = stats
+
+    stored = getattr(index, "sidecar", None) or readSidecar(index.filename) or sidecarFromIndex(index)
+    for storedGroup, entries in stored["groups"]:
+        for entry in entries:
+            if (storedGroup, entry[0]) == (group, name):
+                entry[3] = _statsToJson(stats)
+    index.sidecar = writeSidecar(index.filename, stored)
+    return stats
+
+
+def addSegments(index, group, fieldChannel, segments):
+    """
+    Compute the per-segment statistics of all channels of group that have
+    the length of fieldChannel and store them with the segmentation in the
+    sidecar index of index.filename
+    """
+    length = int(segments.stop[-1]) if len(segments) else 0
+    stats = {}
+    for name in index.channelNames(group):
+        channel = index.channel(group, name)
+        if channel.length != length:
+            continue
+        data = channel.data
+        if _isNumeric(data):
+            stats[name] = channelStats(data, segments.start)
+            index.segmentStats[(group, fieldChannel, name)] = stats[name]
+    index.segmentIndexes[(group, fieldChannel)] = segments
+
+    stored = getattr(index, "sidecar", None) or readSidecar(index.filename) or sidecarFromIndex(index)
+    stored["segments"] = [entry for entry in stored["segments"] if (entry[0], entry[1]) != (group, fieldChannel)]
+    stored["segments"].append([group, fieldChannel, segments.fields.tolist(), segments.start.tolist(), length,
+                               dict((name, _statsToJson(value)) for name, value in stats.items())])
+    index.sidecar = writeSidecar(index.filename, stored)
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Metadata index of a TDMS file.
+
+The index is built once when a file is loaded and maps
+group -> ordered channel names -> channel handle (with dtype and length), so
+looking up groups and channels does not need to parse channel paths or scan
+channel lists again.
+"""
+import re
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+import logging
+l = logging.getLogger(__name__) # level is configured in lib/__init__.py
+
+from fileloader import openTdmsFile
+
+
+def channelName(channel):
+    """
+    Name of a TDMS channel, parsed from its path /'group'/'channel'
+    """
+    return re.search(r"'/'(.+)'", channel.path).group(1)
+
+
+class ChannelInfo(object):
+    """
+    Metadata of a single channel and its handle in the TDMS file
+
+    Class Members
+    ----------
+    self.group : str
+        name of the group the channel belongs to
+    self.name : str
+        name of the channel
+    self.dtype : np.dtype
+        dtype of the channel data (None if the channel has no data)
+    self.length : int
+        number of data points in the channel
+    self.channel : nptdms channel object
+        handle of the channel in the TDMS file
+    self.npyPath : str
+        .npy file the channel data is memory-mapped from instead (if the
+        index has been opened from a npycache)
+    self.loader : callable(group, name)
+        returns the channel handle on first access to the data (if the index
+        has been built from a sidecar index without opening the TDMS file)
+    """
+    def __init__(self, group, name, dtype, length, channel = None, npyPath = None, loader = None):
+        self.group = group
+        self.name = name
+        self.dtype = dtype
+        self.length = length
+        self.channel = channel
+        self.npyPath = npyPath
+        self.loader = loader
+        self._data = None
+
+    @property
+    def data(self):
+        if self.channel is None and self.loader is not None:
+            self.channel = self.loader(self.group, self.name)
+        if self.channel is not None:
+            return self.channel.data
+        if self._data is None and self.npyPath is not None:
+            # pages are only read from disk when they are accessed
+            self._data = np.load(self.npyPath, mmap_mode = "r")
+        return self._data
+
+    def __repr__(self):
+        return "ChannelInfo(%r, %r, %s, %d)"%(self.group, self.name, self.dtype, self.length)
+
+
+class TdmsIndex(object):
+    """
+    Index of groups and channels of a TDMS file.
+
+    Parameters
+    ----------
+    filename : str
+        path of the TDMS file
+    tdmsFile : nptdms.TdmsFile (optional)
+        opened TDMS file to build the index for. If omitted, an empty index
+        is created (to be filled e.g. from a npycache manifest)
+
+    Class Members
+    ----------
+    self.filename : str
+        path of the TDMS file
+    self.tdmsFile : nptdms.TdmsFile
+        the indexed TDMS file (None if not opened)
+    self.groups : OrderedDict
+        group name -> OrderedDict(channel name -> ChannelInfo) in the order
+        of the file
+    self.segmentIndexes : dict
+        (group, field channel) -> segments.SegmentIndex precomputed e.g. by
+        the directory watcher (filled from the npycache or the sidecar index)
+    self.segmentStats : dict
+        (group, field channel, channel) -> min, max and mean of the channel
+        in each segment (structured array, see sidecar.STATS_DTYPE). The
+        field channel is None for the statistics of the whole channel
+    """
+    def __init__(self, filename, tdmsFile = None):
+        self.filename = filename
+        self.tdmsFile = tdmsFile
+        self.groups = OrderedDict()
+        self.segmentIndexes = {}
+        self.segmentStats = {}
+        self.sidecar = None # sidecar index the index has been built from or updated with
+        self.released = [] # weak references to unloaded channel data (see release())
+        self.openLock = threading.Lock() # the file may be opened from several threads (e.g. thumbnails)
+        if tdmsFile is None:
+            return
+
+        for group in tdmsFile.groups():
+            channels = OrderedDict()
+            for channel in tdmsFile.group_channels(group):
+                data = channel.data
+                name = channelName(channel)
+                channels[name] = ChannelInfo(group, name,
+                                             data.dtype if data is not None else None,
+                                             np.size(data) if data is not None else 0,
+                                             channel)
+            self.groups[group] = channels
+        l.debug("Indexed %d groups of %s", len(self.groups), filename)
+
+    def groupNames(self, prefix = None):
+        """
+        Names of all groups (starting with prefix if given)
+        """
+        if prefix is None:
+            return list(self.groups.keys())
+        return [group for group in self.groups if group.startswith(prefix)]
+
+    def channelNames(self, group):
+        """
+        Ordered names of the channels in group
+        """
+        return list(self.groups[group].keys())
+
+    def channel(self, group, name):
+        """
+        ChannelInfo of channel name in group
+        """
+        return self.groups[group][name]
+
+    def channelData(self, group, name):
+        """
+        Data of channel name in group
+        """
+        return self.groups[group][name].data
+
+    def openFile(self):
+        """
+        Open the TDMS file if the index has been built without it (once, also
+        if several threads access channel data at the same time)
+        """
+        with self.openLock:
+            if self.tdmsFile is None:
+                l.debug("Opening %s on first access to channel data", self.filename)
+                self.tdmsFile = openTdmsFile(self.filename)
+        return self.tdmsFile
+
+    def loadChannel(self, group, name):
+        """
+        Handle of a channel in the TDMS file (opened if necessary)
+        """
+        return self.openFile().object(group, name)
+
+    def memoryUsage(self):
+        """
+        Bytes of channel data read into memory from the TDMS file (nptdms
+        reads the whole file; data memory-mapped from the npycache is not
+        counted). Unloaded channel data that is still alive (e.g. because
+        data objects hold views of it) is counted as well.
+        """
+        self.released = [ref for ref in self.released if ref() is not None]
+        usage = sum(ref().nbytes for ref in self.released)
+        if self.tdmsFile is None:
+            return usage
+        return usage + sum(info.length*info.dtype.itemsize for channels in self.groups.values()
+                           for info in channels.values() if info.channel is not None and info.dtype is not None)
+
+    def release(self, spillDirectory = None):
+        """
+        Unload the channel data read from the TDMS file (see memory.py). The
+        file is read again on the next access to channel data. Data that is
+        still referenced elsewhere (e.g. views held by data objects) is only
+        freed once these references are gone.
+        """
+        if self.tdmsFile is None:
+            return
+        for channels in self.groups.values():
+            for info in channels.values():
+                if info.channel is not None:
+                    if isinstance(info.channel.data, np.ndarray):
+                        self.released.append(weakref.ref(info.channel.data))
+                    info.channel = None
+                    info.loader = self.loadChannel
+        self.tdmsFile = None
+        l.debug("Unloaded the channel data of %s", self.filename)
+
+
+def openTdmsIndex(filename, useNpyCache = True, useSidecar = True):
+    """
+    Open a TDMS file and build its index (loader for fileloader.loadFiles)
+
+    If useNpyCache and a valid .npy cache of the file exists (see
+    npycache.convertTdmsToNpy), the channels are memory-mapped from the cache
+    instead of parsing the TDMS file.
+
+    If useSidecar, the index is built from the sidecar index of the file (see
+    sidecar.py) without opening the TDMS file, which is then only opened on
+    first access to channel data. Segmentations and statistics stored in the
+    sidecar index are attached to the index. The sidecar index is written
+    if there is none yet.
+    """
+    index = None
+    if useNpyCache:
+        import npycache
+        if npycache.isCacheValid(filename):
+            l.debug("Opening %s from its npy cache", filename)
+            index = npycache.openNpyCache(filename)
+    if not useSidecar:
+        return index or TdmsIndex(filename, openTdmsFile(filename))
+
+    import sidecar
+    stored = sidecar.readSidecar(filename)
+    if index is None and stored is not None:
+        l.debug("Opening %s from its sidecar index", filename)
+        index = sidecar.indexFromSidecar(filename, stored)
+    if index is None:
+        index = TdmsIndex(filename, openTdmsFile(filename))
+    if stored is None:
+        stored = sidecar.writeSidecar(filename, sidecar.sidecarFromIndex(index))
+    sidecar.applySidecar(index, stored)
+    return index
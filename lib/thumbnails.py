@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Overview thumbnails of all channels of a measurement file.
+
+A thumbnail is a min/max decimated trace of a channel (see
+transportdata.decimateMinMax) with about 2*nBins points, so peaks and
+outliers stay visible. Channels are decimated in blocks of at most blockSize
+points, so memory stays bounded for channels that are memory-mapped from the
+npycache.
+
+Thumbnails are cached per file in the per-user cache directory (validated by
+size and modification time of the file) and generated in a background
+thread by ThumbnailGenerator, which reports each thumbnail as soon as it is
+ready.
+
+Usage example
+----------
+>>> generator = ThumbnailGenerator(index, lambda group, channel, x, y: ...)
+>>> generator.start()
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import transportdata as transdat
+from npycache import sourceStamp, replaceFile
+
+import logging
+l = logging.getLogger(__name__) # level is configured in lib/__init__.py
+
+THUMBNAIL_BINS = 200
+BLOCK_SIZE = 2**20 # points decimated at once
+USER_CACHE = os.path.join(os.path.expanduser("~"), ".previewTransportData", "thumbnails")
+
+
+def channelThumbnail(data, nBins = THUMBNAIL_BINS, blockSize = BLOCK_SIZE):
+    """
+    Min/max decimated trace of a channel
+
+    Parameters
+    ----------
+    data : array_like
+        channel data
+    nBins : int
+        number of bins of equal number of points; the minimum and the
+        maximum of each bin are kept
+    blockSize : int
+        maximum number of points read and decimated at once
+
+    Returns
+    ----------
+    x : ndarray
+        indices of the kept points in data
+    y : ndarray (float64)
+        values of the kept points
+    """
+    n = np.size(data)
+    if n <= 2*nBins:
+        return np.arange(n), np.asarray(data, dtype = np.float64)
+
+    perBin = n//nBins
+    binsPerBlock = max(1, blockSize//perBin)
+    xs, ys = [], []
+    for firstBin in range(0, nBins, binsPerBlock):
+        bins = min(binsPerBlock, nBins - firstBin)
+        start, stop = firstBin*perBin, (firstBin + bins)*perBin
+        x, y = transdat.decimateMinMax(np.arange(start, stop), np.asarray(data[start:stop], dtype = np.float64), bins)
+        xs.append(x)
+        ys.append(y)
+    if nBins*perBin < n:
+        # remaining points that don't fill a whole bin
+        tail = np.asarray(data[nBins*perBin:], dtype = np.float64)
+        idx = np.unique([tail.argmin(), tail.argmax()])
+        xs.append(nBins*perBin + idx)
+        ys.append(tail[idx])
+    return np.concatenate(xs), np.concatenate(ys)
+
+
+def thumbnailPath(filename):
+    """
+    Cache file of the thumbnails of filename
+    """
+    digest = hashlib.sha1(os.path.abspath(filename).encode("utf-8")).hexdigest()
+    return os.path.join(USER_CACHE, digest + ".npz")
+
+
+def readThumbnails(filename):
+    """
+    Cached thumbnails of filename
+
+    Returns
+    ----------
+    thumbnails : OrderedDict
+        (group, channel) -> (x, y), empty if there is no valid cache
+    """
+    thumbnails = OrderedDict()
+    try:
+        with np.load(thumbnailPath(filename)) as stored:
+            if json.loads(str(stored["source"])) != sourceStamp(filename):
+                return thumbnails
+            for i, (group, channel) in enumerate(json.loads(str(stored["names"]))):
+                thumbnails[(group, channel)] = (stored["x_%d"%i], stored["y_%d"%i])
+    except (OSError, IOError, KeyError, ValueError):
+        pass
+    return thumbnails
+
+
+def writeThumbnails(filename, thumbnails):
+    """
+    Cache the thumbnails of filename. Failing to write is logged, not raised.
+    """
+    path = thumbnailPath(filename)
+    arrays = {"source": np.array(json.dumps(sourceStamp(filename))),
+              "names": np.array(json.dumps([list(key) for key in thumbnails]))}
+    for i, (x, y) in enumerate(thumbnails.values()):
+        arrays["x_%d"%i] = x
+        arrays["y_%d"%i] = y
+    try:
+        if not os.path.isdir(USER_CACHE):
+            os.makedirs(USER_CACHE)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, **arrays)
+        replaceFile(path + ".tmp", path)
+    except (OSError, IOError) as e:
+        l.warn("Could not cache the thumbnails of %s: %s", filename, e)
+
+
+class ThumbnailGenerator(object):
+    """
+    Generate the thumbnails of all channels of a file in a background thread
+
+    Parameters
+    ----------
+    index : tdmsindex.TdmsIndex
+        the opened file
+    callback : callable(group, channel, x, y)
+        called (from the generator thread) for each thumbnail as soon as it
+        is ready; cached thumbnails are reported first
+    done : callable(thumbnails) (optional)
+        called (from the generator thread) with all thumbnails when finished
+    groupPrefix : str
+        only channels of groups starting with groupPrefix are shown
+    nBins, blockSize :
+        see channelThumbnail()
+    """
+    def __init__(self, index, callback, done = None, groupPrefix = "Read.",
+                 nBins = THUMBNAIL_BINS, blockSize = BLOCK_SIZE):
+        self.index = index
+        self.callback = callback
+        self.done = done
+        self.groupPrefix = groupPrefix
+        self.nBins = nBins
+        self.blockSize = blockSize
+        self.thumbnails = OrderedDict()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start generating in a daemon thread
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target = self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout = None):
+        """
+        Stop generating (after the current channel). The thumbnails
+        generated so far are cached, done is not called.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        filename = self.index.filename
+        cached = readThumbnails(filename)
+        generated = 0
+        stopped = False
+        for group in self.index.groupNames(self.groupPrefix):
+            for channel in self.index.channelNames(group):
+                stopped = self._stop.is_set()
+                if stopped:
+                    break
+                key = (group, channel)
+                if key not in cached:
+                    try:
+                        data = self.index.channelData(group, channel)
+                        if data is None or not np.issubdtype(np.asarray(data).dtype, np.number):
+                            continue
+                        cached[key] = channelThumbnail(data, self.nBins, self.blockSize)
+                        generated += 1
+                    except Exception as e:
+                        l.error("Error generating the thumbnail of %s/%s: %s", group, channel, e)
+                        continue
+                self.thumbnails[key] = cached[key]
+                self.callback(group, channel, *cached[key])
+            if stopped:
+                break
+        if generated:
+            # all thumbnails known (also the cached ones not reported before
+            # stopping), the next run generates the missing ones only
+            writeThumbnails(filename, cached)
+        l.debug("Thumbnails of %s: %d cached, %d generated%s", filename, len(self.thumbnails) - generated, generated,
+                " (stopped)" if stopped else "")
+        if self.done is not None and not stopped:
+            self.done(self.thumbnails)
@@ -4,19 +4,64 @@ Created on Mon Jun 23 13:32:51 2014
 
 Shared functions for processing transport measurement data.
 
+The functions take views where possible: slicing, separating and reversing
+data never copies it. Functions computing new data accept an optional out=
+buffer the result is written to (and returned), so a chain of operations
+only allocates its final outputs. out may also be a callable(shape, dtype)
+returning the buffer (e.g. from operations.Buffers) for callers that don't
+know the shape of the result in advance. Each function documents whether it
+copies.
+
+The processing functions work along the last axis, so y may also be the
+stacked data of several channels recorded against the same x (shape
+(channels, points)) which are then processed in one vectorized run.
+
+Up and down sweeps are located by sweepBoundaries(), which detects the
+turning points of the swept channel (x). Averaging (averageUpDownSweep) and
+symmetrization of up-down data (symmetrizeSignalUpDown,
+antiSymmetrizeSignalUpDown) take these boundaries, so aborted or asymmetric
+sweeps and repeated up/down cycles are handled. Without boundaries the data
+is split in halves.
+
 @author: hannes.maierflaig
 """
 
 import numpy as np
-import scipy.optimize as optimize
-import scipy.fftpack as fftpack
+# scipy is imported on first use in the fitting routines to keep importing
+# this module cheap
+
+# data is returned in the processing precision (float64 unless configured
+# otherwise), fits are always done in float64
+from precision import floatType
 
 import logging
-logging.basicConfig()
-l = logging.getLogger(__name__)
-l.setLevel(logging.DEBUG)
+l = logging.getLogger(__name__) # level is configured in lib/__init__.py
+
+def _floatDtype(y):
+    """
+    dtype of the result of averaging y: its own floating type or the
+    processing type for integer data
+    """
+    return y.dtype if np.issubdtype(y.dtype, np.floating) else floatType()
+
+
+def _output(out, y, size, dtype):
+    """
+    Buffer for a result of size points along the last axis of y: out if
+    given (its shape is checked; a callable is called with shape and
+    dtype), otherwise a new array
+    """
+    shape = np.shape(y)[:-1] + (int(size),)
+    if out is None:
+        return np.empty(shape, dtype = dtype)
+    if callable(out):
+        out = out(shape, dtype)
+    if np.shape(out) != shape:
+        raise Exception("out has shape %s, expected %s"%(np.shape(out), shape))
+    return out
 
-def symmetrizeSignalZero(y, idx = None):
+
+def symmetrizeSignalZero(y, idx = None, out = None):
     """
     Dischard antisymmetric (around center index or around idx) part by 
     taking the sum of the signal at x[idx_centre +n] and x[idx_centre -n]
@@ -27,28 +72,33 @@ def symmetrizeSignalZero(y, idx = None):
         numpy array or list of data values to anti symmtetrize
     idx : scalar
         index of center to symmetrize around if ommitted len(y)/2 is taken as idx
+    out : ndarray (optional)
+        buffer for the result
     
     Returns
     ----------
     y_symmetrized : ndarray
-        numpy array of dimension size(y)/2 of the symmetrized data
+        numpy array of dimension size(y)/2 of the symmetrized data (out if
+        given, y is not copied)
     """
-    y = np.array(y)
-    if not np.size(y)%2 and idx == None:
+    y = np.asarray(y)
+    if not np.shape(y)[-1]%2 and idx == None:
         raise Exception("Data needs to have an uneven number of elements if no center index (idx) is provided")
     if not idx:
-        idx = np.size(y)/2
+        idx = np.shape(y)[-1]//2
         idx_start = 0
-        idx_end = np.size(y)
+        idx_end = np.shape(y)[-1]
     else:
-        idx_end = min((np.size(y), idx*2+1))
+        idx_end = min((np.shape(y)[-1], idx*2+1))
         idx_start = max(0, idx-(idx_end - idx)+1)
         
-    y = (y[idx_start:idx] + y[idx+1:idx_end][::-1])/2
-    return y
+    out = _output(out, y, idx - idx_start, _floatDtype(y))
+    np.add(y[..., idx_start:idx], y[..., idx+1:idx_end][..., ::-1], out = out)
+    out *= .5
+    return out
 
 
-def antiSymmetrizeSignalZero(y, idx = None):
+def antiSymmetrizeSignalZero(y, idx = None, out = None):
     """
     Dischard symmetric (around center index or around idx) part by 
     taking the difference of the signal at x[idx_centre +n] and x[idx_centre -n]
@@ -59,28 +109,33 @@ def antiSymmetrizeSignalZero(y, idx = None):
         numpy array or list of data values to anti symmtetrize
     idx : scalar
         index of center to symmetrize around if ommitted len(y)/2 is taken as idx
+    out : ndarray (optional)
+        buffer for the result
     
     Returns
     ----------
     y_symmetrized : ndarray
-        numpy array of dimension size(y)/2 of the antisymmetrized data
+        numpy array of dimension size(y)/2 of the antisymmetrized data (out
+        if given, y is not copied)
     """
-    y = np.array(y)
-    if not np.size(y)%2 and idx == None:
+    y = np.asarray(y)
+    if not np.shape(y)[-1]%2 and idx == None:
         raise Exception("Data needs to have an uneven number of elements if no center index (idx) is provided")
     if not idx:
-        idx = np.size(y)/2
-        idx_end = np.size(y)
+        idx = np.shape(y)[-1]//2
+        idx_end = np.shape(y)[-1]
         idx_start = 0
     else:
-        idx_end = min((np.size(y), idx*2+1))
+        idx_end = min((np.shape(y)[-1], idx*2+1))
         idx_start = max(0, idx-(idx_end - idx)+1)
         
-    y = (y[idx_start:idx] - y[idx+1:idx_end][::-1])/2
-    return y
+    out = _output(out, y, idx - idx_start, _floatDtype(y))
+    np.subtract(y[..., idx_start:idx], y[..., idx+1:idx_end][..., ::-1], out = out)
+    out *= .5
+    return out
     
     
-def antiSymmetrizeSignal(y, symmetryStep):
+def antiSymmetrizeSignal(y, symmetryStep, out = None):
     """    
     Dischard symmetric part of a signal by 
     taking the difference of the signal at x[n] and x[n + symmetry_step]
@@ -92,22 +147,27 @@ def antiSymmetrizeSignal(y, symmetryStep):
         numpy array or list of data values to anti symmtetrize
     symmetryStep : scalar
         expected symmetry of the signal at x[n] occurs at x[n+symmetryStep]
+    out : ndarray (optional)
+        buffer for the result
     
     Returns
     ----------
     y_symmetrized : ndarray
-        numpy array of dimension size(y)/2 of the antisymmetrized data
+        numpy array of dimension size(y)/2 of the antisymmetrized data (out
+        if given, y is not copied)
     """
-    y = np.array(y)
-        
-    s = np.zeros(len(y)/2)
-    for idx in range(0, len(s)):
-        # (positive field - negative field)/2
-        s[idx] = (y[idx] - y[idx+symmetryStep])/2.-(y[0] - y[0+symmetryStep])/2.
-    return s
+    y = np.asarray(y)
+    n = np.shape(y)[-1]//2
+    
+    out = _output(out, y, n, floatType())
+    # (positive field - negative field)/2, relative to the first point
+    np.subtract(y[..., 0:n], y[..., symmetryStep:symmetryStep+n], out = out)
+    out -= y[..., 0:1] - y[..., symmetryStep:symmetryStep+1]
+    out *= .5
+    return out
 
 
-def symmetrizeSignal(y, symmetryStep):
+def symmetrizeSignal(y, symmetryStep, out = None):
     """
     Dischard antisymmetric part of a signal by taking the sum of the signal at
     x[idx_centre +n] and x[idx_centre +n + symmetry_step].
@@ -120,21 +180,58 @@ def symmetrizeSignal(y, symmetryStep):
         numpy array or list of data values to anti symmtetrize
     symmetryStep : scalar
         expected symmetry of the signal at x[n] occurs at x[n+symmetryStep]
+    out : ndarray (optional)
+        buffer for the result
     
     Returns
     ----------
     y_symmetrized : ndarray
-        numpy array of dimension size(y)/2 of the symmetrized data
+        numpy array of dimension size(y)-symmetryStep of the symmetrized data
+        (out if given, y is not copied)
     """
-    y = np.array(y)
-        
-    s = np.zeros(len(y)-symmetryStep)
-    for idx in range(0, len(s)):
-        s[idx] = (y[idx] + y[idx+symmetryStep])/2.-(y[0] + y[0+symmetryStep])/2.
-    return s
+    y = np.asarray(y)
+    n = np.shape(y)[-1] - symmetryStep
+    
+    out = _output(out, y, n, floatType())
+    np.add(y[..., 0:n], y[..., symmetryStep:], out = out)
+    out -= y[..., 0:1] + y[..., symmetryStep:symmetryStep+1]
+    out *= .5
+    return out
+
+
+def _upDownSweeps(y, boundaries = None):
+    """
+    Up and (reversed) down sweep of y as views
+
+    Returns
+    ----------
+    yU, yD : ndarray
+        first sweep and reversed second sweep
+    offset : int
+        yD[..., j] belongs to yU[..., j + offset]: the sweeps are aligned at
+        the turning point (0 without boundaries, where y is split in halves
+        that are aligned at their outer ends)
+    """
+    if boundaries is None:
+        half = np.shape(y)[-1]//2
+        return y[..., 0:half], y[..., half:][..., ::-1], 0
+    if len(boundaries) < 2:
+        raise Exception("Data needs to consist of an up and a down sweep, found %d sweep(s)"%len(boundaries))
+    (startU, stopU), (startD, stopD) = boundaries[0], boundaries[1]
+    return y[..., startU:stopU], y[..., startD:stopD][..., ::-1], (stopU - startU) - (stopD - startD)
+
+
+def _shiftedDownSweep(yD, offset, symmetryStep):
+    """
+    Points symmetryStep..2*symmetryStep of the down sweep yD (in indices of
+    the up sweep)
+    """
+    if symmetryStep - offset < 0 or 2*symmetryStep - offset > np.shape(yD)[-1]:
+        raise Exception("Down sweep of %d points is too short for symmetry step %d"%(np.shape(yD)[-1], symmetryStep))
+    return yD[..., symmetryStep - offset:2*symmetryStep - offset]
 
 
-def symmetrizeSignalUpDown(y, symmetryStep):
+def symmetrizeSignalUpDown(y, symmetryStep, out = None, boundaries = None):
     """
     Symmetrize a signal that is recorded as an up and down sweep by calculating
     the cross sum between up and down sweep of values shifted by symmetry step.
@@ -147,28 +244,32 @@ def symmetrizeSignalUpDown(y, symmetryStep):
         numpy array or list of data values to anti symmtetrize
     symmetryStep : scalar
         expected symmetry of the signal at x[n] occurs at x[n+symmetryStep]
+    out : ndarray (optional)
+        buffer for the result
+    boundaries : ndarray (optional)
+        sweep boundaries (see sweepBoundaries()), the first two sweeps are
+        used as up and down sweep; if omitted y is split in halves
     
     Returns
     ----------
     y_symmetrized : ndarray
-        numpy array of dimension size(y)/2 of the symmetrized data
+        numpy array of dimension 2*symmetryStep of the symmetrized data (out
+        if given, y is not copied)
     """
-    y=np.array(y)
+    y = np.asarray(y)
  
-    yU = y[0:len(y)/2] # up sweep (for the sake of the argument)                    
-    yD = y[len(y)/2:][::-1] # down sweep w/ same axis
-    
+    # up sweep (for the sake of the argument) and down sweep w/ same axis (views)
+    yU, yD, offset = _upDownSweeps(y, boundaries)
     
-    sL = np.zeros(2*symmetryStep)
-    for idx in range(0, symmetryStep):
-        sL[idx] = (yU[idx] + yD[idx+symmetryStep])/2
-    for idx in range(symmetryStep,2*symmetryStep):
-        sL[idx] = (yU[idx] + yU[idx-symmetryStep])/2.
-    return sL
+    out = _output(out, y, 2*symmetryStep, floatType())
+    np.add(yU[..., 0:symmetryStep], _shiftedDownSweep(yD, offset, symmetryStep), out = out[..., 0:symmetryStep])
+    np.add(yU[..., symmetryStep:2*symmetryStep], yU[..., 0:symmetryStep], out = out[..., symmetryStep:])
+    out *= .5
+    return out
     
     
 
-def antiSymmetrizeSignalUpDown(y, symmetryStep):
+def antiSymmetrizeSignalUpDown(y, symmetryStep, out = None, boundaries = None):
     """
     Antisymmetrize a signal that is recorded as an up and down sweep by calculating
     the cross difference between up and down sweep of values shifted by symmetry step.
@@ -181,23 +282,28 @@ def antiSymmetrizeSignalUpDown(y, symmetryStep):
         numpy array or list of data values to anti symmtetrize
     symmetryStep : scalar
         expected symmetry of the signal at x[n] occurs at x[n+symmetryStep]
+    out : ndarray (optional)
+        buffer for the result
+    boundaries : ndarray (optional)
+        sweep boundaries (see sweepBoundaries()), the first two sweeps are
+        used as up and down sweep; if omitted y is split in halves
     
     Returns
     ----------
     y_symmetrized : ndarray
-        numpy array of dimension size(y)/2 of the antisymmetrized data
+        numpy array of dimension 2*symmetryStep of the antisymmetrized data
+        (out if given, y is not copied)
     """
-    y=np.array(y)
+    y = np.asarray(y)
 
-    yU = y[0:len(y)/2] # up sweep (for the sake of the argument)                    
-    yD = y[len(y)/2:][::-1] # down sweep w/ same axis
+    # up sweep (for the sake of the argument) and down sweep w/ same axis (views)
+    yU, yD, offset = _upDownSweeps(y, boundaries)
     
-    sL = np.zeros(2*symmetryStep)
-    for idx in range(0, symmetryStep):
-        sL[idx] = (yU[idx] - yD[idx+symmetryStep])/2
-    for idx in range(symmetryStep,2*symmetryStep):
-        sL[idx] = (yU[idx] - yU[idx-symmetryStep])/2.
-    return sL
+    out = _output(out, y, 2*symmetryStep, floatType())
+    np.subtract(yU[..., 0:symmetryStep], _shiftedDownSweep(yD, offset, symmetryStep), out = out[..., 0:symmetryStep])
+    np.subtract(yU[..., symmetryStep:2*symmetryStep], yU[..., 0:symmetryStep], out = out[..., symmetryStep:])
+    out *= .5
+    return out
     
 def separateAlternatingSignal(x):
     """
@@ -206,35 +312,554 @@ def separateAlternatingSignal(x):
     Returns    
     ----------
     separated_signal : list of two arrays (x[2n], x[2n-1])
+        strided views of x (no copy). Copy them before modifying them in
+        place if x must not change.
     """
-    if np.size(x)%2:
-        x = x[:-1]
+    x = np.asarray(x)
+    if np.shape(x)[-1]%2:
+        x = x[..., :-1]
         l.warn("""Data does not have an even number of elements. Dropping last datapoint. 
         Maybe the data has not been recorded using a delta method?""")
-    return np.array(x[0::2]), np.array(x[1::2])
+    return x[..., 0::2], x[..., 1::2]
+
+
+def sweepTolerance(x):
+    """
+    Default tolerance of sweepBoundaries(): half the typical step between
+    successive values of the swept channel. Repeated samples of one value
+    (e.g. delta method, averaging at each angle) only differ by the readback
+    noise, so the typical step is taken as the median of the largest 5% of
+    the steps.
+    """
+    step = np.abs(np.diff(np.asarray(x, dtype = np.float64)))
+    step = step[step > 0]
+    if not np.size(step):
+        return 0.
+    return .5*float(np.median(step[step >= np.percentile(step, 95)]))
+
 
+def _nextTurn(x, start, direction, tolerance, blockSize = 256):
+    """
+    Index of the next extremum of x after start (a maximum for direction 1,
+    a minimum for -1) that x leaves by more than tolerance and the index
+    where it does so, (None, None) if x doesn't turn anymore. x is scanned in blocks of growing size, so finding all
+    turning points is linear in the length of x.
+    """
+    n = np.shape(x)[-1]
+    peak, peakIdx = direction*x[start], start
+    pos = start + 1
+    while pos < n:
+        block = direction*x[pos:pos + blockSize]
+        running = np.maximum(np.maximum.accumulate(block), peak)
+        turned = np.flatnonzero(running - block > tolerance)
+        stop = turned[0] if len(turned) else len(block)
+        if stop and block[0:stop].max() > peak:
+            peakIdx = pos + int(block[0:stop].argmax())
+            peak = block[peakIdx - pos]
+        if len(turned):
+            return peakIdx, pos + int(turned[0])
+        pos += len(block)
+        blockSize *= 2
+    return None, None
+
+
+def sweepBoundaries(x, tolerance = None, alternating = True):
+    """
+    Split the swept values x (e.g. the angle channel) into its monotonic
+    runs (sweeps) at the turning points, in one pass over the data.
+    
+    A turning point is an extremum that x leaves by more than tolerance in
+    the other direction (hysteresis), so readback noise of the swept channel
+    doesn't start new sweeps. The samples at a turning point (the extremum
+    and the samples around it within tolerance, e.g. its repetitions) are
+    split evenly between the two sweeps; of an odd number of them the middle
+    one is dropped, so e.g. for 0..360..0 the up sweep ends at 359 and the
+    down sweep starts at 359 again.
     
-def averageUpDownSweep(x, num=1):
+    Parameters
+    ----------
+    x : array_like
+        swept values (1-d)
+    tolerance : scalar (optional)
+        largest excursion from an extremum that doesn't count as a change of
+        direction (default: sweepTolerance(x))
+    alternating : bool
+        sweeps alternate in direction (default: True). If False (e.g. a
+        sawtooth) only the sweeps in the direction of the first one are
+        returned, from turning point to turning point (including both), the
+        sweeps back in between are dropped.
+    
+    Returns
+    ----------
+    boundaries : ndarray of int, shape (number of sweeps, 2)
+        start and stop index of each sweep (x[start:stop]), in order of
+        measurement; up and down sweeps alternate (if alternating)
+    """
+    x = np.asarray(x)
+    n = np.shape(x)[-1]
+    if tolerance is None:
+        tolerance = sweepTolerance(x)
+    moved = np.flatnonzero(np.abs(x - x[0]) > tolerance) if n else []
+    if not len(moved):
+        return np.array([[0, n]], dtype = np.intp)
+
+    starts, stops = [0], []
+    direction = 1 if x[moved[0]] > x[0] else -1
+    start = 0
+    while True:
+        peakIdx, turnIdx = _nextTurn(x, start, direction, tolerance)
+        if peakIdx is None:
+            break
+        # samples at the extremum
+        near = np.abs(x[start:peakIdx + 1][::-1] - x[peakIdx]) > tolerance
+        first = peakIdx + 1 - (int(near.argmax()) if near.any() else peakIdx + 1 - start)
+        last = peakIdx - 1 + int((np.abs(x[peakIdx:turnIdx + 1] - x[peakIdx]) > tolerance).argmax())
+        repeated = last - first + 1
+        stops.append(first + repeated//2)
+        starts.append(last + 1 - repeated//2)
+        start = last
+        direction = -direction
+    stops.append(n)
+    boundaries = np.array([starts, stops], dtype = np.intp).T
+    if not alternating:
+        # from the end of a sweep back to the start of the next one
+        count = (len(boundaries) + 1)//2
+        boundaries = np.array([np.append(0, boundaries[1::2, 1])[:count],
+                               np.append(boundaries[1::2, 0], n)[:count]], dtype = np.intp).T
+    return boundaries
+
+    
+def averageUpDownSweep(x, num=1, out = None, boundaries = None):
     """
     Calculate x[center+n] + x[center-n] of a signal thereby data recorded as up,
     then down sweep can be averaged.
+    
+    For num = 1 and an uneven number of elements, the center element (the
+    turning point of the sweep) is dropped. For num > 1 the data is treated
+    as 2**num alternating sweeps, see averageSweeps().
+    
+    With boundaries, all sweeps are averaged (num is ignored), see
+    averageSweeps().
        
     Parameters
     ----------
     x : data (list or numpy array) to average
     num : apply algorithm num times to average more than once (default: 1)
+    out : ndarray (optional) buffer for the result
+    boundaries : ndarray (optional) sweep boundaries, see sweepBoundaries()
     
     Returns    
     ----------
-    x_averaged : numpy array of the averaged data
+    x_averaged : numpy array of the averaged data (out if given; for num = 0
+        x itself, not a copy, unless out is given)
     """
-    x = np.array(x)
-    for i in range(num):
-        x = (x[0:np.size(x)/2] + x[::-1][0:np.size(x)/2])/2
-    return x
+    x = np.asarray(x)
+    if boundaries is not None:
+        return averageSweeps(x, alternating = True, out = out, boundaries = boundaries)
+    if num == 0:
+        if out is None:
+            return x
+        out = _output(out, x, np.shape(x)[-1], x.dtype)
+        out[...] = x
+        return out
+    if num == 1:
+        half = np.shape(x)[-1]//2
+        out = _output(out, x, half, _floatDtype(x))
+        np.add(x[..., 0:half], x[..., ::-1][..., 0:half], out = out)
+        out *= .5
+        return out
+    return averageSweeps(x, 2**num, alternating = True, out = out)
+    
+
+def countSweepRepetitions(x, alternating = True):
+    """
+    Count the repeated sweeps in x: for alternating sweeps the number of
+    monotonic runs (e.g. 0..360, 360..0, 0..360 are 3 sweeps), otherwise the
+    number of sweeps in the direction of the first one (e.g. 0..360, 0..360,
+    0..360 are 3 sweeps, the jumps back are not counted). Repeated values are
+    ignored.
+    
+    Parameters
+    ----------
+    x : array_like
+        swept values (e.g. the angle channel)
+    alternating : bool
+        sweeps alternate in direction (default: True)
     
+    Returns
+    ----------
+    n : int
+        number of sweeps (see sweepBoundaries())
+    """
+    return len(sweepBoundaries(x, alternating = alternating))
     
-def preprocessTransportData(field, angle, U, I = None, fields = None, n_angle_points = None, delta_method = True):
+
+def averageSweeps(x, nRepetitions = None, alternating = True, out = None, boundaries = None):
+    """
+    Average nRepetitions sweeps of equal length recorded one after another by
+    reshaping the data to (nRepetitions, points per sweep) and taking the
+    mean along the repetitions.
+    
+    With boundaries, the sweeps between the boundaries are averaged instead
+    (nRepetitions is ignored). They are aligned at their ends (in the
+    direction of the first sweep, i.e. at the turning points for alternating
+    sweeps) and cut to the length of the shortest one, so aborted sweeps can
+    be averaged.
+    
+    Parameters
+    ----------
+    x : array_like
+        data of all sweeps
+    nRepetitions : int
+        number of sweeps in x (see countSweepRepetitions() to detect it from
+        the swept channel)
+    alternating : bool
+        sweeps alternate in direction (up, down, up, ...); every second sweep
+        is reversed before averaging (default: True)
+    out : ndarray (optional)
+        buffer for the result
+    boundaries : ndarray (optional)
+        start and stop index of each sweep (see sweepBoundaries(); for sweeps
+        that are not alternating only those in the direction of the first
+        sweep)
+    
+    Returns
+    ----------
+    x_averaged : ndarray
+        averaged sweep in the direction of the first sweep (out if given).
+        The sweeps are views of x; the sum is accumulated in float64, in out
+        if it is a float64 array (no further allocation). With boundaries
+        the result has the floating type of x and the sum is accumulated in
+        it.
+    """
+    x = np.asarray(x)
+    if boundaries is not None:
+        # sweeps in the direction of the first one (views)
+        sweeps = [x[..., start:stop][..., ::-1 if alternating and i%2 else 1] for i, (start, stop) in enumerate(boundaries)]
+        length = min(np.shape(sweep)[-1] for sweep in sweeps)
+        if not length:
+            raise Exception("Can't average sweeps, found an empty one in %s"%np.asarray(boundaries).tolist())
+        out = _output(out, x, length, _floatDtype(x))
+        out[...] = sweeps[0][..., np.shape(sweeps[0])[-1] - length:]
+        for sweep in sweeps[1:]:
+            out += sweep[..., np.shape(sweep)[-1] - length:]
+        out *= 1./len(sweeps)
+        return out
+    if nRepetitions is None:
+        raise Exception("Provide either the number of sweeps (nRepetitions) or their boundaries")
+    length = np.shape(x)[-1]//nRepetitions
+    if length*nRepetitions != np.shape(x)[-1]:
+        raise Exception("%d data points can't be split into %d sweeps of equal length"%(np.shape(x)[-1], nRepetitions))
+    
+    sweeps = x.reshape(np.shape(x)[:-1] + (nRepetitions, length))
+    out = _output(out, x, length, floatType()) if out is not None else None
+    accumulator = out if out is not None and out.dtype == np.float64 else None
+    if alternating:
+        # sum up- and (reversed) down-sweeps separately to avoid copying
+        averaged = np.sum(sweeps[..., 0::2, :], axis = -2, dtype = np.float64, out = accumulator)
+        for repetition in range(1, nRepetitions, 2):
+            averaged += sweeps[..., repetition, ::-1]
+        averaged /= nRepetitions
+    else:
+        averaged = np.mean(sweeps, axis = -2, dtype = np.float64, out = accumulator)
+    if out is None:
+        return averaged.astype(floatType(), copy = False)
+    if averaged is not out:
+        out[...] = averaged
+    return out
+    
+
+class RunningSweepAverage(object):
+    """
+    Running mean of sweeps that arrive one after another (e.g. while the
+    measurement is still running).
+    
+    Parameters
+    ----------
+    alternating : bool
+        sweeps alternate in direction; every second sweep is reversed
+        before it is added (default: True)
+    
+    Class Members
+    ----------
+    self.mean : ndarray
+        average of all sweeps added so far (None before the first one)
+    self.count : int
+        number of sweeps added so far
+    """
+    def __init__(self, alternating = True):
+        self.alternating = alternating
+        self.mean = None
+        self.count = 0
+    
+    def add(self, sweep):
+        """
+        Add one sweep and return the updated mean
+        """
+        sweep = np.asarray(sweep)
+        if self.alternating and self.count%2:
+            sweep = sweep[::-1]
+        if self.mean is None:
+            self.mean = np.array(sweep, dtype = np.float64)
+        elif np.size(sweep) != np.size(self.mean):
+            raise Exception("Sweep has %d points, expected %d"%(np.size(sweep), np.size(self.mean)))
+        else:
+            self.mean += (sweep - self.mean)/(self.count + 1)
+        self.count += 1
+        return self.mean
+    
+    def addSweeps(self, x, nRepetitions):
+        """
+        Add nRepetitions sweeps of equal length recorded one after another in x
+        """
+        x = np.asarray(x)
+        length = np.size(x)//nRepetitions
+        if length*nRepetitions != np.size(x):
+            raise Exception("%d data points can't be split into %d sweeps of equal length"%(np.size(x), nRepetitions))
+        for sweep in x.reshape(nRepetitions, length):
+            self.add(sweep)
+        return self.mean
+    
+    
+def movingAverage(y, window, out = None):
+    """
+    Centered moving average of y over window points, computed from the
+    cumulative sum in linear time (independent of window). At the edges the
+    average is taken over the points available.
+    
+    Parameters
+    ----------
+    y : array_like
+        data to smooth
+    window : int
+        number of points to average
+    out : ndarray (optional)
+        buffer for the result (must not be y)
+    
+    Returns
+    ----------
+    y_smoothed : ndarray
+        smoothed data of the same size as y (out if given). The cumulative
+        sum is a temporary float64 array of the size of y.
+    """
+    y = np.asarray(y)
+    n = np.shape(y)[-1]
+    out = _output(out, y, n, floatType())
+    if not n:
+        return out
+    window = max(1, min(int(window), n))
+    half = window//2
+    # subtracting the mean keeps the cumulative sum small (rounding errors)
+    mean = np.mean(y, axis = -1, dtype = np.float64, keepdims = True)
+    cumsum = np.empty(np.shape(y)[:-1] + (n + 1,))
+    cumsum[..., 0] = 0.
+    np.subtract(y, mean, out = cumsum[..., 1:])
+    np.cumsum(cumsum[..., 1:], axis = -1, out = cumsum[..., 1:])
+    # points with the whole window inside the data
+    inner = out[..., half:half + n - window + 1]
+    np.subtract(cumsum[..., window:], cumsum[..., :n - window + 1], out = inner)
+    inner /= window
+    # edges: average over the points available
+    hi = np.arange(window - half, window)
+    out[..., :half] = cumsum[..., hi]/hi
+    lo = np.arange(n - window + 1, n - half)
+    out[..., half + n - window + 1:] = (cumsum[..., n:n + 1] - cumsum[..., lo])/(n - lo)
+    out += mean
+    return out
+    
+
+def savitzkyGolay(y, window, order = 3, out = None):
+    """
+    Savitzky-Golay filter of y (least squares polynomial of order order over
+    window points), linear time in the length of y.
+    
+    Parameters
+    ----------
+    y : array_like
+        data to smooth
+    window : int
+        length of the filter window (is made odd and > order if necessary)
+    order : int
+        order of the fitted polynomial (default: 3)
+    out : ndarray (optional)
+        buffer for the result
+    
+    Returns
+    ----------
+    y_smoothed : ndarray
+        smoothed data of the same size as y (out if given). scipy returns a
+        new array that is copied to out. If the window is longer than y, y is
+        returned unchanged (not a copy unless out is given or y is converted
+        to the processing type).
+    """
+    import scipy.signal as signal
+    y = np.asarray(y, dtype = floatType())
+    window = int(window) | 1 # odd
+    if window <= order:
+        window = order + 1 + order%2 # smallest odd window > order
+    if window > np.shape(y)[-1]:
+        smoothed = y
+    else:
+        smoothed = signal.savgol_filter(y, window, order, mode = "interp").astype(floatType(), copy = False)
+    if out is None:
+        return smoothed
+    out = _output(out, y, np.shape(y)[-1], floatType())
+    out[...] = smoothed
+    return out
+    
+
+def rollingMedian(y, window, out = None):
+    """
+    Centered rolling median of y over window points (edges are padded with
+    the nearest value) by scipy.ndimage.median_filter, which takes up to
+    O(n*window). The result is written to out if given (must not be y),
+    otherwise to a new array. Windows below 1 point are taken as 1.
+    """
+    import scipy.ndimage as ndimage
+    y = np.asarray(y, dtype = floatType())
+    # filter along the last axis only (each channel of stacked data separately)
+    size = (1,)*(np.ndim(y) - 1) + (max(1, int(window)),)
+    return ndimage.median_filter(y, size = size, mode = "nearest",
+                                 output = _output(out, y, np.shape(y)[-1], floatType()))
+    
+
+def _quantizationStep(y):
+    """
+    Smallest gap between the values that occur more than once in each row of
+    y (the resolution of quantized data; single values such as spikes are
+    ignored), 0 if no two such values exist
+
+    Returns
+    ----------
+    step : ndarray
+        of shape y.shape[:-1] + (1,)
+    """
+    rows = np.reshape(y, (-1, np.shape(y)[-1]))
+    step = np.zeros(len(rows))
+    for i, row in enumerate(rows):
+        ordered = np.sort(row)
+        repeated = np.unique(ordered[1:][np.diff(ordered) == 0])
+        if len(repeated) > 1:
+            step[i] = np.min(np.diff(repeated))
+    return step.reshape(np.shape(y)[:-1] + (1,))
+
+
+def rejectOutliers(y, window, threshold = 3.5, out = None):
+    """
+    Replace outliers by the rolling median. Outliers are points deviating from
+    the rolling median by more than threshold times the rolling median
+    absolute deviation (MAD, scaled to the standard deviation of normally
+    distributed data). The MAD is at least the MAD of the whole data and the
+    quantization step of the data (see _quantizationStep()); if both are 0
+    (e.g. constant data with single spikes), at least the mean absolute
+    deviation. Only constant data has no outliers. The number of points is
+    kept, so up- and down-sweeps stay aligned for averaging and
+    symmetrization.
+    
+    Parameters
+    ----------
+    y : array_like
+        data to check
+    window : int
+        number of points of the rolling median and MAD
+    threshold : float
+        allowed deviation in units of the scaled MAD (default: 3.5)
+    out : ndarray (optional)
+        buffer for y_rejected; may be y itself to replace the outliers in
+        place
+    
+    Returns
+    ----------
+    y_rejected : ndarray
+        y with outliers replaced by the rolling median (out if given,
+        otherwise a copy of y). The rolling median and the deviations are
+        temporary arrays of the size of y.
+    outliers : ndarray of bool
+        True for each outlier in y
+    """
+    y = np.asarray(y, dtype = floatType())
+    median = rollingMedian(y, window)
+    deviation = np.subtract(y, median)
+    np.abs(deviation, out = deviation)
+    mad = rollingMedian(deviation, window)
+    floor = np.maximum(np.median(deviation, axis = -1, keepdims = True), _quantizationStep(y))
+    floor = np.where(floor > 0, floor, np.mean(deviation, axis = -1, keepdims = True))
+    np.maximum(mad, floor, out = mad)
+    mad *= 1.4826*threshold
+    outliers = deviation > mad
+    if out is None:
+        out = np.array(y)
+    elif out is not y:
+        out = _output(out, y, np.shape(y)[-1], floatType())
+        out[...] = y
+    out[outliers] = median[outliers]
+    return out, outliers
+    
+    
+def decimateMinMax(x, y, nBins):
+    """
+    Decimate a curve for display by keeping the minimum and the maximum of y
+    in each of nBins bins of equal number of points (in their original order),
+    so that peaks and outliers stay visible.
+    
+    Parameters
+    ----------
+    x, y : array_like
+        curve to decimate
+    nBins : int
+        number of bins, the result has at most 2*nBins (+2) points
+    
+    Returns
+    ----------
+    x_decimated, y_decimated : ndarray
+        decimated curve (copies; x and y themselves if they have less than
+        2*nBins points)
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = np.size(y)
+    if n <= 2*nBins:
+        return x, y
+    
+    perBin = n//nBins
+    binned = y[:nBins*perBin].reshape(nBins, perBin)
+    iMin = binned.argmin(axis = 1)
+    iMax = binned.argmax(axis = 1)
+    offset = np.arange(nBins)*perBin
+    idx = np.empty(2*nBins, dtype = np.int64)
+    idx[0::2] = offset + np.minimum(iMin, iMax)
+    idx[1::2] = offset + np.maximum(iMin, iMax)
+    if nBins*perBin < n:
+        # remaining points that don't fill a whole bin
+        tail = y[nBins*perBin:]
+        idx = np.append(idx, nBins*perBin + np.sort([tail.argmin(), tail.argmax()]))
+    return x[idx], y[idx]
+    
+    
+def segmentUniqueFields(field):
+    """
+    Find the unique values of a field (parameter) channel and the index at
+    which each of them occurs first.
+    
+    Parameters
+    ----------
+    field : array_like
+        field values as they are recorded in the experiment
+    
+    Returns
+    ----------
+    uniqueFields : ndarray
+        unique field values sorted by their first occurrence (i.e. by order
+        of measurement, not by value)
+    uniqueFieldStartIdx : ndarray
+        index of the first occurrence of each of the unique field values
+    """
+    uniqueFields, uniqueFieldStartIdx = np.unique(field, return_index=True)
+    order = np.argsort(uniqueFieldStartIdx)
+    return uniqueFields[order], uniqueFieldStartIdx[order]
+    
+    
+def preprocessTransportData(field, angle, U, I = None, fields = None, n_angle_points = None, delta_method = True, segments = None):
     """
     Parse transport rotational data that has been recorded at various fields
     and return a dict that contains the data for each field value.
@@ -257,6 +882,9 @@ def preprocessTransportData(field, angle, U, I = None, fields = None, n_angle_po
         at each sweep point instead and R = U/I is returned instead of U
     n_angle_points: scalar (optional)
         Disable automatic detection of angle points, for aborted measurements
+    segments : (uniqueFields, uniqueFieldStartIdx) or segments.SegmentIndex (optional)
+        precomputed segmentation of field (e.g. from the sidecar index), so
+        the field channel does not have to be scanned
     
     Returns
     ----------
@@ -279,6 +907,8 @@ def preprocessTransportData(field, angle, U, I = None, fields = None, n_angle_po
             signal[:]
         signal specifies U for the field "field" in the dict if function 
         argument I is not provided . otherwise, if I is provided, signal specifies R = U/I
+        angle, signal, signal_raw1 and signal_raw2 are views of the input
+        arrays (no copies), signal_diff and signal_sum are new arrays.
 
         
     Usage example
@@ -299,12 +929,16 @@ def preprocessTransportData(field, angle, U, I = None, fields = None, n_angle_po
     
     """        
     
-    l.debug("Loading data for dim(field) = %d,  dim(angle) = %d,  dim(U) = %d"%(len(field), len(angle), len(U)))
-    if np.size(field) == np.size(angle) and n_angle_points == None:
+    l.debug("Loading data for dim(field) = %d,  dim(angle) = %d,  dim(U) = %d", len(field), len(angle), len(U))
+    if segments is not None:
+        if hasattr(segments, "fields"):
+            segments = (segments.fields, segments.start)
+        uniqueFields, uniqueFieldStartIdx = np.asarray(segments[0]), np.asarray(segments[1])
+    elif np.size(field) == np.size(angle) and n_angle_points == None:
         # automatically calculate field points
-        uniqueFields, uniqueFieldStartIdx = np.unique(field, return_index=True)
-        l.debug("found unique fields in data: ")
-        l.debug(uniqueFields)
+        uniqueFields, uniqueFieldStartIdx = segmentUniqueFields(field)
+        if l.isEnabledFor(logging.DEBUG):
+            l.debug("found %d unique fields in data: %s", np.size(uniqueFields), uniqueFields)
     elif n_angle_points:
         # get field indices by user provided parameters
         uniqueFields = field
@@ -320,7 +954,7 @@ def preprocessTransportData(field, angle, U, I = None, fields = None, n_angle_po
     
     data = []
     for idx, uniqueField in enumerate(uniqueFields):
-        l.debug("Parsing data for field %.2f T."%uniqueField)
+        l.debug("Parsing data for field %.2f T.", uniqueField)
         if idx == np.size(uniqueFields)-1:
             # last rotation might be unfinished, just taking the remaining points
             if not (uniqueFieldStartIdx[idx]-np.size(angle)-1)%2 and delta_method == True:
@@ -328,12 +962,12 @@ def preprocessTransportData(field, angle, U, I = None, fields = None, n_angle_po
                 l.warn("Ditching last datapoint of the last rotation in order to be able to symmetrize")
             else:
                 stopIdx = np.size(angle)
-            fieldRange = np.arange(uniqueFieldStartIdx[idx],stopIdx)
+            fieldRange = slice(uniqueFieldStartIdx[idx], stopIdx)
         else:
             # complete measurements
-            fieldRange = np.arange(uniqueFieldStartIdx[idx],uniqueFieldStartIdx[idx+1], 
-                                   np.sign(uniqueFieldStartIdx[idx+1]-uniqueFieldStartIdx[idx]))
-        l.debug("It's field index range is (%d, %d)", fieldRange[0], fieldRange[-1])
+            fieldRange = slice(uniqueFieldStartIdx[idx], uniqueFieldStartIdx[idx+1], 
+                               np.sign(uniqueFieldStartIdx[idx+1]-uniqueFieldStartIdx[idx]))
+        l.debug("It's field index range is (%d, %d)", fieldRange.start, fieldRange.stop)
 
         if I:
             signal = U/I # return R instead of U
@@ -343,7 +977,7 @@ def preprocessTransportData(field, angle, U, I = None, fields = None, n_angle_po
             returnI = None    
 
 
-        angle = np.array(angle)  
+        angle = np.asarray(angle)  
         if delta_method:
             data.append({
                 "field": uniqueField,
@@ -364,17 +998,94 @@ def preprocessTransportData(field, angle, U, I = None, fields = None, n_angle_po
         
     return data 
     
-def fitcos(x, y, fitY0 = False, guess = None):
+class _cosModel(object):
+    """
+    Model amplitude * cos(frequency * x + phase)**power (+ y0) with an analytic
+    Jacobian for optimize.curve_fit.
+
+    cos and sin of the argument are cached for the last (frequency, phase) so
+    that the model and its Jacobian evaluated at the same parameters share a
+    single evaluation of the trigonometric functions.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        x-values (in rad) the model is evaluated at
+    squared : bool
+        model cos**2 instead of cos
+    fitY0 : bool
+        model has a fourth parameter offset y0
+    """
+    def __init__(self, x, squared = False, fitY0 = False):
+        self.x = x
+        self.squared = squared
+        self.fitY0 = fitY0
+        self.nfev = 0 # number of model evaluations
+        self.njev = 0 # number of jacobian evaluations
+        self._key = None
+        self._cos = None
+        self._sin = None
+
+    def _trig(self, frequency, phase):
+        if self._key != (frequency, phase):
+            arg = frequency * self.x + phase
+            self._cos = np.cos(arg)
+            self._sin = np.sin(arg)
+            self._key = (frequency, phase)
+        return self._cos, self._sin
+
+    def __call__(self, x, amplitude, frequency, phase, y0 = 0):
+        self.nfev += 1
+        c, s = self._trig(frequency, phase)
+        if self.squared:
+            return amplitude * c**2 + y0
+        return amplitude * c + y0
+
+    def jacobian(self, x, amplitude, frequency, phase, y0 = 0):
+        self.njev += 1
+        c, s = self._trig(frequency, phase)
+        jac = np.empty((np.size(self.x), 4 if self.fitY0 else 3))
+        if self.squared:
+            # d/dphase cos**2 = -2 cos sin = -sin(2 arg)
+            jac[:,0] = c**2
+            jac[:,2] = -2 * amplitude * c * s
+        else:
+            jac[:,0] = c
+            jac[:,2] = -amplitude * s
+        jac[:,1] = jac[:,2] * self.x
+        if self.fitY0:
+            jac[:,3] = 1.
+        return jac
+
+
+def _curveFit(model, x, y, guess, jacobian):
+    """
+    Run optimize.curve_fit on a _cosModel, using its analytic Jacobian
+    unless jacobian is False (Jacobian estimated by finite differences then).
+    """
+    import scipy.optimize as optimize
+    if jacobian:
+        popt, pcov = optimize.curve_fit(model, x, y, guess, jac = model.jacobian)
+    else:
+        popt, pcov = optimize.curve_fit(model, x, y, guess)
+    return popt
+
+
+def fitcos(x, y, fitY0 = False, guess = None, jacobian = True):
     """
     Fit a cosin to the date in x and y. x is expected to be in rad
+
+    Parameters
+    ----------
+    jacobian : bool
+        use the analytic Jacobian of the model (default). If False the
+        Jacobian is estimated by finite differences.
     """
-    def cos(x, amplitude, frequency, phase):
-        return amplitude * np.cos(frequency * x + phase)   
-    def cos_y0(x, amplitude, frequency, phase, y0):
-        return amplitude * np.cos(frequency * x + phase) + y0    
+    import scipy.fftpack as fftpack
 
-    x = np.array(x)
-    y = np.array(y)    
+    x = np.asarray(x, dtype = np.float64) # copied only if not float64 yet
+    y = np.asarray(y, dtype = np.float64)
+    y00 = 0.
     if not guess:       
         # fourier transform to find guess value for frequency
         yhat = fftpack.rfft(y)
@@ -393,35 +1104,34 @@ def fitcos(x, y, fitY0 = False, guess = None):
         phase0 = guess[2]
         if fitY0:
             y00 = guess[3]
-    l.debug("Fit cosin. Guessing: Amplitude %.3e, Frequency %.3e, Phase %.3e, Offset y0 %.3e"%(amplitude0, frequency0, phase0, y00))
+    l.debug("Fit cosin. Guessing: Amplitude %.3e, Frequency %.3e, Phase %.3e, Offset y0 %.3e", amplitude0, frequency0, phase0, y00)
     
+    model = _cosModel(x, fitY0 = fitY0)
     if fitY0:
         guess = [amplitude0, abs(frequency0), phase0, y00]
-        (amplitude, frequency, phase, y0), pcov = optimize.curve_fit(
-            cos_y0,
-            x, y,
-            guess)
-        yFit = cos_y0(x, amplitude, frequency, +phase, y0)
+        (amplitude, frequency, phase, y0) = _curveFit(model, x, y, guess, jacobian)
+        yFit = model(x, amplitude, frequency, +phase, y0)
         return (amplitude, frequency, phase, y0, yFit)
     else:
         guess = [amplitude0, abs(frequency0), phase0]
-        (amplitude, frequency, phase), pcov = optimize.curve_fit(
-            cos,
-            x, y,
-            guess)
-        yFit = cos(x, amplitude, frequency, +phase)        
+        (amplitude, frequency, phase) = _curveFit(model, x, y, guess, jacobian)
+        yFit = model(x, amplitude, frequency, +phase)        
         return (amplitude, frequency, phase, 0, yFit)
         
         
-def fitcos_squared(x, y, fitY0 = False, guess = None):
-    """ Fit a cosin² to the data in params x and y"""
-    def cossq(x, amplitude, frequency, phase):
-        return amplitude * np.cos(frequency * x + phase)**2   
-    def cossq_y0(x, amplitude, frequency, phase, y0):
-        return amplitude * np.cos(frequency * x + phase)**2 + y0    
-
-    x = np.array(x)
-    y = np.array(y)    
+def fitcos_squared(x, y, fitY0 = False, guess = None, jacobian = True):
+    """
+    Fit a cosin² to the data in params x and y
+    
+    Parameters
+    ----------
+    jacobian : bool
+        use the analytic Jacobian of the model (default). If False the
+        Jacobian is estimated by finite differences.
+    """
+    x = np.asarray(x, dtype = np.float64) # copied only if not float64 yet
+    y = np.asarray(y, dtype = np.float64)
+    y00 = 0.
     if not guess:       
         frequency0 = 1
         amplitude0 = np.sqrt(np.abs(max(y)-min(y))/2)
@@ -433,22 +1143,16 @@ def fitcos_squared(x, y, fitY0 = False, guess = None):
         phase0 = guess[2]
         if fitY0:
             y00 = guess[3]
-    l.debug("Fit cosin squared. Guessing: Amplitude %.3e, Frequency %.3e, Phase %.3e, Offset y0 %.3e"%(amplitude0, frequency0, phase0, y00))
+    l.debug("Fit cosin squared. Guessing: Amplitude %.3e, Frequency %.3e, Phase %.3e, Offset y0 %.3e", amplitude0, frequency0, phase0, y00)
   
+    model = _cosModel(x, squared = True, fitY0 = fitY0)
     if fitY0:
         guess = [amplitude0, abs(frequency0), phase0, y00]
-        (amplitude, frequency, phase, y0), pcov = optimize.curve_fit(
-            cossq_y0,
-            x, y,
-            guess)
-        yFit = cossq_y0(x, amplitude, frequency, +phase, y0)
+        (amplitude, frequency, phase, y0) = _curveFit(model, x, y, guess, jacobian)
+        yFit = model(x, amplitude, frequency, +phase, y0)
         return (amplitude, frequency, phase, y0, yFit)
     else:
         guess = [amplitude0, abs(frequency0), phase0]
-        (amplitude, frequency, phase), pcov = optimize.curve_fit(
-            cossq,
-            x, y,
-            guess)
-        yFit = cossq(x, amplitude, frequency, +phase)
+        (amplitude, frequency, phase) = _curveFit(model, x, y, guess, jacobian)
+        yFit = model(x, amplitude, frequency, +phase)
         return (amplitude, frequency, phase, 0, yFit)
-        
\ No newline at end of file
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Directory watcher that ingests new measurement files in the background.
+
+New TDMS files in a directory are detected by polling. A file is only
+ingested once it is complete, i.e. its size and modification time have not
+changed for `settle` seconds (debouncing files that are still being written).
+A file that changes after it has been ingested (e.g. the DAQ paused for
+longer than `settle`) or whose ingestion failed is ingested again.
+Ingesting a file fills its npycache (see npycache.py) with
+
+    + the channels as .npy files and the metadata index (convertTdmsToNpy)
+    + the segmentation of its field channels (writeSegments)
+    + the processed results of the configured pipelines (writeResult)
+
+so opening the file in previewTransportData (or with the query API / preview
+server) finds everything precomputed.
+
+Usage example
+----------
+>>> watcher = DirectoryWatcher("D:/measurements", pipelines = [
+...     {"group": "Read.K2400_long_oopj", "x": "owis.Angle (deg)", "y": "K2400U",
+...      "fieldChannel": "IPS.TargetField", "ops": [["deltaMethod", {"method": 3}]]}])
+>>> watcher.start()
+"""
+import fnmatch
+import os
+import threading
+import time
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+import numpy as np
+
+import npycache
+from segments import SegmentIndex
+from operations import pipelineFromJson, execute
+
+import logging
+l = logging.getLogger(__name__) # level is configured in lib/__init__.py
+
+MIN_SEGMENT_POINTS = 10 # channels with fewer points per segment are no field channels
+
+
+def isFieldChannel(data, segments):
+    """
+    Whether a channel segmented into segments looks like a field (parameter)
+    channel, i.e. stays constant over several points at a time
+    """
+    return (np.issubdtype(np.asarray(data).dtype, np.number)
+            and 0 < len(segments) <= np.size(data)//MIN_SEGMENT_POINTS)
+
+
+def resultKey(pipeline):
+    """
+    Key of the result of a pipeline in the npycache (see npycache.resultPath)
+    """
+    return [pipeline["group"], pipeline["x"], pipeline["y"], pipeline["fieldChannel"], pipeline.get("ops", [])]
+
+
+def runPipeline(index, segmentIndex, pipeline):
+    """
+    Process all segments of a measurement as configured by pipeline
+
+    Parameters
+    ----------
+    index : tdmsindex.TdmsIndex
+    segmentIndex : segments.SegmentIndex
+        segmentation of the field channel of pipeline
+    pipeline : dict
+        group, x, y, fieldChannel: names of the group and channels
+        ops: list of [operation, parameters] (see operations.OperationSpec.toJson)
+
+    Returns
+    ----------
+    curves : list of (x, y)
+        processed data of each segment
+    """
+    x = np.asarray(index.channelData(pipeline["group"], pipeline["x"]))
+    y = np.asarray(index.channelData(pipeline["group"], pipeline["y"]))
+    specs = pipelineFromJson(pipeline.get("ops", []))
+    return [execute(specs, x[segmentIndex.slice(number)], y[segmentIndex.slice(number)])
+            for number in range(len(segmentIndex))]
+
+
+def ingestFile(filename, fieldChannels = None, pipelines = (), groupPrefix = "Read."):
+    """
+    Precompute the npycache of a TDMS file: channels, index, field
+    segmentations and pipeline results
+
+    Parameters
+    ----------
+    filename : str
+        TDMS file
+    fieldChannels : list of str (optional)
+        names of the field channels to segment. If None, every channel that
+        looks like a field channel (see isFieldChannel) is segmented
+    pipelines : list of dict
+        default processing to precompute (see runPipeline)
+    groupPrefix : str
+        only groups starting with groupPrefix are segmented
+    """
+    if not npycache.isCacheValid(filename):
+        npycache.convertTdmsToNpy(filename)
+    index = npycache.openNpyCache(filename)
+
+    segmentIndexes = {}
+    for group in index.groupNames(groupPrefix):
+        for channel in index.channelNames(group):
+            if fieldChannels is not None and channel not in fieldChannels:
+                continue
+            data = index.channelData(group, channel)
+            if data is None or not np.size(data):
+                continue
+            segments = SegmentIndex.fromFieldChannel(data)
+            if fieldChannels is not None or isFieldChannel(data, segments):
+                segmentIndexes[(group, channel)] = segments
+    npycache.writeSegments(filename, segmentIndexes)
+    l.debug("Segmented %d field channels of %s", len(segmentIndexes), filename)
+
+    for pipeline in pipelines:
+        key = (pipeline["group"], pipeline["fieldChannel"])
+        if key not in segmentIndexes:
+            l.warn("%s has no field channel %s in group %s", filename, key[1], key[0])
+            continue
+        curves = runPipeline(index, segmentIndexes[key], pipeline)
+        npycache.writeResult(filename, resultKey(pipeline), segmentIndexes[key].fields, curves)
+
+
+class DirectoryWatcher(object):
+    """
+    Watch a directory for new TDMS files and ingest them (see ingestFile) in a
+    background thread
+
+    Parameters
+    ----------
+    directory : str
+        directory to watch (not recursive)
+    pattern : str
+        glob pattern of the files to ingest
+    interval : float
+        seconds between two scans of the directory
+    settle : float
+        seconds size and modification time of a file must stay unchanged
+        before it is considered complete
+    callback : callable(filename, error, duration) (optional)
+        called (from the watcher thread) after each file has been ingested.
+        error is None on success
+    fieldChannels, pipelines :
+        passed to ingestFile()
+    """
+    def __init__(self, directory, pattern = "*.tdms", interval = 2., settle = 10.,
+                 callback = None, fieldChannels = None, pipelines = ()):
+        self.directory = directory
+        self.pattern = pattern
+        self.interval = interval
+        self.settle = settle
+        self.callback = callback
+        self.fieldChannels = fieldChannels
+        self.pipelines = list(pipelines)
+
+        self.pending = {}   # filename -> (size, mtime, time the state was first seen)
+        self.done = {}      # filename -> (size, mtime) the file has been queued for ingestion with
+        self.queue = Queue()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """
+        Start scanning and ingesting in daemon threads
+        """
+        self._stop.clear()
+        self._threads = [threading.Thread(target = self._scanLoop),
+                         threading.Thread(target = self._ingestLoop)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+        l.info("Watching %s for %s", self.directory, self.pattern)
+
+    def stop(self, timeout = None):
+        """
+        Stop watching (the file being ingested is finished first)
+        """
+        self._stop.set()
+        self.queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def scan(self, now = None):
+        """
+        Scan the directory once; queue files that are complete
+
+        Returns
+        ----------
+        filenames : list of str
+            files queued for ingestion by this scan
+        """
+        now = time.time() if now is None else now
+        queued = []
+        for name in fnmatch.filter(os.listdir(self.directory), self.pattern):
+            filename = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue # removed in the meantime
+            state = (stat.st_size, stat.st_mtime)
+            if self.done.get(filename) == state:
+                continue # unchanged since it has been ingested
+            if filename not in self.pending or self.pending[filename][:2] != state:
+                # new or still being written: (re)start the settle time
+                self.pending[filename] = state + (now,)
+                continue
+            if now - self.pending[filename][2] < self.settle:
+                continue
+            del self.pending[filename]
+            self.done[filename] = state
+            if npycache.isCacheValid(filename) and npycache.readSegments(filename):
+                continue # ingested before
+            self.queue.put(filename)
+            queued.append(filename)
+        return queued
+
+    def _scanLoop(self):
+        while not self._stop.is_set():
+            try:
+                self.scan()
+            except (OSError, IOError) as e:
+                l.error("Error scanning %s: %s", self.directory, e)
+            self._stop.wait(self.interval)
+
+    def _ingestLoop(self):
+        while not self._stop.is_set():
+            filename = self.queue.get()
+            if filename is None:
+                break
+            start = time.time()
+            error = None
+            try:
+                ingestFile(filename, self.fieldChannels, self.pipelines)
+                l.info("Ingested %s in %.2fs", filename, time.time() - start)
+            except Exception as e:
+                error = e
+                l.error("Error ingesting %s: %s", filename, e)
+                # retried on one of the next scans
+                self.done.pop(filename, None)
+            if self.callback is not None:
+                self.callback(filename, error, time.time() - start)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Serve processed transport data of TDMS files over HTTP (see lib/server.py)
+
+Usage:
+    python previewServer.py [--host localhost] [--port 8050] [--root DIR] [file.tdms ...]
+"""
+import argparse
+import logging
+import os
+
+import lib
+from lib.server import PreviewServer, DEFAULT_CACHE_SIZE
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs = "*", help = "TDMS files to load at startup")
+    parser.add_argument("--host", default = "localhost", help = "address to listen on")
+    parser.add_argument("--port", type = int, default = 8050, help = "port to listen on")
+    parser.add_argument("--root", default = os.getcwd(), help = "only files below this directory are served")
+    parser.add_argument("--cache-size", type = int, default = DEFAULT_CACHE_SIZE, help = "number of cached responses")
+    args = parser.parse_args()
+
+    logging.basicConfig()
+    lib.setLogLevel(os.environ.get("PREVIEWTRANSPORTDATA_LOGLEVEL", "INFO"))
+
+    server = PreviewServer((args.host, args.port), root = args.root,
+                           filenames = args.files, cacheSize = args.cache_size)
+    print("Serving %s on http://%s:%d"%(server.root, args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
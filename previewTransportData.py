@@ -4,24 +4,37 @@ Created on Mon Jun 23 10:27:50 2014
 
 @author: hannes.maierflaig
 """
-from guidata.qt.QtGui import QLabel, QDoubleValidator, QTextEdit, QLineEdit, QCheckBox, QVBoxLayout, QMainWindow, QWidget, QComboBox, QGridLayout, QHBoxLayout, QFileDialog, QPushButton, QGroupBox
-from PyQt4.QtCore import SIGNAL
+from guidata.qt.QtGui import QLabel, QDoubleValidator, QIntValidator, QTextEdit, QLineEdit, QCheckBox, QVBoxLayout, QMainWindow, QWidget, QComboBox, QGridLayout, QHBoxLayout, QFileDialog, QPushButton, QGroupBox, QTableWidget, QTableWidgetItem
+from guidata.qt.QtGui import QListWidget, QListWidgetItem, QListView, QIcon, QPixmap, QPainter, QPen, QPolygonF
+from PyQt4.QtCore import SIGNAL, Qt, QTimer, QPointF, QSize
 
 from guiqwt.plot import CurveDialog
 from guiqwt.builder import make
 
 import numpy as np
-import nptdms
 import re
 from lib.DataObject import DataObject
 import lib.transportdata as transdat
+import lib.fileloader as fileloader
+import lib.batchfit as batchfit
+import lib.tdmsindex as tdmsindex
+from lib.segments import TransportQuery
+from lib.operations import Buffers, PipelineGraph
+import lib.npycache as npycache
+from lib.thumbnails import ThumbnailGenerator
+from lib.memory import MemoryManager
 
 import os
+import fnmatch
+import colorsys
+from collections import deque, OrderedDict
 import logging
 logging.basicConfig()
 l = logging.getLogger(__name__)
 l.setLevel(logging.DEBUG)
 
+BRANCH_COLORS = ['b', 'r', 'g', 'm'] # curves of branches plotted together
+
 def qwtArrayDoubleToList(array):
     """
     Transforms a QWT array to a list
@@ -31,6 +44,37 @@ def qwtArrayDoubleToList(array):
         x.append(array[i])
     return x
 
+def thumbnailPixmap(x, y, width = 160, height = 60):
+    """
+    Draws a thumbnail trace (lib.thumbnails.channelThumbnail) into a QPixmap
+    """
+    pixmap = QPixmap(width, height)
+    pixmap.fill(Qt.white)
+    finite = np.isfinite(y)
+    if np.count_nonzero(finite) < 2:
+        return pixmap
+    x, y = np.asarray(x, dtype = np.float64)[finite], np.asarray(y)[finite]
+    xSpan = (x[-1] - x[0]) or 1.
+    ySpan = (np.max(y) - np.min(y)) or 1.
+    px = (x - x[0])/xSpan*(width - 1)
+    py = (height - 1) - (y - np.min(y))/ySpan*(height - 1)
+    painter = QPainter(pixmap)
+    painter.setPen(QPen(Qt.blue))
+    painter.drawPolyline(QPolygonF([QPointF(a, b) for a, b in zip(px, py)]))
+    painter.end()
+    return pixmap
+
+def fieldColors(fields):
+    """
+    Colours (#rrggbb) of curves by field: from blue for the lowest to red for
+    the highest field
+    """
+    fields = np.asarray(fields, dtype = np.float64)
+    span = np.ptp(fields) if np.size(fields) else 0.
+    scaled = (fields - np.min(fields))/span if span else np.zeros(np.size(fields))
+    return ["#%02x%02x%02x"%tuple(int(round(255*c)) for c in colorsys.hsv_to_rgb(2./3*(1 - value), 1., .9))
+            for value in scaled]
+
 def ndarrayToList(array):
     """
     Transforms a numpy array to a list
@@ -73,19 +117,42 @@ class widgetLogger(logging.Handler):
     Creates a Handler that writes the logger's output to a QTextEdit.
     Output is formatted as debuglevel::name::message @ time
 
+    Records are buffered and written to the widget in batches by a timer, so
+    logging from hot paths (or from worker threads) does not block on updating
+    the widget for every single record.
+
     Parameters
     ---------
     statusWidget: QTextEdit Widget where the output of the logger is written to
     debugLevel: Int DebugLevel of the handler to operate
+    flushInterval: Int interval in ms in which buffered records are written
+    maxRecordsPerFlush: Int maximum number of records written per interval
+    maxBuffered: Int maximum number of buffered records, older ones are dropped
     """
-    def __init__(self, statusWidget, debugLevel):
+    def __init__(self, statusWidget, debugLevel, flushInterval = 200, maxRecordsPerFlush = 100, maxBuffered = 10000):
         logging.Handler.__init__(self)
         self.setLevel(debugLevel)
         self.statusWidget = statusWidget
         self.formatter = logging.Formatter(fmt='%(levelname)s::%(name)s::%(message)s @ %(asctime)s')
 
+        self.maxRecordsPerFlush = maxRecordsPerFlush
+        self.records = deque(maxlen = maxBuffered) # appending is thread-safe
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.flushToWidget)
+        self.timer.start(flushInterval)
+
     def emit(self,record):
-        self.statusWidget.append(self.format(record))
+        self.records.append(record)
+
+    def flushToWidget(self):
+        """
+        Write up to maxRecordsPerFlush buffered records to the widget at once
+        """
+        lines = []
+        while self.records and len(lines) < self.maxRecordsPerFlush:
+            lines.append(self.format(self.records.popleft()))
+        if lines:
+            self.statusWidget.append("\n".join(lines))
 
 
 #class FitInfo(ObjectInfo):
@@ -122,8 +189,12 @@ class plotWidget(QWidget):
                                 # with the plot list
         self.currentDataObject  = None # currently selected or plotted data object
 
-        self.dataObjectTdmsFile  = [] # relates tdmsFiles to dataObjects
-        self.curveItemDataObject = []  # relates curveItems to dataObjects
+        self.dataObjectTdmsFile  = {} # dataObject -> tdmsFile it has been read from
+        self.curveDataObjects    = {} # curveItem -> dataObject plotted as the curve
+
+        self.fitPool = None # worker pool of all batch fits, started on the first fit (lib.batchfit.createPool)
+        self.fitResults = None # results table of the last batch fit (lib.batchfit.resultsTable)
+        self.fitResultsName = None
 
         ## Initialize plot widget
         self.curveDialog = curveDialogIgnoreEsc(edit=False,toolbar=True)
@@ -147,6 +218,7 @@ class plotWidget(QWidget):
         self.comboBoxSymmetrize.addItem(u"No symmetrization")
         self.comboBoxSymmetrize.addItem(u"Symmetrization")
         self.comboBoxSymmetrize.addItem(u"Antisymmetrization")
+        self.comboBoxSymmetrize.addItem(u"Symmetrization and antisymmetrization")
         self.checkBoxAdmrData = QCheckBox(u"ADMR data")
         self.checkBoxAdmrData.setDisabled(1)
         self.checkBoxAntiSymmetrize = QCheckBox(u"Antisymmetrize")
@@ -175,11 +247,29 @@ class plotWidget(QWidget):
         self.lineEditSymmStep.setValidator(QDoubleValidator())
         self.lineEditSymmStep.setEnabled(False)
 
+        self.checkBoxOutliers = QCheckBox(u"Reject outliers")
+        self.checkBoxOutliers.setToolTip(u"Replace points deviating from the rolling median by more than threshold * MAD")
+        self.lineEditOutlierThreshold = QLineEdit(u"3.5")
+        self.lineEditOutlierThreshold.setMaximumWidth(50)
+        self.lineEditOutlierThreshold.setValidator(QDoubleValidator())
+
+        self.comboBoxSmooth = QComboBox()
+        self.comboBoxSmooth.addItem(u"No smoothing")
+        self.comboBoxSmooth.addItem(u"Moving average")
+        self.comboBoxSmooth.addItem(u"Savitzky-Golay (3rd order)")
+        self.labelWindow = QLabel(u"Window [points]")
+        self.lineEditWindow = QLineEdit(u"5")
+        self.lineEditWindow.setMaximumWidth(50)
+        self.lineEditWindow.setValidator(QIntValidator(1, 2**31-1, self))
+
         # Connect SIGNALs
         self.connect(self.comboBoxOffset, SIGNAL('stateChanged(int)'), self.uiOffset)
         self.connect(self.checkBoxAdmrData, SIGNAL('stateChanged(int)'), self.uiSymmetrization)
         self.connect(self.comboBoxSymmetrize, SIGNAL('currentIndexChanged(QString)'), self.uiSymmetrization)
         self.plot.SIG_ACTIVE_ITEM_CHANGED.connect(self.updateGUI)
+        self.plot.SIG_ITEM_REMOVED.connect(self.curveRemoved)
+        self.connect(self, SIGNAL("fitsFinished(PyQt_PyObject, PyQt_PyObject, PyQt_PyObject)"),
+                     self.fitsFinished, Qt.QueuedConnection)
         # Processing
         vLayoutData  = QVBoxLayout()
 
@@ -198,9 +288,18 @@ class plotWidget(QWidget):
         hLayoutData2.addWidget(self.labelSymmStep)
         hLayoutData2.addWidget(self.lineEditSymmStep)
 
+        hLayoutData3 = QHBoxLayout()
+        hLayoutData3.addWidget(self.checkBoxOutliers)
+        hLayoutData3.addWidget(self.lineEditOutlierThreshold)
+        hLayoutData3.addWidget(self.comboBoxSmooth)
+        hLayoutData3.addWidget(self.labelWindow)
+        hLayoutData3.addWidget(self.lineEditWindow)
+        hLayoutData3.addStretch()
+
         vLayoutData.addLayout(self.hLayoutData0)
         vLayoutData.addLayout(hLayoutData1)
         vLayoutData.addLayout(hLayoutData2)
+        vLayoutData.addLayout(hLayoutData3)
 
 
         groupDataProcess = QGroupBox("Processing")
@@ -210,12 +309,27 @@ class plotWidget(QWidget):
         toolbar = self.curveDialog.get_toolbar()
         toolbar.addAction("cos", self.fitCos)
         toolbar.addAction(u"cos²", self.fitCosSq)
+        toolbar.addAction("fit table", self.showFitResultsWidget)
         toolbar.addAction("residual", self.calculateResidual)
         toolbar.addSeparator()
         toolbar.addAction("autoscale", self.plot.do_autoscale)
+        toolbar.addAction("memory", self.reportMemory)
         toolbar.addSeparator()
         toolbar.addAction("ascii", self.export_ascii).setDisabled(0)
         toolbar.addAction("code", self.export_objects).setDisabled(1)
+        # Fit results (separate window)
+        self.fitResultsWidget = QWidget(self, Qt.Window)
+        self.fitResultsWidget.table = QTableWidget()
+        self.fitResultsWidget.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        buttonExportFits = QPushButton(u"Export")
+        buttonExportFits.setMaximumWidth(100)
+        self.connect(buttonExportFits, SIGNAL('clicked()'), self.exportFitResults)
+        vLayoutFits = QVBoxLayout()
+        vLayoutFits.addWidget(self.fitResultsWidget.table)
+        vLayoutFits.addWidget(buttonExportFits)
+        self.fitResultsWidget.setLayout(vLayoutFits)
+        self.fitResultsWidget.resize(600, 300)
+
         #  Putting it all together
         vlayout = QVBoxLayout()
         vlayout.addWidget(groupDataProcess)
@@ -230,6 +344,8 @@ class plotWidget(QWidget):
         if(-1 == dataObject):
             l.error("GUI could not be updated")
             return
+        self.currentDataObject = dataObject
+        self.parent().memory.touch(dataObject)
 
         dummyIndex = self.parent().comboBoxFile.findText(dataObject.path)
         self.parent().setCurrentTdmsFile(dummyIndex)
@@ -259,12 +375,32 @@ class plotWidget(QWidget):
         """
         Find data object associated to currently selected curve
         """
-        try:
-            dataObject  = [v[1] for i, v in enumerate(self.curveItemDataObject) if v[0] == self.plot.get_selected_items()[0]][0]
-        except:
+        selected = self.plot.get_selected_items()
+        if not selected or selected[0] not in self.curveDataObjects:
             l.error("Could not find a data object associated to the currently selected curve. Maybe there's no curve selected?")
             return -1
-        return dataObject
+        return self.curveDataObjects[selected[0]]
+
+
+    def curveRemoved(self, curveItem):
+        """
+        Forget the data object of a curve that has been removed from the plot
+        """
+        dataObject = self.curveDataObjects.pop(curveItem, None)
+        if dataObject is None:
+            return
+        self.dataObjects.remove(dataObject)
+        self.dataObjectTdmsFile.pop(dataObject, None)
+        self.parent().memory.forget(dataObject)
+        if self.currentDataObject is dataObject:
+            self.currentDataObject = None
+
+
+    def reportMemory(self):
+        """
+        Log the memory used by the loaded files and plotted data objects
+        """
+        l.info(u"Memory use:\n%s", self.parent().memory.formatReport())
 
     def readOperationsFromDataObject(self,dataObject):
         """
@@ -272,24 +408,30 @@ class plotWidget(QWidget):
         the used parameters
         """
         self.resetFilters()
-        for idx,operation in enumerate(dataObject.operations):
-            if re.search(r"_deltaMethod",str(operation.__name__)):
-                self.comboBoxDeltaMethod.setCurrentIndex(dataObject.operationParameters[idx]["method"])
-            elif re.search(r"_averageUpDown",str(operation.__name__)):
+        for operation in dataObject.operations:
+            if operation.name == "deltaMethod":
+                self.comboBoxDeltaMethod.setCurrentIndex(operation["method"])
+            elif operation.name == "averageUpDown":
                 self.checkBoxAverage.setChecked(1)
-            elif re.search(r"_offsetCorrection",str(operation.__name__)):
-                self.comboBoxOffset.setCurrentIndex(dataObject.operationParameters[idx]["method"])
-                self.lineEditOffset.setText(str(dataObject.operationParameters[idx]["offset"]))
-            elif re.search(r"_symmetrize",str(operation.__name__)):
-                self.comboBoxSymmetrize.setCurrentIndex(dataObject.operationParameters[idx]["method"])
-                if dataObject.operationParameters[idx]["symm_step"]:
-                    self.lineEditSymmStep.setText(str(dataObject.operationParameters[idx]["symm_step"]))
+            elif operation.name == "offsetCorrection":
+                self.comboBoxOffset.setCurrentIndex(operation["method"])
+                self.lineEditOffset.setText(str(operation["offset"]))
+            elif operation.name == "symmetrize":
+                self.comboBoxSymmetrize.setCurrentIndex(operation["method"])
+                if operation["symm_step"]:
+                    self.lineEditSymmStep.setText(str(operation["symm_step"]))
                     self.checkBoxAdmrData.setChecked(1)
-                elif dataObject.operationParameters[idx]["symm_center"]:
-                    self.lineEditSymmStep.setText(str(dataObject.operationParameters[idx]["symm_center"]))
-            elif re.search(r"_normalize",str(operation.__name__)):
-                self.comboBoxNormalize.setCurrentIndex(dataObject.operationParameters[idx]["method"])
-           # elif re.search(r"_averageUpDown",str(operation.__name__)):
+                elif operation["symm_center"]:
+                    self.lineEditSymmStep.setText(str(operation["symm_center"]))
+            elif operation.name == "normalize":
+                self.comboBoxNorm.setCurrentIndex(operation["method"])
+            elif operation.name == "rejectOutliers":
+                self.checkBoxOutliers.setChecked(1)
+                self.lineEditWindow.setText(str(operation["window"]))
+                self.lineEditOutlierThreshold.setText(str(operation["threshold"]))
+            elif operation.name == "smooth":
+                self.comboBoxSmooth.setCurrentIndex(operation["method"])
+                self.lineEditWindow.setText(str(operation["window"]))
 
     def resetFilters(self):
         """
@@ -304,6 +446,8 @@ class plotWidget(QWidget):
         self.comboBoxSymmetrize.setCurrentIndex(0)
         self.lineEditOffset.clear()
         self.lineEditSymmStep.clear()
+        self.checkBoxOutliers.setChecked(0)
+        self.comboBoxSmooth.setCurrentIndex(0)
 
     def export_ascii(self):
         """
@@ -331,7 +475,7 @@ class plotWidget(QWidget):
         Change UI (enabled state of text box etc) on selecting (anti-)symmetrization
         method
         """
-        l.debug("Symmetrization method changed to %d"%self.comboBoxSymmetrize.currentIndex())
+        l.debug("Symmetrization method changed to %d", self.comboBoxSymmetrize.currentIndex())
         if self.comboBoxSymmetrize.currentIndex() > 0: # any symm. method has been selected
             self.checkBoxAdmrData.setEnabled(True)
             self.labelSymmStep.setEnabled(True)
@@ -350,7 +494,7 @@ class plotWidget(QWidget):
         """
         Change enabled state of text box on selecting offset subtraction
         """
-        l.debug("Symmetrization method changed to %d"%self.comboBoxSymmetrize.currentIndex())
+        l.debug("Symmetrization method changed to %d", self.comboBoxSymmetrize.currentIndex())
         if (self.comboBoxOffset.currentIndex() == 0      # no offset subtraction
             or self.comboBoxOffset.currentIndex() == 4): # user defined value
             self.lineEditOffset.setEnabled(True)
@@ -358,36 +502,109 @@ class plotWidget(QWidget):
             self.lineEditOffset.setEnabled(False)
 
 
-    def processAndPlotData(self):
+    def symmetrizationBranches(self):
         """
-        Processes the data of the current data object and appends them to the plot window
+        Symmetrization methods selected in the GUI
+
+        Returns
+        ----------
+        branches : list of (method, suffix)
+            symmetrization method of lib.operations.symmetrize and suffix of
+            the label; more than one if the branches are plotted together
         """
-        currentDataObject = self.dataObjects.pop()
+        if self.comboBoxSymmetrize.currentIndex() == 3:
+            return [(1, u"sym."), (2, u"antisym.")]
+        return [(self.comboBoxSymmetrize.currentIndex(), None)]
+
+
+    def queueOperations(self, currentDataObject, symmetrizeMethod = None):
+        """
+        Queue the operations selected in the GUI on a data object
 
-        # Queue operations
+        symmetrizeMethod overrides the method selected in the GUI (see
+        symmetrizationBranches())
+        """
+        if symmetrizeMethod is None:
+            symmetrizeMethod = self.comboBoxSymmetrize.currentIndex()
         currentDataObject.deltaMethod(self.comboBoxDeltaMethod.currentIndex())
+        window = (self.lineEditWindow.text().toInt())[0]
+        if self.checkBoxOutliers.isChecked():
+            currentDataObject.rejectOutliers(window, threshold = (self.lineEditOutlierThreshold.text().toDouble())[0])
         if self.checkBoxAverage.isChecked():
             currentDataObject.averageUpDown()
         if self.checkBoxAdmrData.isChecked():
-            currentDataObject.symmetrize(self.comboBoxSymmetrize.currentIndex(),symm_step = (self.lineEditSymmStep.text().toDouble())[0])
+            currentDataObject.symmetrize(symmetrizeMethod,symm_step = (self.lineEditSymmStep.text().toDouble())[0])
         else:
-            currentDataObject.symmetrize(self.comboBoxSymmetrize.currentIndex(),symm_center = (self.lineEditSymmStep.text().toDouble())[0])
+            currentDataObject.symmetrize(symmetrizeMethod,symm_center = (self.lineEditSymmStep.text().toDouble())[0])
+        currentDataObject.smooth(self.comboBoxSmooth.currentIndex(), window)
         currentDataObject.normalize(self.comboBoxNorm.currentIndex())
         currentDataObject.offsetCorrection(self.comboBoxOffset.currentIndex(), offset = (self.lineEditOffset.text().toDouble())[0])
 
+
+    def processAndPlotData(self):
+        """
+        Processes the data of the current data object and appends them to the plot window
+        """
+        currentDataObject = self.dataObjects.pop()
+        if len(self.symmetrizationBranches()) > 1:
+            self.processAndPlotBranches(currentDataObject)
+            return
+        self.queueOperations(currentDataObject)
+
         x,y = currentDataObject.processData()
-        l.debug(str(currentDataObject))
+        l.debug("%s", currentDataObject)
 
         self.dataObjects.append(currentDataObject)
-        curve = make.curve(x,y,color='b',marker='Ellipse', markerfacecolor='b', title = currentDataObject.label)
-        self.plot.add_item(curve)
+        self.addDataCurve(currentDataObject, x, y)
+
+
+    def processAndPlotBranches(self, dataObject):
+        """
+        Processes the data of a data object in several branches (e.g.
+        symmetrization and antisymmetrization) and appends all of them to the
+        plot window. The operations the branches have in common are run once.
+        """
+        tdmsFile = self.dataObjectTdmsFile.pop(dataObject, None)
+        graph = PipelineGraph()
+        for method, suffix in self.symmetrizationBranches():
+            branch = dataObject.copy(label = u"%s %s"%(dataObject.label, suffix) if dataObject.label else suffix)
+            self.queueOperations(branch, symmetrizeMethod = method)
+            graph.add(branch, branch.operations)
+        results = graph.execute(dataObject.x, dataObject.y, dataObject.stats)
+
+        for i, (branch, result) in enumerate(results.items()):
+            branch.xCalc, branch.yCalc, branch.isUpDownData = result.xCalc, result.yCalc, result.isUpDownData
+            l.debug("%s", branch)
+            self.dataObjects.append(branch)
+            self.dataObjectTdmsFile[branch] = tdmsFile
+            self.addDataCurve(branch, result.xCalc, result.yCalc, autoscale = False,
+                              color = BRANCH_COLORS[i % len(BRANCH_COLORS)])
         self.plot.do_autoscale()
-        curve.select()
 
-        self.curveItemDataObject.append((curve, currentDataObject))
 
+    def addDataCurve(self, dataObject, x, y, autoscale = True, color = 'b', batch = False):
+        """
+        Add the processed data of a data object as curve to the plot
 
-    def newData(self,x,y, label = None):
+        If batch, the curve is not selected and the memory budget is not
+        enforced (the caller does so once for all curves of the batch).
+        Returns the curve.
+        """
+        curve = make.curve(x,y,color=color,marker='Ellipse', markerfacecolor=color, title = dataObject.label)
+        self.plot.add_item(curve)
+        if autoscale:
+            self.plot.do_autoscale()
+
+        self.curveDataObjects[curve] = dataObject
+        self.currentDataObject = dataObject
+        self.parent().memory.track(dataObject, u"curve %s (%s)"%(dataObject.label, dataObject.yChannel))
+        if not batch:
+            curve.select()
+            self.parent().enforceMemoryBudget()
+        return curve
+
+
+    def newData(self,x,y, label = None, stats = None):
         """
         Adds new data to the plot after recalculating everything as specified by the GUI
 
@@ -395,6 +612,7 @@ class plotWidget(QWidget):
         --------
         x: np.array contains the data used for the x-axis
         y: np.array contains the data used for the y-axis
+        stats: dict with min, max and mean of y (from the sidecar index) or None
         """
         dataObject = DataObject(x,y,
                                label = label,
@@ -403,13 +621,124 @@ class plotWidget(QWidget):
                                paramChannel = self.parent().fieldChannelBox.currentText(),
                                param = self.parent().fieldBox.currentText(),
                                xChannel = self.parent().xChannelBox.currentText(),
-                               yChannel = self.parent().yChannelBox.currentText())
+                               yChannel = self.parent().yChannelBox.currentText(),
+                               stats = stats)
         self.dataObjects.append(dataObject)
-        self.dataObjectTdmsFile.append((dataObject, self.parent().currentTdmsFile))
+        self.dataObjectTdmsFile[dataObject] = self.parent().currentTdmsFile
 
         self.processAndPlotData()
 
 
+    def newChannelData(self, x, y, yChannels, label = None):
+        """
+        Adds the data of several y-channels recorded against the same x to the
+        plot. The operations specified by the GUI are run once on the stacked
+        data of all channels (once per branch if symmetrization and
+        antisymmetrization are plotted together, sharing the common operations);
+        each channel gets its own data object and curve.
+
+        Parameters
+        --------
+        x: np.array contains the data used for the x-axis
+        y: np.array of shape (len(yChannels), len(x)) contains the data of the y-channels
+        yChannels: list of the names of the y-channels
+        """
+        graph = PipelineGraph()
+        for method, suffix in self.symmetrizationBranches():
+            stacked = DataObject(x, y)
+            self.queueOperations(stacked, symmetrizeMethod = method)
+            graph.add(suffix, stacked.operations)
+        results = graph.execute(x, y)
+        l.debug("Processed %d channels in %d branches in one run", len(yChannels), len(results))
+
+        for i, (suffix, result) in enumerate(results.items()):
+            self.addChannelCurves(x, y, yChannels, label, graph.branches[suffix], result,
+                                  suffix = suffix, color = BRANCH_COLORS[i % len(BRANCH_COLORS)])
+        self.plot.do_autoscale()
+
+
+    def addChannelCurves(self, x, y, yChannels, label, operations, result, suffix = None, color = 'b'):
+        """
+        Add a curve for each channel of the stacked result of a pipeline
+        """
+        xCalc, yCalc = result.xCalc, result.yCalc
+        for row, yChannel in enumerate(yChannels):
+            dataObject = DataObject(x, y[row],
+                                   label = " ".join(part for part in (yChannel, label, suffix) if part),
+                                   path=self.parent().comboBoxFile.currentText(),
+                                   group = self.parent().groupBox.currentText(),
+                                   paramChannel = self.parent().fieldChannelBox.currentText(),
+                                   param = self.parent().fieldBox.currentText(),
+                                   xChannel = self.parent().xChannelBox.currentText(),
+                                   yChannel = yChannel)
+            # the result of the stacked run, the data object can be reprocessed on its own
+            dataObject.setOperations(operations)
+            dataObject.xCalc, dataObject.yCalc = xCalc, yCalc[row]
+            dataObject.isUpDownData = result.isUpDownData
+            self.dataObjects.append(dataObject)
+            self.dataObjectTdmsFile[dataObject] = self.parent().currentTdmsFile
+            self.addDataCurve(dataObject, xCalc, yCalc[row], autoscale = False, color = color)
+
+
+    def newFieldSeries(self, fields, segments, stats = None):
+        """
+        Adds the data of all field segments of a channel to the plot in one
+        batch: the operations specified by the GUI are queued once and run on
+        each segment (reusing the buffers of the intermediate results), the
+        curves (coloured by field) are added without replotting, and the plot
+        is autoscaled and replotted once. The last curve is selected and the
+        memory budget is enforced once after the batch. Segments that fail to
+        process are logged and skipped.
+
+        Parameters
+        --------
+        fields: np.array of the field of each segment
+        segments: list of (x, y) of each segment
+        stats: list of dicts with min, max and mean of y of each segment (or None)
+        """
+        graph = PipelineGraph()
+        for method, suffix in self.symmetrizationBranches():
+            template = DataObject(*segments[0])
+            self.queueOperations(template, symmetrizeMethod = method)
+            graph.add(suffix, template.operations)
+
+        buffers = Buffers()
+        tdmsFile = self.parent().currentTdmsFile
+        curve = None
+        self.plot.setAutoReplot(False)
+        try:
+            for field, (x, y), segmentStats, color in zip(fields, segments, stats or [None]*len(segments), fieldColors(fields)):
+                fieldLabel = "%.2fT"%field
+                try:
+                    results = graph.execute(x, y, segmentStats, buffers)
+                    for suffix, result in results.items():
+                        dataObject = DataObject(x, y,
+                                               label = " ".join(part for part in (fieldLabel, suffix) if part),
+                                               path=self.parent().comboBoxFile.currentText(),
+                                               group = self.parent().groupBox.currentText(),
+                                               paramChannel = self.parent().fieldChannelBox.currentText(),
+                                               param = fieldLabel,
+                                               xChannel = self.parent().xChannelBox.currentText(),
+                                               yChannel = self.parent().yChannelBox.currentText(),
+                                               stats = segmentStats)
+                        dataObject.setOperations(graph.branches[suffix])
+                        dataObject.xCalc, dataObject.yCalc = result.xCalc, result.yCalc
+                        dataObject.isUpDownData = result.isUpDownData
+                        self.dataObjects.append(dataObject)
+                        self.dataObjectTdmsFile[dataObject] = tdmsFile
+                        curve = self.addDataCurve(dataObject, result.xCalc, result.yCalc, autoscale = False, color = color, batch = True)
+                except Exception as e:
+                    l.error(u"Processing the segment at %s failed: %s", fieldLabel, e)
+        finally:
+            self.plot.setAutoReplot(True)
+        if curve is not None:
+            curve.select()
+            self.parent().enforceMemoryBudget()
+        self.plot.do_autoscale(replot = False)
+        self.plot.replot()
+        l.debug("Added %d fields in one batch", len(segments))
+
+
     def calculateResidual(self):
         """
         Calculate the residual of two selected curves and plot
@@ -425,75 +754,159 @@ class plotWidget(QWidget):
     # %% Fitting routines
     def fitCos(self):
         """
-        Fit a cosin^2 to the currently selected curve and plot the resulting fit function
+        Fit a cosin to all selected curves and plot the resulting fit functions
         """
-        if len(self.plot.get_selected_items()) == 0:
-            l.warn("No curve selected to fit.")
-            return False
+        return self.fitSelected("cos")
 
-        curveItem = self.plot.get_selected_items()[0]
-        # get data from curve (this is actually "built-in method x of QwtArrayData object")
-        # and does not have iterators implemented
-        x = np.array(qwtArrayDoubleToList(curveItem.data().xData()))
-        y = np.array(qwtArrayDoubleToList(curveItem.data().yData()))
-
-        # fit using a cosin
-        amplitude, frequency, phase, y0 , yFit= transdat.fitcos(ndarrayToList(np.deg2rad(x)),ndarrayToList(y), fitY0 = True)
-
-        fitCurve = make.curve(ndarrayToList(x),ndarrayToList(yFit),
-                              color='r',
-                              title=u"cosfit(%s)"%curveItem.title().text())
-        fitCurve.select()
-        self.plot.add_item(fitCurve)
-
-        l.info(u"cos fit: amplitude %.3e, frequency %.3e, phase %.3e, offset y0 %.3e"%(amplitude, frequency, phase, y0))
-        label = make.label(u"""<i>cos()-fit (%s)</i><br/>
-            amplitude %.3e<br/>
-            period %.3e°<br/>
-            phase %.3e°<br/>
-            offset y0 %.3e
-            """%(curveItem.title().text(), amplitude, np.rad2deg(2*np.pi/frequency), np.rad2deg(phase), y0),
-            (curveItem.boundingRect().left(), curveItem.boundingRect().top()),(0.1,0.1),
-            "BL",
-            title = u"cos(%s)"%curveItem.title().text())
-        self.plot.add_item(label)
-        self.plot.replot()
-        self.plot.do_autoscale()
 
+    def fitCosSq(self):
+        """
+        Fit a cosin^2 to all selected curves and plot the resulting fit functions
+        """
+        return self.fitSelected("cos2")
 
 
-    def fitCosSq(self):
+    def fitSelected(self, kind):
         """
-        Fit a cosin to the currently selected curve and plot the resulting fit function
+        Fit all selected curves concurrently in a worker pool (see
+        lib.batchfit). The fit curves are added by fitsFinished() when all
+        fits are done.
+
+        Parameters
+        ----------
+        kind : str
+            "cos" or "cos2"
         """
-        if len(self.plot.get_selected_items()) == 0:
+        curveItems = [item for item in self.plot.get_selected_items() if hasattr(item, "data")]
+        if len(curveItems) == 0:
             l.warn("No curve selected to fit.")
             return False
 
-        curveItem = self.plot.get_selected_items()[0]
+        curves = []
+        for n, curveItem in enumerate(curveItems):
+            # get data from curve (this is actually "built-in method x of QwtArrayData object")
+            # and does not have iterators implemented
+            x = np.array(qwtArrayDoubleToList(curveItem.data().xData()))
+            y = np.array(qwtArrayDoubleToList(curveItem.data().yData()))
+            curves.append((n, x, y))
+
+        l.info(u"Fitting %d curve(s)", len(curves))
+        if self.fitPool is None:
+            self.fitPool = batchfit.createPool()
+        batchfit.fitCurves(curves,
+                           lambda results: self.emit(SIGNAL("fitsFinished(PyQt_PyObject, PyQt_PyObject, PyQt_PyObject)"),
+                                                     kind, curveItems, results),
+                           kind = kind, pool = self.fitPool)
+        return True
+
+
+    def closeFitPool(self):
+        """
+        Stop the worker processes of the batch fits
+        """
+        if self.fitPool is not None:
+            self.fitPool.terminate()
+            self.fitPool = None
 
-        x = np.array(qwtArrayDoubleToList(curveItem.data().xData()))
-        y = np.array(qwtArrayDoubleToList(curveItem.data().yData()))
 
-        # fit using a cosin
-        amplitude, frequency, phase, y0 , yFit= transdat.fitcos_squared(ndarrayToList(np.deg2rad(x)),ndarrayToList(y), fitY0 = True)
+    def fitsFinished(self, kind, curveItems, results):
+        """
+        Add fit curves and labels of all fitted curves in one replot and fill
+        the fit results table
+        """
+        name = {"cos": u"cos", "cos2": u"cos²"}[kind]
+        rows = []
+        self.plot.setAutoReplot(False)
+        try:
+            for key, result, error, duration in results:
+                curveItem = curveItems[key]
+                title = curveItem.title().text()
+                if error is not None:
+                    l.error(u"%s fit of %s failed: %s", name, title, error)
+                    continue
+                amplitude, frequency, phase, y0, yFit = result
+                x = np.array(qwtArrayDoubleToList(curveItem.data().xData()))
+
+                self.plot.add_item(make.curve(ndarrayToList(x), ndarrayToList(yFit),
+                                              color='r',
+                                              title=u"%sfit(%s)"%(name, title)))
+
+                l.info(u"%s fit of %s: amplitude %.3e, frequency %.3e, phase %.3e, offset y0 %.3e", name, title, amplitude, frequency, phase, y0)
+                label = make.label(u"""<i>%s()-fit (%s)</i><br/>
+                    amplitude %.3e<br/>
+                    period %.3e°<br/>
+                    phase %.3e°<br/>
+                    offset y0 %.3e
+                    """%(name, title, amplitude, np.rad2deg(2*np.pi/frequency), np.rad2deg(phase), y0),
+                    (curveItem.boundingRect().left(), curveItem.boundingRect().top()),(0.1,0.1),
+                    "BL",
+                    title = u"%s(%s)"%(name, title))
+                self.plot.add_item(label)
+                rows.append((title, batchfit.resultRow(self.curveField(curveItem), result)))
+        finally:
+            self.plot.setAutoReplot(True)
+        self.plot.do_autoscale(replot = False)
+        self.plot.replot()
+        self.showFitResults(name, rows)
 
-        self.plot.add_item(make.curve(ndarrayToList(x),ndarrayToList(yFit),
-                                      color='r',
-                                      title=u"cos²fit(%s)"%curveItem.title().text()))
 
-        label = make.label(u"""<i>cos²()-fit (%s)</i><br/>
-            amplitude %.3e<br/>
-            frequency %.3e°<br/>
-            phase %.3e°<br/>
-            offset y0 %.3e
-            """%(curveItem.title().text(), amplitude, np.rad2deg(2*np.pi/frequency), np.rad2deg(phase), y0),
-            (curveItem.boundingRect().left(), curveItem.boundingRect().top()),(0.1,0.1),
-            "BL",
-            title = u"cos²(%s)"%curveItem.title().text())
-        self.plot.add_item(label)
-        self.plot.replot()
-        self.plot.do_autoscale()
+    def curveField(self, curveItem):
+        """
+        Field (parameter) value of the data object plotted as curveItem (NaN
+        if unknown)
+        """
+        dataObject = self.curveDataObjects.get(curveItem)
+        if dataObject is not None:
+            match = re.match(r"\s*([-+]?[0-9.]+(?:[eE][-+]?[0-9]+)?)", unicode(dataObject.param or ""))
+            if match:
+                return float(match.group(1))
+        return np.nan
+
+
+    def showFitResults(self, name, rows):
+        """
+        Show the results of the last batch fit in the fit results table
+        """
+        order = np.argsort([row[0] for title, row in rows], kind = "mergesort") # as in resultsTable()
+        titles = [rows[i][0] for i in order]
+        self.fitResults = batchfit.resultsTable([row for title, row in rows])
+        self.fitResultsName = name
+
+        table = self.fitResultsWidget.table
+        columns = [column for column, dtype in batchfit.RESULT_DTYPE]
+        table.clear()
+        table.setColumnCount(len(columns) + 1)
+        table.setRowCount(len(self.fitResults))
+        table.setHorizontalHeaderLabels([u"curve"] + columns)
+        for i, row in enumerate(self.fitResults):
+            table.setItem(i, 0, QTableWidgetItem(titles[i]))
+            for j, column in enumerate(columns):
+                table.setItem(i, j + 1, QTableWidgetItem(u"%.6g"%row[column]))
+        table.resizeColumnsToContents()
+        self.fitResultsWidget.setWindowTitle(u"%s fit results"%name)
+        self.showFitResultsWidget()
+
+
+    def showFitResultsWidget(self):
+        """
+        Show the window with the fit results table
+        """
+        self.fitResultsWidget.show()
+        self.fitResultsWidget.raise_()
+
+
+    def exportFitResults(self):
+        """
+        Save the fit results table as ascii
+        """
+        if self.fitResults is None or not len(self.fitResults):
+            l.warn("No fit results to export.")
+            return
+        fname = QFileDialog.getSaveFileName(self, u"Choose file to save", u"fitresults.dat", u"ASCII data file (*.dat);;All files (*.*)")
+        if not fname:
+            return
+        batchfit.saveResultsTable(unicode(fname), self.fitResults, comment = u"%s fit results"%self.fitResultsName)
+        l.info(u"Saved fit results to %s", fname)
 
 
 
@@ -539,10 +952,25 @@ class previewTransportDataWindow(QWidget):
         self.yChannelBox.setMinimumWidth(250)
         self.yChannelBox.addItem("Y-Channel")
         self.yChannelBox.setDisabled(1)
+        self.lineEditYChannels = QLineEdit()
+        self.lineEditYChannels.setMinimumWidth(250)
+        self.lineEditYChannels.setToolTip(u"Further y-channels processed together with the selected one\n"
+                                          u"(comma separated, wildcards allowed, e.g. Lockin*)")
         buttonFile = QPushButton(u"Select File")
         buttonFile.setMaximumWidth(100)
+        self.buttonCache = QPushButton(u"Cache File")
+        self.buttonCache.setMaximumWidth(100)
+        self.buttonCache.setToolTip(u"Convert the current file to memory-mapped .npy files for instant loading")
+        self.buttonCache.setEnabled(False)
         self.buttonPlot = QPushButton(u"Plot")
         self.buttonPlot.setMaximumWidth(100)
+        self.buttonPlotAll = QPushButton(u"Plot all fields")
+        self.buttonPlotAll.setMaximumWidth(100)
+        self.buttonPlotAll.setToolTip(u"Plot the selected channel of every field with the current operations")
+        self.buttonOverview = QPushButton(u"Overview")
+        self.buttonOverview.setMaximumWidth(100)
+        self.buttonOverview.setToolTip(u"Thumbnails of all channels of the current file")
+        self.buttonOverview.setEnabled(False)
         self.statusDisplay = QTextEdit()
         self.statusDisplay.setReadOnly(1)
         self.statusDisplay.setMinimumHeight(80)
@@ -550,30 +978,65 @@ class previewTransportDataWindow(QWidget):
 
         # Connect SIGNALs
         self.connect(buttonFile, SIGNAL('clicked()'), self.chooseFile)
+        self.connect(self.buttonCache, SIGNAL('clicked()'), self.cacheFile)
         self.connect(self.buttonPlot, SIGNAL('clicked()'), self.plot)
+        self.connect(self.buttonPlotAll, SIGNAL('clicked()'), self.plotAllFields)
+        self.connect(self.buttonOverview, SIGNAL('clicked()'), self.showOverview)
+        self.connect(self, SIGNAL("thumbnailReady(PyQt_PyObject, PyQt_PyObject, PyQt_PyObject, PyQt_PyObject, PyQt_PyObject)"),
+                     self.thumbnailReady, Qt.QueuedConnection)
+        self.connect(self, SIGNAL("fileLoaded(PyQt_PyObject, PyQt_PyObject, PyQt_PyObject, PyQt_PyObject)"),
+                     self.fileLoaded, Qt.QueuedConnection)
 
         # Build Layout
-        layout.addWidget(self.comboBoxFile,0,0,1,5)
+        layout.addWidget(self.comboBoxFile,0,0,1,3)
+        layout.addWidget(self.buttonOverview,0,3)
+        layout.addWidget(self.buttonCache,0,4)
         layout.addWidget(buttonFile,0,5)
         layout.addWidget(self.groupBox,1,0)
         layout.addWidget(self.fieldChannelBox,1,1)
         layout.addWidget(self.fieldBox,1,2)
         layout.addWidget(self.xChannelBox,1,3)
-        layout.addWidget(self.yChannelBox,1,4)
-        layout.addWidget(self.buttonPlot,1,5)
+        yChannelLayout = QVBoxLayout()
+        yChannelLayout.addWidget(self.yChannelBox)
+        yChannelLayout.addWidget(self.lineEditYChannels)
+        layout.addLayout(yChannelLayout,1,4)
+        plotLayout = QVBoxLayout()
+        plotLayout.addWidget(self.buttonPlot)
+        plotLayout.addWidget(self.buttonPlotAll)
+        layout.addLayout(plotLayout,1,5)
         layout.columnStretch(5)
         layout.addWidget(self.statusDisplay,3,0,1,6)
         # Initialize store for TDMSfiles
         self.groupList = []
         self.ChannelList = []
 
-        self.tdmsFiles = []     # holds all tdms files loaded in this session
+        self.tdmsFiles = []     # holds the index (lib.tdmsindex.TdmsIndex) of all
+                                # tdms files loaded in this session
         self.currentTdmsFile = None
+        self.query = TransportQuery() # segment lookup in the loaded files
+        self.memory = MemoryManager() # budget for the loaded files and plotted data (lib/memory.py)
+        self.filesPending = 0   # number of files still being loaded
+        self.filesRequested = 0 # number of files in the current loading run
+        self.lastLoaded = None  # index of the last file loaded in the current loading run
+        self.loaderPool = None
+
+        # Overview of all channels of the current file (separate window)
+        self.overviewWidget = QListWidget()
+        self.overviewWidget.setWindowTitle(u"Overview")
+        self.overviewWidget.setViewMode(QListView.IconMode)
+        self.overviewWidget.setResizeMode(QListView.Adjust)
+        self.overviewWidget.setIconSize(QSize(160, 60))
+        self.overviewWidget.resize(800, 600)
+        self.connect(self.overviewWidget, SIGNAL('itemDoubleClicked(QListWidgetItem*)'), self.selectOverviewChannel)
+        self.thumbnails = {}        # filename -> OrderedDict of (group, channel) -> QPixmap
+        self.thumbnailsDone = set() # files all thumbnails have been generated of
+        self.thumbnailGenerator = None
 
         # Initialize plot widget
         self.widget = plotWidget(self)
         self.layout().addWidget(self.widget,2,0,1,6)
         self.buttonPlot.setEnabled(False)
+        self.buttonPlotAll.setEnabled(False)
 
         # Debuglevel for output in status display
         self.debugLevel = logging.DEBUG
@@ -581,6 +1044,8 @@ class previewTransportDataWindow(QWidget):
         # Initialize Handler to write logging output to statusDisplay
         self.widgetLogger = widgetLogger(self.statusDisplay,self.debugLevel)
         l.addHandler(self.widgetLogger)
+        # messages of lib (at the level set by lib.setLogLevel())
+        logging.getLogger("lib").addHandler(self.widgetLogger)
 
     def chooseFile(self):
         """
@@ -598,26 +1063,80 @@ class previewTransportDataWindow(QWidget):
     def addFiles(self, filenames):
         """
         Load and add to the lists all the files contained in filenames
+
+        Files are opened concurrently in a thread pool and added to
+        self.comboBoxFile one by one as soon as they are loaded.
         """
-        print(filenames)
-        firstFile = self.comboBoxFile.count() <= 1
-        for filename in enumerate(filenames):
-            # Catch error in opening file  ~ TODO ~ could specify error?
-            try:
-                self.tdmsFiles.append(nptdms.TdmsFile(str(filename[1])))
-            except:
-                l.error(u"Error opening file")
-                return
-
-            self.comboBoxFile.addItem(filename[1])
+        filenames = [unicode(filename) for filename in filenames]
+        if not filenames:
+            return
+        l.info(u"Loading %d file(s)", len(filenames))
+        self.filesPending += len(filenames)
+        self.filesRequested += len(filenames)
+        self.loaderPool = fileloader.loadFiles(filenames, self.emitFileLoaded,
+                                               loader = tdmsindex.openTdmsIndex)
+
+    def emitFileLoaded(self, filename, tdmsFile, error, duration):
+        """
+        Hand a loaded file from the loader thread to the GUI thread
+        """
+        self.emit(SIGNAL("fileLoaded(PyQt_PyObject, PyQt_PyObject, PyQt_PyObject, PyQt_PyObject)"),
+                  filename, tdmsFile, error, duration)
+
+    def fileLoaded(self, filename, tdmsFile, error, duration):
+        """
+        Add a file loaded by addFiles() to self.tdmsFiles and self.comboBoxFile
+        (or report the error if it could not be opened). When all files of
+        the loading run are loaded, the last one becomes the current file.
+        """
+        self.filesPending -= 1
+        progress = self.filesRequested - self.filesPending
+        if error is not None:
+            l.error(u"Error opening file (%d/%d) %s: %s", progress, self.filesRequested, filename, error)
+        else:
+            l.info(u"Loaded file (%d/%d) %s in %.2fs", progress, self.filesRequested, filename, duration)
+            self.tdmsFiles.append(tdmsFile)
+            self.query.addIndex(tdmsFile)
+            self.memory.track(tdmsFile, u"file %s"%filename)
+            self.enforceMemoryBudget()
+            self.comboBoxFile.addItem(filename)
+            self.lastLoaded = self.comboBoxFile.count() - 1
             self.comboBoxFile.setEnabled(1)
+            self.buttonCache.setEnabled(1)
+            self.buttonOverview.setEnabled(1)
 
-            self.comboBoxFile.setCurrentIndex(self.comboBoxFile.count()-1)
+            # First tdms file that's loaded, so connect signal to combobox now
+            if len(self.tdmsFiles) == 1:
+                self.setCurrentTdmsFile(0)
+                self.comboBoxFile.currentIndexChanged['int'].connect(self.setCurrentTdmsFile)
 
-        # First tdms file that's loaded, so connect signal to combobox now
-        if firstFile:
-            self.setCurrentTdmsFile(0)
-            self.comboBoxFile.currentIndexChanged['int'].connect(self.setCurrentTdmsFile)
+        if not self.filesPending:
+            self.filesRequested = 0
+            if self.lastLoaded is not None and self.lastLoaded != self.comboBoxFile.currentIndex():
+                # setCurrentTdmsFile() is called by currentIndexChanged
+                self.comboBoxFile.setCurrentIndex(self.lastLoaded)
+            self.lastLoaded = None
+
+
+    def cacheFile(self):
+        """
+        Convert the current TDMS file to a .npy cache (in the background) so
+        that it opens instantly the next time
+        """
+        index = self.currentTdmsFile
+        if npycache.isCacheValid(index.filename):
+            l.info(u"%s is already cached", index.filename)
+            return
+
+        def cached(filename, directory, error, duration):
+            if error is not None:
+                l.error(u"Error caching %s: %s", filename, error)
+            else:
+                l.info(u"Cached %s in %s (%.2fs)", filename, directory, duration)
+
+        l.info(u"Caching %s", index.filename)
+        self.cachePool = fileloader.loadFiles([index.filename], cached,
+                                              loader = lambda filename: npycache.convertTdmsToNpy(filename, index = index))
 
 
     def setCurrentTdmsFile(self,index):
@@ -625,10 +1144,90 @@ class previewTransportDataWindow(QWidget):
         Set the Tdms file in self.tdmsFiles at the specified index to be
         the currently used one and fill group and channel boxes appropriately)
         """
-        l.debug("Setting current TDMS file to id %d of %d"%(index, len(self.tdmsFiles)))
+        l.debug("Setting current TDMS file to id %d of %d", index, len(self.tdmsFiles))
         self.comboBoxFile.setCurrentIndex(index)
         self.currentTdmsFile = self.tdmsFiles[index]
+        self.memory.touch(self.currentTdmsFile)
         self.fillGroupBox(0)
+        if self.overviewWidget.isVisible():
+            self.showOverview()
+
+
+    def showOverview(self):
+        """
+        Show the thumbnails of all channels of the current file. Missing
+        thumbnails are generated in the background and added as they are ready.
+        """
+        filename = self.currentTdmsFile.filename
+        self.overviewWidget.clear()
+        self.overviewWidget.setWindowTitle(u"Overview of %s"%os.path.basename(filename))
+        self.overviewWidget.show()
+        self.overviewWidget.raise_()
+        for (group, channel), pixmap in self.thumbnails.get(filename, {}).items():
+            self.addOverviewItem(group, channel, pixmap)
+
+        if filename in self.thumbnailsDone:
+            return
+        if self.thumbnailGenerator is not None:
+            if self.thumbnailGenerator.index is self.currentTdmsFile:
+                return # still generating, the remaining thumbnails are added as they are ready
+            self.thumbnailGenerator.stop(timeout = 0)
+        self.thumbnailGenerator = ThumbnailGenerator(self.currentTdmsFile,
+                                                     lambda group, channel, x, y: self.emitThumbnailReady(filename, group, channel, x, y),
+                                                     done = lambda thumbnails: self.thumbnailsDone.add(filename))
+        self.thumbnailGenerator.start()
+
+
+    def emitThumbnailReady(self, filename, group, channel, x, y):
+        """
+        Hand a thumbnail from the generator thread to the GUI thread
+        """
+        self.emit(SIGNAL("thumbnailReady(PyQt_PyObject, PyQt_PyObject, PyQt_PyObject, PyQt_PyObject, PyQt_PyObject)"),
+                  filename, group, channel, x, y)
+
+
+    def thumbnailReady(self, filename, group, channel, x, y):
+        """
+        Add a thumbnail generated in the background to the overview
+        """
+        pixmaps = self.thumbnails.setdefault(filename, OrderedDict())
+        known = (group, channel) in pixmaps
+        pixmaps[(group, channel)] = thumbnailPixmap(x, y)
+        if not known and self.currentTdmsFile is not None and filename == self.currentTdmsFile.filename:
+            self.addOverviewItem(group, channel, pixmaps[(group, channel)])
+
+
+    def addOverviewItem(self, group, channel, pixmap):
+        """
+        Add a thumbnail to the overview
+        """
+        item = QListWidgetItem(QIcon(pixmap), channel)
+        item.setToolTip(u"%s/%s"%(group, channel))
+        item.setData(Qt.UserRole, (group, channel))
+        self.overviewWidget.addItem(item)
+
+
+    def selectOverviewChannel(self, item):
+        """
+        Select the group and y-channel of a thumbnail that has been double clicked
+        """
+        group, channel = item.data(Qt.UserRole).toPyObject()
+        groupIndex = self.groupBox.findText(group)
+        if groupIndex < 0:
+            return
+        self.groupBox.setCurrentIndex(groupIndex)
+        self.fillChannelBoxes(groupIndex)
+        self.yChannelBox.setCurrentIndex(self.yChannelBox.findText(channel))
+
+
+    def enforceMemoryBudget(self):
+        """
+        Release the data of the least recently used files and data objects
+        if the memory budget is exceeded (the current ones are kept)
+        """
+        released = self.memory.enforce(protect = [self.currentTdmsFile, self.widget.currentDataObject])
+        if released:
+            l.info(u"Released the data of %d file(s)/curve(s) to stay within the memory budget", len(released))
 
 
     def resetChannelBoxes(self):
@@ -654,11 +1253,9 @@ class previewTransportDataWindow(QWidget):
         selectedGroupChannel = self.groupBox.currentIndex()
 
         self.groupBox.clear()
-        for group in self.currentTdmsFile.groups():
-            if group.startswith("Read."):
-                self.groupBox.addItem(group)
+        self.groupBox.addItems(self.currentTdmsFile.groupNames("Read."))
         self.groupBox.setEnabled(1)
-        l.debug("Filled group combo box with %d groups from %s"%(self.groupBox.count(),str(self.currentTdmsFile.groups())))
+        l.debug("Filled group combo box with %d groups from %s", self.groupBox.count(), self.currentTdmsFile.groupNames())
 
         # recall selected group
         self.groupBox.setCurrentIndex(selectedGroupChannel)
@@ -677,8 +1274,8 @@ class previewTransportDataWindow(QWidget):
         index: int
             unused, for compatibility with signals
         """
-        l.debug("index %i" %index)
-        self.channelList = self.currentTdmsFile.group_channels(str(self.groupBox.currentText()))
+        l.debug("index %i", index)
+        channelNames = self.currentTdmsFile.channelNames(unicode(self.groupBox.currentText()))
 
         # Store currently selected channels
         selectedFieldChannel = self.fieldChannelBox.currentIndex()
@@ -689,16 +1286,16 @@ class previewTransportDataWindow(QWidget):
         self.resetChannelBoxes()
 
         # Fill with new channels
-        for channel in self.channelList:
-            self.fieldChannelBox.addItem(re.search(r"'/'(.+)'",channel.path).group(1))
-            self.xChannelBox.addItem(re.search(r"'/'(.+)'",channel.path).group(1))
-            self.yChannelBox.addItem(re.search(r"'/'(.+)'",channel.path).group(1))
+        self.fieldChannelBox.addItems(channelNames)
+        self.xChannelBox.addItems(channelNames)
+        self.yChannelBox.addItems(channelNames)
 
         # Enable boxes
         self.fieldChannelBox.setEnabled(1)
         self.xChannelBox.setEnabled(1)
         self.yChannelBox.setEnabled(1)
         self.buttonPlot.setEnabled(1)
+        self.buttonPlotAll.setEnabled(1)
 
         # Recalculate available fields when changing the field channel
         self.fieldChannelBox.activated['int'].connect(self.fillFieldBox)
@@ -713,6 +1310,15 @@ class previewTransportDataWindow(QWidget):
         self.fillFieldBox(self.fieldChannelBox.currentIndex())
 
 
+    def currentSegmentIndex(self):
+        """
+        SegmentIndex of the field channel selected in self.fieldChannelBox
+        """
+        return self.query.segmentIndex(self.currentTdmsFile.filename,
+                                       unicode(self.groupBox.currentText()),
+                                       unicode(self.fieldChannelBox.currentText()))
+
+
     def fillFieldBox(self,index):
         """
         Populate field combo box with unique fields from channel selected in
@@ -724,10 +1330,9 @@ class previewTransportDataWindow(QWidget):
             self.fieldBox.setDisabled(1)
             return
 
-        # Get unique fields and sort by index (thus by order of measurement)
-        fields, uniqueFieldStartIdx = np.unique(self.channelList[self.fieldChannelBox.currentIndex()-1].data, return_index=True)
-        fields = fields[np.argsort(uniqueFieldStartIdx)]
-        l.debug("Found %d fields in channel %s: "%(np.size(fields), str(self.fieldChannelBox.currentText())))
+        # Get unique fields sorted by index (thus by order of measurement)
+        fields = self.currentSegmentIndex().fields
+        l.debug("Found %d fields in channel %s: ", np.size(fields), self.fieldChannelBox.currentText())
 
         # Populate combo box
         self.fieldBox.clear()
@@ -737,30 +1342,99 @@ class previewTransportDataWindow(QWidget):
         self.fieldBox.setEnabled(1)
 
 
+    def selectedYChannels(self):
+        """
+        Names of the y-channel selected in self.yChannelBox and of the channels
+        matching the patterns in self.lineEditYChannels
+        """
+        channelNames = self.currentTdmsFile.channelNames(unicode(self.groupBox.currentText()))
+        yChannels = [unicode(self.yChannelBox.currentText())]
+        for pattern in unicode(self.lineEditYChannels.text()).split(","):
+            pattern = pattern.strip()
+            if not pattern:
+                continue
+            matches = fnmatch.filter(channelNames, pattern)
+            if not matches:
+                l.warn("No channel matches %s", pattern)
+            yChannels.extend(name for name in matches if name not in yChannels)
+        return yChannels
+
+
+    def plotChannels(self, yChannels):
+        """
+        Hands the data of several y-channels to the plotWidget(), the segment
+        is looked up once for all channels
+        """
+        filename = self.currentTdmsFile.filename
+        group = unicode(self.groupBox.currentText())
+        xChannel = unicode(self.xChannelBox.currentText())
+
+        if self.fieldChannelBox.currentIndex() > 0:
+            number = self.fieldBox.currentIndex()
+            fieldLabel = "%.2fT"%self.currentSegmentIndex().fields[number]
+            x, y = self.query.segmentChannels(filename, group, xChannel, yChannels,
+                                              unicode(self.fieldChannelBox.currentText()), number = number)
+        else:
+            fieldLabel = None
+            x, y = self.query.segmentChannels(filename, group, xChannel, yChannels)
+
+        l.debug("Adding data of %d channels with label \"%s\", len(x) = %d.", len(yChannels), fieldLabel, len(x))
+        self.widget.newChannelData(x, y, yChannels, label = fieldLabel)
+
+
     def plot(self):
         """
         Hands new data to the plotWidget() to be displayed (or to be appended to the display)
 
         """
-        rawX = self.channelList[self.xChannelBox.currentIndex()].data
-        rawY = self.channelList[self.yChannelBox.currentIndex()].data
+        filename = self.currentTdmsFile.filename
+        group = unicode(self.groupBox.currentText())
+        xChannel = unicode(self.xChannelBox.currentText())
+        yChannel = unicode(self.yChannelBox.currentText())
+
+        yChannels = self.selectedYChannels()
+        if len(yChannels) > 1:
+            self.plotChannels(yChannels)
+            return
 
         if self.fieldChannelBox.currentIndex() > 0:
-            rawField = self.channelList[self.fieldChannelBox.currentIndex()-1].data
-
-            dataStruct = transdat.preprocessTransportData(rawField, rawX, rawY,delta_method = False)
-
-            fieldLabel = "%.2fT"%dataStruct[self.fieldBox.currentIndex()]["field"]
-            x = dataStruct[self.fieldBox.currentIndex()-1]["angle"]
-            y = dataStruct[self.fieldBox.currentIndex()-1]["signal"]
+            # entries of the field box are the segments in order of measurement
+            number = self.fieldBox.currentIndex()
+            fieldLabel = "%.2fT"%self.currentSegmentIndex().fields[number]
+            x, y = self.query.segment(filename, group, xChannel, yChannel,
+                                      unicode(self.fieldChannelBox.currentText()), number = number)
+            stats = self.query.segmentStats(filename, group, yChannel,
+                                            unicode(self.fieldChannelBox.currentText()), number = number)
         else:
             fieldLabel = None
-            x = rawX
-            y = rawY
+            x, y = self.query.segment(filename, group, xChannel, yChannel)
+            stats = self.query.segmentStats(filename, group, yChannel)
+
+        l.debug("Adding data with label \"%s\", len(x) = %d, len(y) = %d.", fieldLabel, len(x), len(y))
 
-        l.debug("Adding data with label \"%s\", len(x) = %d, len(y) = %d."%(str(fieldLabel), len(x), len(y)))
+        self.widget.newData(x,y, label = fieldLabel, stats = stats)
 
-        self.widget.newData(x,y, label = fieldLabel)
+
+    def plotAllFields(self):
+        """
+        Hands the data of the selected channel of all fields to the
+        plotWidget(), the segments are looked up in one pass
+        """
+        if self.fieldChannelBox.currentIndex() <= 0:
+            l.warn("Select a field channel to plot all fields.")
+            return
+        filename = self.currentTdmsFile.filename
+        group = unicode(self.groupBox.currentText())
+        xChannel = unicode(self.xChannelBox.currentText())
+        yChannel = unicode(self.yChannelBox.currentText())
+
+        fields, segments, stats = self.query.allSegments(filename, group, xChannel, yChannel,
+                                                         unicode(self.fieldChannelBox.currentText()))
+        if not len(segments):
+            l.warn("No fields found in channel %s.", self.fieldChannelBox.currentText())
+            return
+        l.debug("Adding data of %d fields.", len(segments))
+        self.widget.newFieldSeries(fields, segments, stats)
 
 
 def previewTransportData(initial_filenames=None):
@@ -777,6 +1451,8 @@ def previewTransportData(initial_filenames=None):
 
     win.show()
     _app.exec_()
+    win.widget.closeFitPool()
+    win.memory.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Watch a directory and precompute the cache of new TDMS files (see lib/watcher.py)
+
+Usage:
+    python watchDirectory.py DIR [--settle 10] [--field-channel NAME ...]
+                                 [--pipeline GROUP X Y FIELDCHANNEL OPS ...]
+
+OPS is a JSON list of [operation, parameters], e.g. '[["deltaMethod", {"method": 3}]]'
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+import lib
+from lib.watcher import DirectoryWatcher
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.split("\n\n")[0])
+    parser.add_argument("directory", help = "directory to watch")
+    parser.add_argument("--pattern", default = "*.tdms", help = "files to ingest")
+    parser.add_argument("--interval", type = float, default = 2., help = "seconds between scans")
+    parser.add_argument("--settle", type = float, default = 10., help = "seconds a file must stay unchanged before it is ingested")
+    parser.add_argument("--field-channel", action = "append", dest = "fieldChannels",
+                        help = "field channel to segment (default: detect field channels)")
+    parser.add_argument("--pipeline", nargs = 5, action = "append", default = [],
+                        metavar = ("GROUP", "X", "Y", "FIELDCHANNEL", "OPS"), help = "processing to precompute")
+    args = parser.parse_args()
+
+    logging.basicConfig()
+    lib.setLogLevel(os.environ.get("PREVIEWTRANSPORTDATA_LOGLEVEL", "INFO"))
+
+    pipelines = [{"group": group, "x": x, "y": y, "fieldChannel": fieldChannel, "ops": json.loads(ops)}
+                 for group, x, y, fieldChannel, ops in args.pipeline]
+    watcher = DirectoryWatcher(args.directory, pattern = args.pattern, interval = args.interval,
+                               settle = args.settle, fieldChannels = args.fieldChannels, pipelines = pipelines)
+    watcher.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        watcher.stop()